@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import numpy as np
+import tifffile
+from skimage import measure
+from concurrent.futures import ProcessPoolExecutor
+from microglia import analyze_volume_array, skeleton_measurements
+from TiledFields import open_field, label_field
+from ResultsWriter import ID_COLUMNS, SKELETON_COLUMNS, add_results_arguments, results_path, open_results_writer, finish_results
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from CommandLine import ask_value, ask_directory
+
+
+def crop_cell_volume(volume, region):
+    # Crop the bounding box of one cell (plus one background voxel on every side, so that the
+    # skeleton can reach the border) and keep only that cell, not the pieces of its neighbours
+    ndim = volume.ndim
+    start = [max(0, value - 1) for value in region.bbox[:ndim]]
+    stop = [min(size, value + 1) for size, value in zip(volume.shape, region.bbox[ndim:])]
+    crop = np.asarray(volume[tuple(slice(first, last) for first, last in zip(start, stop))])
+
+    # The cell is the object of the crop with the area and bounding box of the region
+    crop_labels = measure.label(crop)
+    bbox = tuple(value - offset for value, offset in zip(region.bbox, start + start))
+    for crop_region in measure.regionprops(crop_labels):
+        if crop_region.area == region.area and crop_region.bbox == bbox:
+            return crop_labels == crop_region.label
+
+    raise ValueError(f'Cell {region.label} not found in its bounding box')
+
+
+def process_cell_volume(cell_task):
+    # Analyze one cell of a z-stack (runs inside a worker process in parallel mode).
+    # Workers open the memory-mapped stack themselves and read only the bounding box of their cell
+    image_path, region, cell_id, output_folder_skeletons = cell_task
+
+    with stage('decode', cell_id):
+        cell_volume = crop_cell_volume(open_field(image_path), region)
+
+    result, num_ramifications, graph = analyze_volume_array(cell_volume, cell_id)
+
+    if output_folder_skeletons:
+        with stage('write_images', cell_id):
+            tifffile.imwrite(os.path.join(output_folder_skeletons, f'Skeletonize_{cell_id}.tif'),
+                             result.skeleton.astype(np.uint8) * 255, imagej=True, metadata={'axes': 'ZYX'})
+
+    return [cell_id] + skeleton_measurements(result, num_ramifications, graph)
+
+
+def collect_volume_tasks(input_folder, min_cell_volume=1000, slab_planes=16, output_folder_skeletons=None):
+    # Label every binary z-stack in slabs of planes and list one task per selected cell
+    cell_tasks = []
+    for filename in sorted(os.listdir(input_folder)):
+        if filename.endswith('.tif') or filename.endswith('.tiff'):
+            image_path = os.path.join(input_folder, filename)
+            volume = open_field(image_path)
+            if volume.ndim != 3:
+                print(f"Skipping {filename}: not a single channel z-stack")
+                continue
+
+            with stage('label', filename):
+                _, filtered_regions = label_field(volume, min_cell_volume, slab_planes)
+            for idx, region in enumerate(filtered_regions):
+                cell_tasks.append((image_path, region, f'{filename}_cell_{idx + 1}', output_folder_skeletons))
+
+    return cell_tasks
+
+
+def process_cell_volumes(cell_tasks, workers=1, trace_path=None):
+    # Analyze the cells serially or fan them out across a process pool, in the order of cell_tasks
+    if workers <= 1:
+        for cell_task in cell_tasks:
+            yield process_cell_volume(cell_task)
+        return
+
+    chunksize = max(1, len(cell_tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_tracing, initargs=(trace_path,)) as executor:
+        yield from executor.map(process_cell_volume, cell_tasks, chunksize=chunksize)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Skeletonize every cell of the thresholded z-stack TIFFs in a folder in 3D (26-connectivity).')
+    parser.add_argument('input_folder', nargs='?', help='Folder with the thresholded z-stack TIFFs (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region written to the results (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group written to the results (asked when omitted)')
+    parser.add_argument('--output-folder', help='Folder for the results table and skeletons (default: the input folder)')
+    parser.add_argument('--min-cell-volume', type=int, default=1000, help='Minimum volume in voxels of a selected cell (default: 1000)')
+    parser.add_argument('--slab-planes', type=int, default=16, help='Planes labeled at once; bounds the memory used by labeling (default: 16)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (default: 1)')
+    parser.add_argument('--save-skeletons', action='store_true', help='Also save the skeleton of every cell as a TIFF stack')
+    add_results_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_tracing(args.trace, new_trace=True)
+
+    # Get the region and group from the command line or the user
+    region = ask_value(args.region, "Enter the region: ")
+    group = ask_value(args.group, "Enter the group: ")
+
+    # Get the folder with the thresholded z-stacks
+    input_folder = ask_directory(args.input_folder, "Select Input Folder")
+
+    if input_folder:
+        output_folder = args.output_folder or input_folder
+        os.makedirs(output_folder, exist_ok=True)
+
+        output_folder_skeletons = None
+        if args.save_skeletons:
+            output_folder_skeletons = os.path.join(output_folder, f'Analyze Skeleton 3D {group} {region}')
+            os.makedirs(output_folder_skeletons, exist_ok=True)
+
+        cell_tasks = collect_volume_tasks(input_folder, args.min_cell_volume, args.slab_planes, output_folder_skeletons)
+
+        # Stream the measurements into the results table as the cells finish
+        output_path = results_path(output_folder, f'Analyze_Skeleton_3D_{region}_{group}', args.output_format)
+        with open_results_writer(output_path, ID_COLUMNS + SKELETON_COLUMNS, args.output_format) as writer:
+            for result in process_cell_volumes(cell_tasks, args.workers, args.trace):
+                writer.write_row([result[0], region, group] + result[1:])
+
+        output_path = finish_results(output_path, args.output_format, args.excel)
+        print(f"3D Skeleton Analysis saved to {output_path}")
+
+    finish_tracing(args.trace)
+
+
+if __name__ == '__main__':
+    main()
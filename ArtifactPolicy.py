@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import os
+import cv2
+import numpy as np
+from AsyncImageIO import write_image
+from Sharding import shard_name
+
+
+# Which output images a run writes:
+#   none     no images, only the results tables
+#   summary  only the images of whole fields (selection mask, numbered overview, field soma and skeleton)
+#   sampled  the summary images plus the cell images of one cell in --artifact-sample
+#   flagged  the summary images plus the cell images of the flagged cells (see flag_cell)
+#   all      every image (the default of the staged scripts)
+ARTIFACT_POLICIES = ['none', 'summary', 'sampled', 'flagged', 'all']
+
+
+class ArtifactPolicy:
+    # Artifact policy of a run. Plain attributes only, so that it can be sent to worker processes
+
+    def __init__(self, policy='all', sample_every=10, archive=False, shard=None):
+        self.policy = policy
+        self.sample_every = sample_every
+        self.archive = archive
+        self.shard = shard
+
+    def summary(self):
+        # Write the images of whole fields
+        return self.policy != 'none'
+
+    def cell(self, cell_id, flagged=False):
+        # Write the images of one cell. cell_id is the Cell ID of the results tables
+        # (the processed PNG name), so that every script picks the same cells
+        if self.policy == 'all':
+            return True
+        if self.policy == 'sampled':
+            return is_sampled(cell_id, self.sample_every)
+        if self.policy == 'flagged':
+            return flagged
+        return False
+
+    def archive_path(self, folder):
+        # Archive taking the place of a folder of cell images. Every shard writes its own
+        # archive, since the shards of a run may share a field
+        return shard_name(folder, self.shard) + '.npz'
+
+
+def is_sampled(cell_id, sample_every):
+    # One cell in sample_every, chosen by the hash of its ID, so that the same cells are
+    # sampled in every run, shard and script
+    return int(hashlib.sha1(cell_id.encode()).hexdigest(), 16) % sample_every == 0
+
+
+def flag_cell(cell_binary=None, soma_area=None, result=None):
+    # A cell worth checking by eye: nothing left after cleaning, no soma found, or a skeleton
+    # without any junction (a microglia cell without ramifications hints at a segmentation problem)
+    if cell_binary is not None and not cell_binary.any():
+        return True
+    if soma_area is not None and soma_area == 0:
+        return True
+    return result is not None and len(result.junctions) == 0
+
+
+class CellArchive:
+    # Compressed NPZ archive of the cell images of one field, instead of one PNG per image.
+    # Images are collected in memory and written in one go when the archive moves on to
+    # another field (open) or is closed
+
+    def __init__(self, path=None):
+        self.path = path
+        self.images = {}
+
+    def open(self, path):
+        if path != self.path:
+            self.close()
+            self.path = path
+
+    def add(self, name, image):
+        self.images[name] = image
+
+    def update(self, images):
+        self.images.update(images)
+
+    def close(self):
+        if self.images:
+            write_image(save_archive, self.path, self.images)
+            self.images = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_archive(path, images):
+    # Add the images to the archive at path, keeping the images already in it (of a resumed or
+    # earlier run), and replace the archive atomically so that readers never see a partial one
+    if os.path.exists(path):
+        with np.load(path) as archive:
+            images = dict({name: archive[name] for name in archive.files}, **images)
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **images)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(temporary_path, path)
+
+
+def save_cell_image(path, image, archive=None):
+    # Write one cell image as a PNG, or add it to the field archive under its file name
+    if archive is None:
+        write_image(cv2.imwrite, path, image)
+    else:
+        archive.add(os.path.splitext(os.path.basename(path))[0], image)
+
+
+def add_artifact_arguments(parser, default='all'):
+    # Command-line options shared by every script writing output images
+    parser.add_argument('--artifacts', choices=ARTIFACT_POLICIES, default=default,
+                        help='Output images to write: none, summary (field images only), sampled or flagged (field images and the images '
+                             f'of the sampled or flagged cells) or all (default: {default})')
+    parser.add_argument('--artifact-sample', type=int, default=10, metavar='N',
+                        help='With --artifacts sampled, write the images of one cell in N, always the same cells (default: 10)')
+    parser.add_argument('--artifact-archive', action='store_true',
+                        help='Store the cell images of every field in one compressed NPZ archive instead of individual PNGs')
+
+
+def open_artifacts(args, policy=None):
+    # Artifact policy of the command-line options (policy overrides --artifacts)
+    return ArtifactPolicy(policy or args.artifacts, args.artifact_sample, args.artifact_archive, getattr(args, 'shard', None))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Active image writer of this process, None when images are written synchronously
+_writer = None
+
+# Marks the end of the items in prefetch
+_END = object()
+
+
+class ImageWriter:
+    # Thread pool writing images in the background. At most max_pending writes are queued
+    # (submit blocks above that), which caps the memory held by images waiting to be written.
+    # cv2.imwrite and PIL release the GIL while encoding, so the writes overlap with compute
+
+    def __init__(self, threads, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='image-writer')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.error = None
+
+    def submit(self, function, *args):
+        self.raise_error()
+        self.slots.acquire()
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+
+    def raise_error(self):
+        # A failed write stops the run at the next write instead of going unnoticed
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.raise_error()
+
+
+def start_writing(threads, max_pending=None):
+    # Write images on `threads` background threads from now on (0 keeps writing synchronously)
+    global _writer
+    if threads and _writer is None:
+        _writer = ImageWriter(threads, max_pending or 4 * threads)
+
+
+def detach_writing():
+    # In a forked worker process: forget the writer inherited from the parent process. Its threads
+    # do not run in the worker and nobody closes the copy, so failed writes would go unnoticed;
+    # the worker writes its images synchronously instead
+    global _writer
+    _writer = None
+
+
+def finish_writing():
+    # Wait for every queued image to be written
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
+
+
+def _write(function, path, *args):
+    # cv2.imwrite returns False on a failed write instead of raising
+    if function(path, *args) is False:
+        raise OSError(f'Could not write {path}')
+
+
+def write_image(function, *args):
+    # Call function(*args) (cv2.imwrite, Image.save, ...) on a writer thread, or right away when
+    # writing synchronously. The arrays passed must not be modified afterwards
+    if _writer is None:
+        _write(function, *args)
+    else:
+        _writer.submit(_write, function, *args)
+
+
+def prefetch(function, items, threads=0, depth=None):
+    # Yield (item, function(item)) in the order of items, decoding up to `depth` items ahead on
+    # `threads` reader threads while the caller computes on the current one. The bounded read-ahead
+    # caps the memory held by decoded images. threads=0 decodes each item when it is needed
+    if not threads:
+        for item in items:
+            yield item, function(item)
+        return
+
+    depth = depth or 2 * threads
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='image-reader') as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            next_item = next(items, _END)
+            if next_item is not _END:
+                pending.append((next_item, executor.submit(function, next_item)))
+            yield item, future.result()
+
+
+def add_io_arguments(parser):
+    # Command-line options shared by every script that reads and writes many images
+    parser.add_argument('--io-threads', type=int, default=0,
+                        help='Threads reading upcoming images and writing output images in the background (default: 0, no background I/O)')
+    parser.add_argument('--io-queue', type=int, help='Maximum number of images queued for writing (default: 4 per I/O thread)')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import cv2
+from PIL import Image
+from skimage.morphology import skeletonize
+from SyntheticMicroglia import synthetic_cell, synthetic_field
+from microglia import skeleton_graph, identify_points, segment_image, morphology_metrics, measure_soma, measure_soma_stack, select_cells
+from SomaMeasurements import extract_soma_and_measure
+from IndividualCellSelectandExtract import extract_cells
+
+
+def measure(function, repeats):
+    # Best wall time over the repeats, and the peak traced memory of one extra run
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), float(np.median(times)), peak
+
+
+def benchmark_stages(cell_size=300, num_cells=16, repeats=5, seed=0):
+    # Time every pipeline stage on synthetic data of the given size
+    cell = synthetic_cell(cell_size, num_processes=8, seed=seed)
+    cell_image = cell.astype(np.uint8) * 255
+    skeleton = skeletonize(cell)
+    result = identify_points(skeleton)
+    graph = skeleton_graph.build_skeleton_graph(skeleton, result.types)
+    field = synthetic_field(num_cells, cell_size, seed=seed)
+    cell_stack = np.stack([synthetic_cell(cell_size, seed=seed + index) for index in range(num_cells)]).astype(np.uint8) * 255
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        # Files for the path-based stages
+        cell_image_path = os.path.join(temporary_folder, 'cell.png')
+        cv2.imwrite(cell_image_path, cell_image)
+        field_path = os.path.join(temporary_folder, 'field.tif')
+        Image.fromarray(field).save(field_path)
+        output_folders = [os.path.join(temporary_folder, name) for name in ['selected', 'rectangles', 'cells', 'processed']]
+        for output_folder in output_folders:
+            os.makedirs(output_folder, exist_ok=True)
+
+        stages = [
+            ('skeletonize', lambda: skeletonize(cell)),
+            ('identify_points', lambda: identify_points(skeleton)),
+            ('segment_image', lambda: segment_image(cell_image, result)),
+            ('build_skeleton_graph', lambda: skeleton_graph.build_skeleton_graph(skeleton, result.types)),
+            ('count_ramifications', lambda: skeleton_graph.count_ramifications(graph)),
+            ('morphology_metrics', lambda: morphology_metrics(cell, skeleton)),
+            ('measure_soma', lambda: measure_soma(cell_image)),
+            ('measure_soma_stack', lambda: measure_soma_stack(cell_stack)),
+            ('extract_soma_and_measure', lambda: extract_soma_and_measure(cell_image_path, os.path.join(temporary_folder, 'soma.png'))),
+            ('select_cells', lambda: select_cells(field)),
+            ('extract_cells', lambda: extract_cells(field_path, output_folders)),
+        ]
+
+        results = []
+        for name, function in stages:
+            best, median, peak = measure(function, repeats)
+            results.append({'stage': name, 'best_s': best, 'median_s': median, 'peak_bytes': peak})
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic microglia.')
+    parser.add_argument('--cell-size', type=int, default=300, help='Side in pixels of the synthetic cells (default: 300)')
+    parser.add_argument('--num-cells', type=int, default=16, help='Number of cells in the synthetic field (default: 16)')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per stage (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data (default: 0)')
+    parser.add_argument('--json', help='Also write the results to this JSON file, to compare runs over releases')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = benchmark_stages(args.cell_size, args.num_cells, args.repeats, args.seed)
+
+    print(f"{'Stage':<26}{'Best (ms)':>12}{'Median (ms)':>14}{'Peak (MB)':>12}")
+    for result in results:
+        print(f"{result['stage']:<26}{result['best_s'] * 1000:>12.2f}{result['median_s'] * 1000:>14.2f}{result['peak_bytes'] / (1024 * 1024):>12.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'parameters': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
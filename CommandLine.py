@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+def ask_value(value, prompt):
+    # Use the command-line value when given, otherwise ask the user
+    if value is not None:
+        return value
+    return input(prompt)
+
+
+def ask_directory(folder, title):
+    # Use the command-line folder when given, otherwise open a folder dialog.
+    # tkinter is only imported here so that headless runs never start a GUI
+    if folder:
+        return folder
+
+    import tkinter as tk
+    from tkinter import filedialog
+
+    # Create a Tkinter window for folder selection
+    root = tk.Tk()
+    root.withdraw()  # Hide the root window
+    folder = filedialog.askdirectory(title=title)
+    root.destroy()
+
+    return folder
@@ -6,227 +6,268 @@ Created on Tue Feb 13 15:43:51 2024
 @author: debyelizarraras
 """
 
-import tkinter as tk
-from tkinter import filedialog
+import argparse
 import numpy as np
-from skimage.morphology import skeletonize
-import matplotlib.pyplot as plt
 from PIL import Image
+from microglia import SkeletonResult, analyze_skeleton_array, skeleton_measurements, render_visualization, measure_soma, morphology_metrics
 import os
 import cv2
-import openpyxl
+from ResultsWriter import ID_COLUMNS, SKELETON_COLUMNS, METRICS_COLUMNS, add_results_arguments, results_path, open_results_writer, finish_results
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from ResultCache import add_cache_arguments, open_cache
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from Sharding import select_shard, shard_name, add_shard_arguments
+from RunManifest import RunManifest, manifest_path, resume_results, add_manifest_arguments
+from AsyncImageIO import start_writing, detach_writing, finish_writing, write_image, prefetch, add_io_arguments
+from ArtifactPolicy import ArtifactPolicy, CellArchive, flag_cell, add_artifact_arguments, open_artifacts
+from CommandLine import ask_value, ask_directory
 
-def analyze_skeleton(cell_image_path, output_skeleton_path, output_segmented_path):
-    # Open the image
-    image = Image.open(cell_image_path)
+def read_cell_image(cell_image_path):
+    with stage('decode', os.path.splitext(os.path.basename(cell_image_path))[0]):
+        # Open the image
+        image = Image.open(cell_image_path)
 
-    # Convert image to grayscale
-    image_gray = image.convert('L')
-    
-    # Convert image to numpy array
-    image_array = np.array(image_gray)
-    
-    # Threshold image to obtain binary image
-    binary_image = image_array > 0
-    
-    # Skeletonize the binary image
-    skeleton = skeletonize(binary_image)
-    
-    # Save the skeletonized image
-    cv2.imwrite(output_skeleton_path, skeleton.astype(np.uint8) * 255)
-    
-    # Identify end points, junctions, and slabs
-    end_points, junctions, slabs = identify_points(skeleton)
-    
-    # Perform segmentation
-    segmented_image = segment_image(image_array, skeleton, end_points, junctions, slabs)
-    
-    # Save the segmented image
-    cv2.imwrite(output_segmented_path, segmented_image.astype(np.uint8) * 255)
-
-    # Count ramifications
-    num_ramifications = count_ramifications(skeleton, end_points, junctions, slabs)
-
-    return os.path.splitext(os.path.basename(cell_image_path))[0], skeleton, segmented_image, end_points, junctions, slabs, num_ramifications
-
-def identify_points(skeleton):
-    # Get coordinates of skeleton points
-    skeleton_coords = np.transpose(np.nonzero(skeleton))
-    
-    # Create lists to store end points, junctions, and slabs
-    end_points = []
-    junctions = []
-    slabs = []
-    
-    # Iterate through skeleton points
-    for coord in skeleton_coords:
-        # Get neighboring pixels
-        neighbors = get_neighbors(coord, skeleton)
+        # Convert image to grayscale
+        image_gray = image.convert('L')
         
-        # Count the number of neighbors
-        num_neighbors = len(neighbors)
-        
-        # Classify the pixel based on the number of neighbors
-        if num_neighbors == 1:
-            end_points.append(coord)
-        elif num_neighbors > 2:
-            junctions.append(coord)
-        else:
-            slabs.append(coord)
-    
-    return end_points, junctions, slabs
+        # Convert image to numpy array
+        return np.array(image_gray)
 
-def get_neighbors(coord, skeleton):
-    # Define offsets for neighboring pixels
-    offsets = [(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]
-    
-    # Get shape of the image
-    height, width = skeleton.shape
-    
-    # List to store neighboring pixels
-    neighbors = []
-    
-    # Iterate over offsets
-    for dx, dy in offsets:
-        x, y = coord[0] + dx, coord[1] + dy
-        # Check if the neighbor is within the image bounds and is a skeleton pixel
-        if 0 <= x < height and 0 <= y < width and skeleton[x, y]:
-            neighbors.append((x, y))
-    
-    return neighbors
+def analyze_skeleton(cell_image_path, output_skeleton_path, output_segmented_path, image_array=None):
+    cell_id = os.path.splitext(os.path.basename(cell_image_path))[0]
 
-def count_ramifications(skeleton, end_points, junctions, slabs):
-    # Initialize the count of ramifications
-    num_ramifications = 0
-    
-    # Create a set of end points and junctions for efficient lookup
-    end_points_set = set(map(tuple, end_points))
-    junctions_set = set(map(tuple, junctions))
+    # image_array may be passed when the image was already read (e.g. prefetched)
+    if image_array is None:
+        image_array = read_cell_image(cell_image_path)
     
-    # Iterate over end points and trace connections to junctions
-    for end_point in end_points:
-        visited = set()
-        stack = [end_point]
-        while stack:
-            current = stack.pop()
-            if tuple(current) in junctions_set:
-                num_ramifications += 1
-                break
-            if tuple(current) in visited:
-                continue
-            visited.add(tuple(current))
-            for neighbor in get_neighbors(current, skeleton):
-                stack.append(neighbor)
-                
-    return num_ramifications
-
-def has_path(skeleton, start, end):
-    # Perform a simple depth-first search to check for a path between start and end points
-    visited = set()
-    stack = [start]
+    # Skeletonize, classify the skeleton points and count ramifications
+    result, segmented_image, num_ramifications, graph = analyze_skeleton_array(image_array, cell_id)
     
-    while stack:
-        current = stack.pop()
-        if tuple(current) == tuple(end):  # Convert arrays to tuples before comparison
-            return True
-        if tuple(current) in visited:  # Convert arrays to tuples before comparison
-            continue
-        visited.add(tuple(current))  # Convert arrays to tuples before adding to set
-        for neighbor in get_neighbors(current, skeleton):
-            stack.append(neighbor)
-    
-    return False
+    # Save the skeletonized and the segmented image (None skips an image)
+    with stage('write_images', cell_id):
+        if output_skeleton_path:
+            write_image(cv2.imwrite, output_skeleton_path, result.skeleton.astype(np.uint8) * 255)
+        if output_segmented_path:
+            write_image(cv2.imwrite, output_segmented_path, segmented_image.astype(np.uint8) * 255)
 
-def segment_image(image_array, skeleton, end_points, junctions, slabs):
-    # Perform segmentation based on the skeleton and detected points
-    segmented_image = np.zeros_like(image_array)
-    
-    # Mark skeleton points
-    segmented_image[skeleton] = 255
-    
-    # Mark end points
-    for point in end_points:
-        segmented_image[point[0], point[1]] = 150  # Adjust intensity as needed
-    
-    # Mark junctions
-    for point in junctions:
-        segmented_image[point[0], point[1]] = 100  # Adjust intensity as needed
-    
-    # Mark slabs
-    for point in slabs:
-        segmented_image[point[0], point[1]] = 50  # Adjust intensity as needed
-    
-    return segmented_image
+    return cell_id, result, segmented_image, num_ramifications, graph
 
-def save_visualization(cell_image_path, segmented_image, end_points, junctions, slabs, output_folder):
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+def save_publication_figure(segmented_image, result, output_path):
+    # matplotlib is only imported when publication figures are asked for
+    import matplotlib
+    matplotlib.use('Agg')  # Figures are only saved, which also keeps worker processes free of GUI backends
+    import matplotlib.pyplot as plt
 
-    # Plot and save the visualization figure
-    file_name = os.path.splitext(os.path.basename(cell_image_path))[0]
+    # Plot and save the matplotlib visualization figure
     plt.figure(figsize=(8, 8))
     plt.imshow(segmented_image, cmap='gray')
-    plt.scatter([point[1] for point in end_points], [point[0] for point in end_points], c='b', label='End Points', s=10)
-    plt.scatter([point[1] for point in junctions], [point[0] for point in junctions], c='purple', label='Junctions', s=10)
-    plt.scatter([point[1] for point in slabs], [point[0] for point in slabs], c='orange', label='Slabs', s=10)
+    plt.scatter(result.end_points[:, 1], result.end_points[:, 0], c='b', label='End Points', s=10)
+    plt.scatter(result.junctions[:, 1], result.junctions[:, 0], c='purple', label='Junctions', s=10)
+    plt.scatter(result.slabs[:, 1], result.slabs[:, 0], c='orange', label='Slabs', s=10)
     plt.title('Skeleton Analysis')
     plt.legend()
-    plt.savefig(os.path.join(output_folder, f'Visualization_{file_name}.png'))
+    plt.savefig(output_path)
     plt.close()
 
-# Get the region and group from the user
-region = input("Enter the region: ")
-group = input("Enter the group: ")
- 
-# Create a Tkinter window for folder selection
-root = tk.Tk()
-root.withdraw()  # Hide the root window
-
-# Ask the user to select the main folder containing subfolders
-main_folder = filedialog.askdirectory(title="Select Main Folder")
-
-if main_folder:
-    # Create an output parent folder
-    output_parent_folder = os.path.join(main_folder, f'Analyze Skeleton {group} {region}')
-    os.makedirs(output_parent_folder, exist_ok=True)
-    
-    # Create an Excel workbook and add a worksheet
-    excel_path = os.path.join(main_folder, f'Analyze_Skeleton_{region}_{group}.xlsx')
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.append(["Cell ID", "Region", "Group", "# Branches", "# End Point Voxels", "# Junction Voxels", "# Slab Voxels"])
-    
-    # Iterate through each subfolder in the main folder
-    for subfolder_name in os.listdir(main_folder):
+def save_visualization(cell_image_path, segmented_image, result, output_folder, publication=False):
+    # Create output folder if it doesn't exist
+    os.makedirs(output_folder, exist_ok=True)
+
+    file_name = os.path.splitext(os.path.basename(cell_image_path))[0]
+    output_path = os.path.join(output_folder, f'Visualization_{file_name}.png')
+
+    # Raster overlay by default, the slower matplotlib figure only when asked for
+    if publication:
+        save_publication_figure(segmented_image, result, output_path)
+    else:
+        write_image(cv2.imwrite, output_path, render_visualization(segmented_image, result))
+
+def skeleton_columns(morphology=False):
+    # Measurement columns of the skeleton table, with the Sholl, fractal and hull metrics when asked for
+    return SKELETON_COLUMNS + METRICS_COLUMNS if morphology else SKELETON_COLUMNS
+
+def save_cell_artifacts(cell_image_path, output_folder, segmented_image, result, publication=False, artifacts=None, missing_only=False):
+    # Save the skeleton, segmented and visualization images of one cell when the artifact policy
+    # asks for them (only the missing ones with missing_only). When archiving, the skeleton and
+    # segmented images are returned for the field archive instead (the visualization is left
+    # out, it can be rendered from the segmented image); otherwise returns {}
+    artifacts = artifacts or ArtifactPolicy()
+    file_name = os.path.splitext(os.path.basename(cell_image_path))[0]
+    if not artifacts.cell(file_name, flag_cell(result=result)):
+        return {}
+
+    if artifacts.archive:
+        return {f'Skeletonize_{file_name}': result.skeleton.astype(np.uint8) * 255,
+                f'Segmented_{file_name}': segmented_image.astype(np.uint8) * 255}
+
+    output_paths = [os.path.join(output_folder, f'{prefix}_{file_name}.png') for prefix in ['Skeletonize', 'Segmented', 'Visualization']]
+    output_skeleton_path, output_segmented_path, output_visualization_path = [
+        None if missing_only and os.path.exists(output_path) else output_path for output_path in output_paths]
+
+    with stage('write_images', file_name):
+        if output_skeleton_path:
+            write_image(cv2.imwrite, output_skeleton_path, result.skeleton.astype(np.uint8) * 255)
+        if output_segmented_path:
+            write_image(cv2.imwrite, output_segmented_path, segmented_image.astype(np.uint8) * 255)
+
+    # Save the visualization figure
+    if output_visualization_path:
+        with stage('visualization', file_name):
+            save_visualization(cell_image_path, segmented_image, result, output_folder, publication)
+    return {}
+
+def process_cell(cell_task, cache=None, publication=False, image_array=None, morphology=False, artifacts=None):
+    # Analyze one cell and save the images the artifact policy asks for (runs inside a worker
+    # process in parallel mode). Returns the result row and the images for the field archive
+    cell_image_path, output_folder_skeletonize = cell_task
+    file_name = os.path.splitext(os.path.basename(cell_image_path))[0]
+
+    # Reuse the cached measurements of an unchanged image, rewriting only missing outputs
+    if cache is not None:
+        key = cache.key('skeleton', cell_image_path, {'columns': skeleton_columns(morphology)})
+        cached = cache.get(key)
+        if cached is not None:
+            measurements, arrays = cached
+            result = SkeletonResult(arrays['skeleton'], arrays['point_types'])
+            images = save_cell_artifacts(cell_image_path, output_folder_skeletonize, arrays['segmented_image'], result, publication, artifacts,
+                                         missing_only=True)
+            return [file_name] + measurements, images
+
+    if image_array is None:
+        image_array = read_cell_image(cell_image_path)
+
+    # Extract num_ramifications, end points, junctions, slab (the images are saved below, once it
+    # is known whether the cell is flagged)
+    cell_id, result, segmented_image, num_ramifications, graph = analyze_skeleton(cell_image_path, None, None, image_array)
+    images = save_cell_artifacts(cell_image_path, output_folder_skeletonize, segmented_image, result, publication, artifacts)
+
+    measurements = skeleton_measurements(result, num_ramifications, graph)
+    if morphology:
+        # The Sholl centre is the soma centroid, measured as SomaMeasurements.py does, so that the
+        # metrics agree with those of MicrogliaPipeline.py
+        with stage('soma', cell_id):
+            soma = measure_soma(image_array)[0]
+        with stage('metrics', cell_id):
+            measurements += morphology_metrics(image_array, result.skeleton, soma)
+    if cache is not None:
+        cache.put(key, measurements, {'skeleton': result.skeleton, 'point_types': result.types, 'segmented_image': segmented_image})
+
+    # Return only the measurements (and the archived images) so that workers do not ship the other images back
+    return [cell_id] + measurements, images
+
+def collect_cell_tasks(main_folder, output_parent_folder):
+    # List every PNG of every subfolder in a deterministic (sorted) order
+    cell_tasks = []
+    for subfolder_name in sorted(os.listdir(main_folder)):
         subfolder_path = os.path.join(main_folder, subfolder_name)
 
-        # Check if the path is a directory
-        if os.path.isdir(subfolder_path):
+        # Check if the path is a directory (skipping the output folder itself)
+        if os.path.isdir(subfolder_path) and subfolder_path != output_parent_folder:
             # Create an output folder for each subfolder in the output parent folder
             output_folder_skeletonize = os.path.join(output_parent_folder, f'{subfolder_name}_Skeletonize')
             os.makedirs(output_folder_skeletonize, exist_ok=True)
 
             # Iterate through each file in the subfolder
-            for filename in os.listdir(subfolder_path):
+            for filename in sorted(os.listdir(subfolder_path)):
                 if filename.endswith('.png'):
-                    cell_image_path = os.path.join(subfolder_path, filename)
-                    file_name = os.path.splitext(filename)[0]
-                    output_skeleton_path = os.path.join(output_folder_skeletonize, f'Skeletonize_{file_name}.png')
-                    output_segmented_path = os.path.join(output_folder_skeletonize, f'Segmented_{file_name}.png')
+                    cell_tasks.append((os.path.join(subfolder_path, filename), output_folder_skeletonize))
+
+    return cell_tasks
+
+def archive_cells(cell_tasks, results, artifacts=None):
+    # Yield the result row of every cell, adding its images to the archive of its subfolder.
+    # The cells of a subfolder are consecutive, so every archive is written once
+    artifacts = artifacts or ArtifactPolicy()
+    with CellArchive() as archive:
+        for (_, output_folder_skeletonize), (row, images) in zip(cell_tasks, results):
+            if images:
+                archive.open(artifacts.archive_path(output_folder_skeletonize))
+                archive.update(images)
+            yield row
+
+def start_worker(trace_path):
+    # Initializer of the worker processes: trace into the run's trace file and write images
+    # synchronously, so that a failed write fails its cell (and the run) in the main process
+    start_tracing(trace_path)
+    detach_writing()
 
-                    # Extract num_ramifications, end points, junctions, slab
-                    cell_id, skeleton, segmented_image, end_points, junctions, slabs, num_ramifications = analyze_skeleton(cell_image_path, output_skeleton_path, output_segmented_path)
+def process_cells(cell_tasks, workers=1, cache=None, trace_path=None, publication=False, io_threads=0, morphology=False, artifacts=None):
+    # Analyze the cells serially or fan them out across a process pool.
+    # Results are yielded in the order of cell_tasks either way. Serially, io_threads threads
+    # read the upcoming cells ahead (without them every cell is read when needed, a cached one
+    # not at all) and write the images in the background. The worker processes read and write
+    # their images themselves, synchronously, overlapping their I/O with each other
+    if workers <= 1:
+        read = (lambda cell_task: read_cell_image(cell_task[0])) if io_threads else (lambda cell_task: None)
+        results = (process_cell(cell_task, cache, publication, image_array, morphology, artifacts)
+                   for cell_task, image_array in prefetch(read, cell_tasks, io_threads))
+        yield from archive_cells(cell_tasks, results, artifacts)
+        return
+
+    chunksize = max(1, len(cell_tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(trace_path,)) as executor:
+        results = executor.map(partial(process_cell, cache=cache, publication=publication, morphology=morphology, artifacts=artifacts),
+                               cell_tasks, chunksize=chunksize)
+        yield from archive_cells(cell_tasks, results, artifacts)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Skeletonize every processed cell PNG in the subfolders of a main folder.')
+    parser.add_argument('main_folder', nargs='?', help='Main folder containing one subfolder of cell PNGs per image (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region written to the results (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group written to the results (asked when omitted)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (default: 1)')
+    parser.add_argument('--publication-figures', action='store_true', help='Render the visualizations as matplotlib figures with title and legend (much slower)')
+    parser.add_argument('--morphology', action='store_true', help='Also measure Sholl intersections, fractal dimension and convex hull of every cell')
+    add_artifact_arguments(parser)
+    add_results_arguments(parser)
+    add_cache_arguments(parser)
+    add_manifest_arguments(parser)
+    add_shard_arguments(parser)
+    add_io_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_tracing(args.trace, new_trace=True)
+    start_writing(args.io_threads, args.io_queue)
+
+    # Get the region and group from the command line or the user
+    region = ask_value(args.region, "Enter the region: ")
+    group = ask_value(args.group, "Enter the group: ")
+
+    # Get the main folder containing subfolders
+    main_folder = ask_directory(args.main_folder, "Select Main Folder")
+
+    if main_folder:
+        # Create an output parent folder
+        output_parent_folder = os.path.join(main_folder, f'Analyze Skeleton {group} {region}')
+        os.makedirs(output_parent_folder, exist_ok=True)
+        
+        # Analyze every cell of every subfolder, or only the cells of one shard
+        cell_tasks = collect_cell_tasks(main_folder, output_parent_folder)
+        task_ids = [os.path.relpath(cell_image_path, main_folder) for cell_image_path, _ in cell_tasks]
+        cell_tasks, task_ids = select_shard(cell_tasks, task_ids, args.shard, args.shard_by)
 
-                    # Save the visualization figure
-                    save_visualization(cell_image_path, segmented_image, end_points, junctions, slabs, output_folder_skeletonize)
+        # Stream the measurements into the results table as the cells finish, recording every
+        # finished cell in the run manifest so that an interrupted run can be resumed
+        output_path = results_path(main_folder, shard_name(f'Analyze_Skeleton_{region}_{group}', args.shard), args.output_format)
+        columns = ID_COLUMNS + skeleton_columns(args.morphology)
+        header = {'script': 'ForAnalyzeSkeleton', 'columns': columns}
+        process = partial(process_cells, workers=args.workers, cache=open_cache(args), trace_path=args.trace,
+                          publication=args.publication_figures, io_threads=args.io_threads, morphology=args.morphology,
+                          artifacts=open_artifacts(args))
+        with RunManifest(manifest_path(output_path), header, args.resume, args.manifest_sync) as manifest, \
+                open_results_writer(output_path, columns, args.output_format) as writer:
+            for result in resume_results(manifest, cell_tasks, task_ids, process):
+                writer.write_row([result[0], region, group] + result[1:])
 
-                    # Write the measurements to the Excel worksheet
-                    worksheet.append([cell_id, region, group, num_ramifications, len(end_points), len(junctions), len(slabs)])
-                    
-    # Save the Excel workbook
-    workbook.save(excel_path)
+        output_path = finish_results(output_path, args.output_format, args.excel)
+        print(f"Skeleton Analysis saved to {output_path}")
 
-    # Close the workbook to ensure the changes are written
-    workbook.close()
+    finish_writing()
+    finish_tracing(args.trace)
 
-    print(f"Skeleton Analysis saved to {excel_path}")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+from skimage.filters import threshold_otsu
+
+
+# Axes of one image plane; every other axis of a stack (time, channel, z, ...) indexes planes
+PLANE_AXES = 'YXS'
+
+
+def is_stack(image_path):
+    # CZI files, and TIFFs (OME or ImageJ hyperstacks) holding more than one plane
+    if image_path.lower().endswith('.czi'):
+        return True
+    try:
+        import tifffile
+    except ImportError:
+        # tifffile is only needed for stacks; without it every TIFF is read as a plain image
+        return False
+    with tifffile.TiffFile(image_path) as tif:
+        series = tif.series[0]
+        return int(np.prod([size for axis, size in zip(series.axes, series.shape) if axis not in PLANE_AXES])) > 1
+
+
+def projection_name(image_path, channel=0):
+    # File name of the projection, as Fiji names an exported MAX projection of one channel
+    return f'MAX_{os.path.basename(image_path)} - C={channel}.tif'
+
+
+def parse_plane_range(text):
+    # 'START:STOP' (0-based, STOP excluded, either may be left out) as a (start, stop) tuple
+    start, _, stop = text.partition(':')
+    return (int(start) if start else 0, int(stop) if stop else None)
+
+
+def _in_range(index, plane_range):
+    return plane_range is None or (plane_range[0] <= index and (plane_range[1] is None or index < plane_range[1]))
+
+
+def max_projection(image_path, channel=0, z_planes=None, chunk_planes=8):
+    # Maximum intensity projection over the z planes of one channel of a CZI or TIFF stack.
+    # Planes are read a few at a time, so only chunk_planes planes are in memory at once
+    if image_path.lower().endswith('.czi'):
+        return _czi_max_projection(image_path, channel, z_planes)
+    return _tiff_max_projection(image_path, channel, z_planes, chunk_planes)
+
+
+def _tiff_max_projection(image_path, channel, z_planes, chunk_planes):
+    import tifffile
+    with tifffile.TiffFile(image_path) as tif:
+        series = tif.series[0]
+        axes, shape = series.axes, series.shape
+        # Stack axes come first, then the axes of one plane
+        num_stack_axes = next((index for index, axis in enumerate(axes) if axis in PLANE_AXES), len(axes))
+        stack_axes, plane_axes = axes[:num_stack_axes], axes[num_stack_axes:]
+        if any(axis not in PLANE_AXES for axis in plane_axes):
+            raise ValueError(f'Unsupported axes {axes} of {image_path}')
+        # A stack written without axis names (one Q axis) is a z stack
+        if stack_axes == 'Q':
+            stack_axes = 'Z'
+        stack_shape, plane_shape = shape[:num_stack_axes], shape[num_stack_axes:]
+
+        # Channels are a C axis, or interleaved (RGB-like) samples without one
+        if 'C' in stack_axes:
+            num_channels = shape[axes.index('C')]
+        else:
+            num_channels = plane_shape[plane_axes.index('S')] if 'S' in plane_axes else 1
+        if not 0 <= channel < num_channels:
+            raise ValueError(f'{image_path} has {num_channels} channel(s), there is no channel {channel}')
+
+        # Planes of the requested channel and z range, in file order
+        positions = list(np.ndindex(*stack_shape))
+        planes_kept = []
+        for plane, index in enumerate(positions):
+            position = dict(zip(stack_axes, index))
+            if position.get('C', channel) == channel and _in_range(position.get('Z', 0), z_planes):
+                planes_kept.append(plane)
+        if not planes_kept:
+            raise ValueError(f'No planes of channel {channel} in the z range of {image_path}')
+
+        if len(series.pages) == len(positions):
+            # One page per plane: read the planes page by page
+            def read_planes(planes):
+                return tif.asarray(key=planes, series=0)
+        else:
+            # Pages of several planes (e.g. a shaped stack whose pages hold planar samples): the
+            # pages do not map to planes, so the whole series is read at once
+            all_planes = series.asarray().reshape((-1,) + tuple(plane_shape))
+
+            def read_planes(planes):
+                return all_planes[planes]
+
+        projection = None
+        for first in range(0, len(planes_kept), chunk_planes):
+            planes = read_planes(planes_kept[first:first + chunk_planes]).reshape((-1,) + tuple(plane_shape))
+            if 'S' in plane_axes and 'C' not in stack_axes:
+                planes = np.take(planes, channel, axis=1 + plane_axes.index('S'))
+            chunk_projection = planes.max(axis=0)
+            projection = chunk_projection if projection is None else np.maximum(projection, chunk_projection)
+
+    return projection
+
+
+def _czi_max_projection(image_path, channel, z_planes):
+    # czifile is only needed for CZI input
+    import czifile
+
+    with czifile.CziFile(image_path) as czi:
+        axes = czi.axes
+        num_channels = czi.shape[axes.index('C')] if 'C' in axes else 1
+        if not 0 <= channel < num_channels:
+            raise ValueError(f'{image_path} has {num_channels} channel(s), there is no channel {channel}')
+        y, x = axes.index('Y'), axes.index('X')
+        projection = np.zeros((czi.shape[y], czi.shape[x]), dtype=czi.dtype)
+
+        # Every subblock is one tile of one plane; the tiles of a mosaic are placed by their start
+        found = False
+        for entry in czi.filtered_subblock_directory:
+            position = dict(zip(axes, (start - czi_start for start, czi_start in zip(entry.start, czi.start))))
+            if position.get('C', channel) != channel or not _in_range(position.get('Z', 0), z_planes):
+                continue
+            tile = entry.data_segment().data(resize=True)
+            tile = tile.max(axis=tuple(index for index in range(tile.ndim) if index not in (y, x)))
+            rows, cols = slice(position['Y'], position['Y'] + tile.shape[0]), slice(position['X'], position['X'] + tile.shape[1])
+            np.maximum(projection[rows, cols], tile, out=projection[rows, cols])
+            found = True
+
+    if not found:
+        raise ValueError(f'No planes of channel {channel} in the z range of {image_path}')
+    return projection
+
+
+def threshold_projection(projection, threshold=None):
+    # Binary 0/255 image of the projection above the threshold (Otsu's threshold when None),
+    # like the thresholded TIFFs the cell selection reads
+    if threshold is None:
+        threshold = threshold_otsu(projection)
+    return (projection > threshold).astype(np.uint8) * 255
@@ -6,113 +6,262 @@ Created on Wed Dec 20 18:33:34 2023
 @author: debyelizarraras
 """
 
-import tkinter as tk
-from tkinter import filedialog
+import argparse
 import os
+from functools import partial
 import cv2
 from PIL import Image
 import numpy as np
-from skimage import measure
-from skimage.morphology import remove_small_objects, binary_erosion, binary_dilation
+from microglia import select_cells, crop_cell, threshold_cell
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from CommandLine import ask_value, ask_directory
+from TiledFields import open_field, field_resolution, label_field, selected_strips, overview_strip
+from ImageReaders import is_stack, projection_name, parse_plane_range, max_projection, threshold_projection
+from AsyncImageIO import start_writing, finish_writing, write_image, prefetch, add_io_arguments
+from ArtifactPolicy import ArtifactPolicy, CellArchive, flag_cell, add_artifact_arguments, open_artifacts
 
 
-# Create a Tkinter window
-root = tk.Tk()
-root.withdraw()  # Hide the root window
+def read_field(image_path):
+    with stage('decode', os.path.basename(image_path)):
+        # Open an image file
+        image = Image.open(image_path)
 
-region = input('Enter region:')
-group = input('Enter the experimental group:')
+        # Convert PIL Image to a NumPy array
+        return np.array(image)
 
-# Ask user to select the input folder
-input_folder = filedialog.askdirectory(title="Select Input Folder")
 
-if input_folder:
+def field_dpi(image_path):
+    # Resolution of a field file in dots per inch, None when it has none (only the header is read)
+    with Image.open(image_path) as image:
+        return image.info.get('dpi')
+
+
+def extract_cells(image_path, output_folders, min_cell_area=300, threshold_value=100, image_array=None, artifacts=None):
+    # Select the cells of one thresholded image and save the selection, the numbered overview
+    # and every individual (raw and processed) cell into the four output folders (the processed
+    # cells always, the other images as the artifact policy asks for).
+    # image_array may be passed when the image was already read (e.g. prefetched)
+    filename = os.path.basename(image_path)
+
+    if image_array is None:
+        image_array = read_field(image_path)
+
+    extract_field_cells(image_array, filename, output_folders, min_cell_area, threshold_value, image_path, artifacts)
+
+
+def extract_stack_cells(stack_path, output_folders, min_cell_area=300, threshold_value=100, channel=0, z_planes=None,
+                        stack_threshold=None, output_folder_projections=None, artifacts=None):
+    # Select the cells of a CZI or OME-TIFF stack: project one channel over z, threshold the
+    # projection and pass it straight to the cell selection, without an exported TIFF
+    filename = projection_name(stack_path, channel)
+
+    with stage('projection', filename):
+        projection = max_projection(stack_path, channel, z_planes)
+    with stage('threshold_projection', filename):
+        image_array = threshold_projection(projection, stack_threshold)
+
+    # Optionally keep the projection, as the manual export would have
+    if output_folder_projections:
+        import tifffile
+        write_image(tifffile.imwrite, os.path.join(output_folder_projections, filename), projection)
+
+    extract_field_cells(image_array, filename, output_folders, min_cell_area, threshold_value, artifacts=artifacts)
+
+
+def extract_field_cells(image_array, filename, output_folders, min_cell_area=300, threshold_value=100, image_path=None, artifacts=None):
+    # Cell selection and outputs of one thresholded field already in memory. The overview is
+    # drawn on the file as cv2 reads it when there is one, else on the array itself
+    artifacts = artifacts or ArtifactPolicy()
+
+    # Label the image and keep the regions large enough to be cells
+    with stage('label', filename):
+        labels, filtered_regions = select_cells(image_array, min_cell_area)
+
+    if artifacts.summary():
+        save_field_images(image_array, labels, filtered_regions, filename, output_folders, image_path)
+
+    save_cell_images(image_array, filtered_regions, filename, output_folders, threshold_value, artifacts)
+
+
+def save_field_images(image_array, labels, filtered_regions, filename, output_folders, image_path=None):
+    # Save the selected cells mask and the overview with the numbered cell rectangles of one field,
+    # with the dpi of the field file when it has one
+    output_folder_selected_cells, output_folder_selected_cells_rectangles_numbers = output_folders[:2]
+    dpi = field_dpi(image_path) if image_path else None
+
+    # Save selected cells image
+    with stage('selected_mask', filename):
+        selected_cells_path = os.path.join(output_folder_selected_cells, f'Selected_cells_{filename}')
+        kept_labels = [region.label for region in filtered_regions]
+        selected_cells = Image.fromarray(np.isin(labels, kept_labels).astype(np.uint8) * 255)
+        write_image(partial(selected_cells.save, dpi=dpi) if dpi else selected_cells.save, selected_cells_path)
+
+    # Draw rectangles and numbers on cells
+    with stage('overview', filename):
+        image_cv2 = cv2.imread(image_path) if image_path else overview_strip(image_array)
+        draw_cell_numbers(image_cv2, filtered_regions)
+
+        # Save image with rectangles and cell numbers
+        output_image_path = os.path.join(output_folder_selected_cells_rectangles_numbers,
+                                         f'Selected_cells_rectangles_numbers_{filename}')
+        dpi_params = [cv2.IMWRITE_TIFF_RESUNIT, 2, cv2.IMWRITE_TIFF_XDPI, round(dpi[0]), cv2.IMWRITE_TIFF_YDPI, round(dpi[1])] if dpi else []
+        write_image(cv2.imwrite, output_image_path, image_cv2, dpi_params)
+
+
+def save_cell_images(image_array, filtered_regions, filename, output_folders, threshold_value=100, artifacts=None):
+    # Save individual cell images (as the artifact policy asks for, in one archive per field with --artifact-archive)
+    artifacts = artifacts or ArtifactPolicy()
+    output_directory = os.path.join(output_folders[2], f'Individual_Cells_{filename}')
     
-    # Create folders for saving results
-    output_folder_selected_cells = f'Selected cells {group} {region}'
-    output_folder_selected_cells_rectangles_numbers = f'Selected cells rectangles numbers {group} {region}'
-    output_folder_individual_cells = f'Individual cells {group} {region}'
-    output_folder_individual_cells_processed = f'Individual processed cells {group} {region}'
+    # Save individual processed cell images (always, the soma and skeleton analyses read them)
+    output_directory_processed_cells = os.path.join(output_folders[3], f'Individual_Processed_Cells_{filename}') 
+    os.makedirs(output_directory_processed_cells, exist_ok=True)
     
- 
-    os.makedirs(output_folder_selected_cells, exist_ok=True)
-    os.makedirs(output_folder_selected_cells_rectangles_numbers, exist_ok=True)
-    os.makedirs(output_folder_individual_cells, exist_ok=True)
-    os.makedirs(output_folder_individual_cells_processed, exist_ok=True)
+    with CellArchive(artifacts.archive_path(output_directory)) as archive:
+        for idx, region in enumerate(filtered_regions):
+            cell_id = f'{filename}_cell_{idx + 1}'
+            cell_array = np.ascontiguousarray(crop_cell(image_array, region))
 
-    
-    # Loop through each file in the folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.tif') or filename.endswith('.tiff'):
-            image_path = os.path.join(input_folder, filename)
-
-            # Open an image file
-            image = Image.open(image_path)
-
-            # Convert PIL Image to a NumPy array
-            image_array = np.array(image)
-
-            # Label connected regions in the thresholded image
-            labels = measure.label(image_array)
-
-            # Get properties of labeled regions
-            props = measure.regionprops(labels)
-
-            # Define a minimum area threshold for cells
-            min_cell_area = 300  # Adjust this based on your image
-
-            # Filter regions based on area
-            filtered_regions = [region for region in props if region.area >= min_cell_area]
-
-            # Save selected cells image
-            selected_cells_path = os.path.join(output_folder_selected_cells, f'Selected_cells_{filename}')
-            selected_cells = Image.new('L', image.size, 0)
-            for region in filtered_regions:
-                for coord in region.coords:
-                    selected_cells.putpixel((coord[1], coord[0]), 255)
-            selected_cells.save(selected_cells_path)
-
-            # Draw rectangles and numbers on cells
-            image_cv2 = cv2.imread(image_path)
-            for idx, region in enumerate(filtered_regions):
-                min_row, min_col, max_row, max_col = region.bbox
-                cv2.rectangle(image_cv2, (min_col, min_row), (max_col, max_row), (0, 255, 0), 2)
-                cv2.putText(image_cv2, str(idx + 1), (min_col, min_row), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-
-            # Save image with rectangles and cell numbers
-            output_image_path = os.path.join(output_folder_selected_cells_rectangles_numbers,
-                                             f'Selected_cells_rectangles_numbers_{filename}')
-            cv2.imwrite(output_image_path, image_cv2)
-
-            # Save individual cell images
-            output_directory = os.path.join(output_folder_individual_cells, f'Individual_Cells_{filename}')
-            os.makedirs(output_directory, exist_ok=True)
-            
-            # Save individual processed cell images
-            output_directory_processed_cells = os.path.join(output_folder_individual_cells_processed, f'Individual_Processed_Cells_{filename}') 
-            os.makedirs(output_directory_processed_cells, exist_ok=True)
-            
-            for idx, region in enumerate(filtered_regions):
-                cell_coords = region.coords
-                min_row, min_col = np.min(cell_coords, axis=0)
-                max_row, max_col = np.max(cell_coords, axis=0)
-                cell_image = image.crop((min_col, min_row, max_col, max_row))
-                cell_image.save(os.path.join(output_directory, f'{filename}_cell_{idx + 1}.png'))
-                
-              # Convert PIL Image to a NumPy array
-                cell_array = np.array(cell_image)
-
-              # Thresholding
-                threshold_value = 100  # Adjust this threshold based on your image
-                cell_binary = cv2.threshold(cell_array, threshold_value, 255, cv2.THRESH_BINARY)[1]
-
-              # Remove small objects (noise)
-                cell_binary = remove_small_objects(cell_binary.astype(bool), min_size=100).astype(np.uint8) * 255
-
-              # Save processed individual cell image
-                cell_image_processed = Image.fromarray(cell_binary)
-                cell_image_processed.save(os.path.join(output_directory_processed_cells, f'{filename}_cell_{idx + 1}_processed.png'))
-                
-
-            
-    
\ No newline at end of file
+            # Threshold the cell and remove small objects (noise)
+            with stage('threshold', cell_id):
+                cell_binary = threshold_cell(cell_array, threshold_value)
+
+            # Save the individual and the processed individual cell images
+            with stage('write_images', cell_id):
+                if artifacts.cell(f'{cell_id}_processed', flag_cell(cell_binary)):
+                    if artifacts.archive:
+                        archive.add(cell_id, cell_array)
+                    else:
+                        os.makedirs(output_directory, exist_ok=True)
+                        write_image(Image.fromarray(cell_array).save, os.path.join(output_directory, f'{cell_id}.png'))
+                write_image(Image.fromarray(cell_binary).save, os.path.join(output_directory_processed_cells, f'{cell_id}_processed.png'))
+
+
+def draw_cell_numbers(image_bgr, filtered_regions, row_offset=0):
+    # Draw the rectangle and number of every cell; row_offset is the first image row of image_bgr,
+    # which may be a strip of the image. Cells not reaching into the strip are skipped (the
+    # numbers are drawn above the rectangles, the rectangle lines are two pixels wide)
+    for idx, region in enumerate(filtered_regions):
+        min_row, min_col, max_row, max_col = region.bbox
+        if max_row + 2 < row_offset or min_row - 40 > row_offset + image_bgr.shape[0]:
+            continue
+        cv2.rectangle(image_bgr, (min_col, min_row - row_offset), (max_col, max_row - row_offset), (0, 255, 0), 2)
+        cv2.putText(image_bgr, str(idx + 1), (min_col, min_row - row_offset), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+
+
+def extract_cells_tiled(image_path, output_folders, min_cell_area=300, threshold_value=100, strip_rows=2048, artifacts=None):
+    # Same outputs as extract_cells for fields too large to load: the TIFF is memory-mapped and
+    # labeled in strips of strip_rows rows, and the selection and overview images are written
+    # strip by strip into memory-mapped TIFFs, so memory stays bounded by the strip size
+    output_folder_selected_cells, output_folder_selected_cells_rectangles_numbers = output_folders[:2]
+    filename = os.path.basename(image_path)
+    artifacts = artifacts or ArtifactPolicy()
+
+    # tifffile is only needed for stacks and tiled fields, plain fields are read with Pillow
+    import tifffile
+    with stage('decode', filename):
+        image_array = open_field(image_path)
+        resolution = field_resolution(image_path)
+
+    # Label the strips and stitch the cells crossing strip borders
+    with stage('label', filename):
+        field_labels, filtered_regions = label_field(image_array, min_cell_area, strip_rows)
+
+    if artifacts.summary():
+        # Save selected cells image
+        with stage('selected_mask', filename):
+            selected_cells = tifffile.memmap(os.path.join(output_folder_selected_cells, f'Selected_cells_{filename}'),
+                                             shape=image_array.shape[:2], dtype=np.uint8, **resolution)
+            for start, strip_labels in selected_strips(image_array, field_labels):
+                selected_cells[start:start + strip_rows] = (strip_labels > 0).astype(np.uint8) * 255
+            selected_cells.flush()
+            del selected_cells
+
+        # Draw rectangles and numbers on cells
+        with stage('overview', filename):
+            overview = tifffile.memmap(os.path.join(output_folder_selected_cells_rectangles_numbers, f'Selected_cells_rectangles_numbers_{filename}'),
+                                       shape=image_array.shape[:2] + (3,), dtype=np.uint8, photometric='rgb', **resolution)
+            for start in range(0, image_array.shape[0], strip_rows):
+                strip_bgr = overview_strip(np.asarray(image_array[start:start + strip_rows]))
+                draw_cell_numbers(strip_bgr, filtered_regions, start)
+                overview[start:start + strip_rows] = strip_bgr[..., ::-1]
+            overview.flush()
+            del overview
+
+    save_cell_images(image_array, filtered_regions, filename, output_folders, threshold_value, artifacts)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Select the cells of every thresholded TIFF in a folder and save them as individual images.')
+    parser.add_argument('input_folder', nargs='?', help='Folder with the thresholded TIFF images (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region used in the output folder names (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group used in the output folder names (asked when omitted)')
+    parser.add_argument('--output-folder', default='.', help='Folder where the result folders are created (default: current folder)')
+    parser.add_argument('--min-cell-area', type=int, default=300, help='Minimum area in pixels of a selected cell (default: 300)')
+    parser.add_argument('--threshold-value', type=int, default=100, help='Threshold applied to every cell crop (default: 100)')
+    parser.add_argument('--channel', type=int, default=0, help='Channel projected from CZI and OME-TIFF stacks (default: 0)')
+    parser.add_argument('--z-planes', type=parse_plane_range, help='Z planes projected from stacks as START:STOP, 0-based with STOP excluded (default: all)')
+    parser.add_argument('--stack-threshold', type=float, help="Threshold of the stack projections (default: Otsu's threshold)")
+    parser.add_argument('--save-projections', action='store_true', help='Also save the maximum projection of every stack')
+    parser.add_argument('--tile-rows', type=int, help='Memory-map every TIFF and process it in strips of this many rows, for stitched fields too large to load')
+    add_artifact_arguments(parser)
+    add_io_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def read_plain_field(image_path, tile_rows=None):
+    # Decode the plain TIFFs ahead of time; stacks and tiled fields are read lazily later instead
+    if tile_rows or is_stack(image_path):
+        return None
+    return read_field(image_path)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_tracing(args.trace, new_trace=True)
+    start_writing(args.io_threads, args.io_queue)
+
+    region = ask_value(args.region, 'Enter region:')
+    group = ask_value(args.group, 'Enter the experimental group:')
+
+    # Ask user to select the input folder
+    input_folder = ask_directory(args.input_folder, "Select Input Folder")
+
+    if input_folder:
+        
+        # Create folders for saving results
+        output_folders = (os.path.join(args.output_folder, f'Selected cells {group} {region}'),
+                          os.path.join(args.output_folder, f'Selected cells rectangles numbers {group} {region}'),
+                          os.path.join(args.output_folder, f'Individual cells {group} {region}'),
+                          os.path.join(args.output_folder, f'Individual processed cells {group} {region}'))
+        
+        for output_folder in output_folders:
+            os.makedirs(output_folder, exist_ok=True)
+
+        # Which selection, overview and raw cell images to write
+        artifacts = open_artifacts(args)
+
+        output_folder_projections = None
+        if args.save_projections:
+            output_folder_projections = os.path.join(args.output_folder, f'Projections {group} {region}')
+            os.makedirs(output_folder_projections, exist_ok=True)
+
+        # Loop through each file in the folder, reading the next field while the current one is processed
+        image_paths = [os.path.join(input_folder, filename) for filename in os.listdir(input_folder)
+                       if filename.endswith('.czi') or filename.endswith('.tif') or filename.endswith('.tiff')]
+        for image_path, image_array in prefetch(partial(read_plain_field, tile_rows=args.tile_rows), image_paths, args.io_threads, depth=1):
+            if image_array is not None:
+                extract_cells(image_path, output_folders, args.min_cell_area, args.threshold_value, image_array, artifacts)
+            elif is_stack(image_path):
+                extract_stack_cells(image_path, output_folders, args.min_cell_area, args.threshold_value,
+                                    args.channel, args.z_planes, args.stack_threshold, output_folder_projections, artifacts)
+            else:
+                extract_cells_tiled(image_path, output_folders, args.min_cell_area, args.threshold_value, args.tile_rows, artifacts)
+
+    finish_writing()
+    finish_tracing(args.trace)
+
+
+if __name__ == '__main__':
+    main()
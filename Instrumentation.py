@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from microglia.tracing import stage, start_tracing, stop_tracing
+
+
+def summarize_trace(path):
+    # Aggregate the trace per stage: count, total and mean wall time, total process CPU time and the
+    # highest process peak RSS of any run of the stage
+    summary = {}
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            stage_summary = summary.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'process_cpu_s': 0.0, 'process_peak_rss': 0})
+            stage_summary['count'] += 1
+            stage_summary['wall_s'] += record['wall_s']
+            stage_summary['process_cpu_s'] += record['process_cpu_s']
+            stage_summary['process_peak_rss'] = max(stage_summary['process_peak_rss'], record['process_peak_rss'] or 0)
+
+    for stage_summary in summary.values():
+        stage_summary['mean_wall_s'] = stage_summary['wall_s'] / stage_summary['count']
+
+    return summary
+
+
+def finish_tracing(path):
+    # Stop tracing, then print the per-stage summary and save it next to the trace
+    stop_tracing()
+    if not path:
+        return None
+
+    summary = summarize_trace(path)
+    with open(os.path.splitext(path)[0] + '_summary.json', 'w') as file:
+        json.dump(summary, file, indent=2)
+
+    total_wall = sum(stage_summary['wall_s'] for stage_summary in summary.values()) or 1.0
+    print('CPU time and peak RSS are those of the whole process while the stage ran')
+    print(f"{'Stage':<20}{'Count':>8}{'Wall (s)':>12}{'Share':>8}{'CPU (s)':>12}{'Peak RSS (MB)':>15}")
+    for name, stage_summary in sorted(summary.items(), key=lambda item: -item[1]['wall_s']):
+        print(f"{name:<20}{stage_summary['count']:>8}{stage_summary['wall_s']:>12.3f}{stage_summary['wall_s'] / total_wall:>8.1%}"
+              f"{stage_summary['process_cpu_s']:>12.3f}{stage_summary['process_peak_rss'] / (1024 * 1024):>15.1f}")
+
+    return summary
+
+
+def add_trace_arguments(parser):
+    # Command-line option shared by every script that can be instrumented
+    parser.add_argument('--trace', help='Write per-stage timing and memory records to this JSON lines file and print a summary at the end')
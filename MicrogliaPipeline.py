@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from CommandLine import ask_value, ask_directory
+from microglia import select_cells, crop_cell, analyze_cell, selected_cell_labels, analyze_labeled_field
+from IndividualCellSelectandExtract import read_field
+from ResultCache import add_cache_arguments, open_cache
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from AsyncImageIO import start_writing, finish_writing, write_image, prefetch, add_io_arguments
+from ArtifactPolicy import ArtifactPolicy, CellArchive, flag_cell, save_cell_image, add_artifact_arguments, open_artifacts
+from ResultsWriter import RESULT_COLUMNS, METRICS_COLUMNS, add_results_arguments, results_path, open_results_writer, finish_results
+
+
+def result_columns(morphology=False):
+    # Columns of the results table, with the Sholl, fractal and hull metrics when asked for
+    return RESULT_COLUMNS + METRICS_COLUMNS if morphology else RESULT_COLUMNS
+
+
+def analyze_field(image_path, min_cell_area=300, threshold_value=100, output_folder_images=None, cache=None, field_mode=False, image_array=None,
+                  morphology=False, artifacts=None):
+    # Label one thresholded image once and measure every selected cell in memory.
+    # Returns one [cell_id] + soma + skeleton measurement row per cell.
+    # image_array may be passed when the image was already read (e.g. prefetched).
+    # With output_folder_images, the images the artifact policy asks for are saved there
+    filename = os.path.basename(image_path)
+    artifacts = artifacts or ArtifactPolicy()
+    if output_folder_images:
+        output_directory = os.path.join(output_folder_images, f'Cells_{filename}')
+
+    # Reuse the cached rows of an unchanged image (unless its images still have to be written)
+    if cache is not None:
+        key = cache.key('pipeline', image_path, {'filename': filename, 'min_cell_area': min_cell_area, 'threshold_value': threshold_value,
+                                                 'min_soma_area': 50, 'erosion_kernel': 3, 'columns': result_columns(morphology), 'field_mode': field_mode})
+        cached = cache.get(key)
+        if cached is not None and (not output_folder_images or os.path.isdir(output_directory) or os.path.exists(artifacts.archive_path(output_directory))):
+            return cached[0]
+
+    # Open the image and label its cells
+    if image_array is None:
+        image_array = read_field(image_path)
+    with stage('label', filename):
+        labels, filtered_regions = select_cells(image_array, min_cell_area)
+
+    # Optionally keep the intermediate images of the cells, as files or in one archive per field
+    if output_folder_images:
+        os.makedirs(output_folder_images if artifacts.archive else output_directory, exist_ok=True)
+
+    # Field mode: measure all cells at once on the label image, each on its own pixels only
+    if field_mode:
+        cell_labels = selected_cell_labels(labels, filtered_regions)
+        measurements, soma_labels, skeleton = analyze_labeled_field(image_array, cell_labels, len(filtered_regions), threshold_value,
+                                                                    field_id=filename, field_images=bool(output_folder_images), morphology=morphology)
+        rows = [[f'{filename}_cell_{idx + 1}_processed'] + cell_measurements for idx, cell_measurements in enumerate(measurements)]
+
+        # The field images are the summary images of field mode
+        if output_folder_images:
+            os.makedirs(output_directory, exist_ok=True)
+            with stage('write_images', filename):
+                write_image(cv2.imwrite, os.path.join(output_directory, f'Soma_{filename}.png'), (soma_labels > 0).astype(np.uint8) * 255)
+                write_image(cv2.imwrite, os.path.join(output_directory, f'Skeletonize_{filename}.png'), skeleton.astype(np.uint8) * 255)
+        if cache is not None:
+            cache.put(key, rows)
+        return rows
+
+    rows = []
+    archive = CellArchive(artifacts.archive_path(output_directory)) if output_folder_images and artifacts.archive else None
+    for idx, region in enumerate(filtered_regions):
+        # Same Cell ID as the processed PNG of the staged pipeline
+        cell_id = f'{filename}_cell_{idx + 1}_processed'
+
+        # Crop, threshold and clean the cell exactly as the extraction step does, and pass the
+        # binary cell straight to the soma and skeleton analysis
+        cell_array = crop_cell(image_array, region)
+        cell_binary, soma, result, segmented_image, measurements = analyze_cell(cell_array, threshold_value, morphology, cell_id)
+        rows.append([cell_id] + measurements)
+
+        if output_folder_images and artifacts.cell(cell_id, flag_cell(cell_binary, measurements[0], result)):
+            with stage('write_images', cell_id):
+                if archive is None:
+                    write_image(Image.fromarray(cell_array).save, os.path.join(output_directory, f'{filename}_cell_{idx + 1}.png'))
+                else:
+                    archive.add(f'{filename}_cell_{idx + 1}', cell_array)
+                save_cell_image(os.path.join(output_directory, f'{cell_id}.png'), cell_binary, archive)
+                save_cell_image(os.path.join(output_directory, f'Soma_{cell_id}.png'), soma, archive)
+                save_cell_image(os.path.join(output_directory, f'Skeletonize_{cell_id}.png'), result.skeleton.astype(np.uint8) * 255, archive)
+                save_cell_image(os.path.join(output_directory, f'Segmented_{cell_id}.png'), segmented_image.astype(np.uint8) * 255, archive)
+
+    if archive is not None:
+        archive.close()
+    if cache is not None:
+        cache.put(key, rows)
+
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Select, extract and measure (soma and skeleton) every cell of the thresholded TIFFs in a folder in one pass.')
+    parser.add_argument('input_folder', nargs='?', help='Folder with the thresholded TIFF images (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region written to the results (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group written to the results (asked when omitted)')
+    parser.add_argument('--output-folder', help='Folder for the results table and images (default: the input folder)')
+    parser.add_argument('--min-cell-area', type=int, default=300, help='Minimum area in pixels of a selected cell (default: 300)')
+    parser.add_argument('--threshold-value', type=int, default=100, help='Threshold applied to every cell crop (default: 100)')
+    parser.add_argument('--save-images', action='store_true', help='Also save the cell, processed, soma, skeleton and segmented images (same as --artifacts all)')
+    parser.add_argument('--field-mode', action='store_true', help='Measure all cells of a field in one pass on the label image, without per-cell crops. '
+                        'Every cell is measured on its own pixels only, so pieces of neighbouring cells inside its bounding box no longer count')
+    parser.add_argument('--morphology', action='store_true', help='Also measure Sholl intersections, fractal dimension and convex hull of every cell')
+    add_artifact_arguments(parser, default='none')
+    add_results_arguments(parser)
+    add_cache_arguments(parser)
+    add_io_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = open_cache(args)
+    start_tracing(args.trace, new_trace=True)
+    start_writing(args.io_threads, args.io_queue)
+
+    # Get the region and group from the command line or the user
+    region = ask_value(args.region, "Enter the region: ")
+    group = ask_value(args.group, "Enter the group: ")
+
+    # Get the folder with the thresholded images
+    input_folder = ask_directory(args.input_folder, "Select Input Folder")
+
+    if input_folder:
+        output_folder = args.output_folder or input_folder
+        os.makedirs(output_folder, exist_ok=True)
+
+        # Images are only written when asked for (--save-images or --artifacts)
+        artifacts = open_artifacts(args, 'all' if args.save_images else None)
+        output_folder_images = None
+        if artifacts.summary():
+            output_folder_images = os.path.join(output_folder, f'Pipeline images {group} {region}')
+
+        # Stream one row of soma and skeleton measurements per cell into the results table
+        output_path = results_path(output_folder, f'Microglia_Measurements_{region}_{group}', args.output_format)
+        with open_results_writer(output_path, result_columns(args.morphology), args.output_format) as writer:
+
+            # Loop through each file in the folder, reading the next field on the I/O threads while the
+            # current one is measured (without them every field is read when needed, a cached one not at all)
+            image_paths = [os.path.join(input_folder, filename) for filename in sorted(os.listdir(input_folder))
+                           if filename.endswith('.tif') or filename.endswith('.tiff')]
+            read = read_field if args.io_threads else lambda image_path: None
+            for image_path, image_array in prefetch(read, image_paths, args.io_threads, depth=1):
+                rows = analyze_field(image_path, args.min_cell_area, args.threshold_value, output_folder_images, cache, args.field_mode, image_array,
+                                    args.morphology, artifacts)
+                for row in rows:
+                    writer.write_row([row[0], region, group] + row[1:])
+
+        output_path = finish_results(output_path, args.output_format, args.excel)
+        print(f"Microglia measurements saved to {output_path}")
+
+    finish_writing()
+    finish_tracing(args.trace)
+
+
+if __name__ == '__main__':
+    main()
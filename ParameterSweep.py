@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+from collections import namedtuple
+from itertools import product
+import cv2
+from CommandLine import ask_value, ask_directory
+from microglia import (select_cells, crop_cell, label_objects, keep_objects, measure_soma, analyze_skeleton_array, skeleton_measurements,
+                       cell_center, sholl_profile, sholl_measurements, fractal_dimension, hull_measurements)
+from IndividualCellSelectandExtract import read_field
+from MicrogliaPipeline import result_columns
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from AsyncImageIO import prefetch, add_io_arguments
+from ResultsWriter import add_results_arguments, results_path, open_results_writer, finish_results
+
+
+# One point of the parameter grid: the cell area cutoff, the threshold of the cell crops, the
+# object size cutoff after thresholding, the soma object size cutoff and the soma erosion kernel size
+ParameterSet = namedtuple('ParameterSet', ['min_cell_area', 'threshold_value', 'min_object_size', 'min_soma_area', 'erosion_kernel'])
+
+
+def parameter_grid(min_cell_areas=(300,), threshold_values=(100,), min_object_sizes=(100,), min_soma_areas=(50,), erosion_kernels=(3,)):
+    # Every combination of the swept values. A value given twice is swept once, so that no parameter
+    # set is analyzed (and appended to its results) twice
+    value_lists = [list(dict.fromkeys(values)) for values in (min_cell_areas, threshold_values, min_object_sizes, min_soma_areas, erosion_kernels)]
+    return [ParameterSet(*values) for values in product(*value_lists)]
+
+
+def parameter_tag(parameters):
+    # Short name of a parameter set for the results file, e.g. area300_threshold100_objects100_soma50_kernel3
+    return (f'area{parameters.min_cell_area}_threshold{parameters.threshold_value}_objects{parameters.min_object_size}'
+            f'_soma{parameters.min_soma_area}_kernel{parameters.erosion_kernel}')
+
+
+def threshold_components(cell_array, threshold_value):
+    # Threshold a cell crop and label its objects once (4-connectivity, like threshold_cell),
+    # so that every small object cutoff is one lookup of the object sizes (keep_objects)
+    return label_objects(cv2.threshold(cell_array, threshold_value, 255, cv2.THRESH_BINARY)[1])
+
+
+def sweep_field(image_path, parameter_sets, image_array=None, morphology=False):
+    # Measure every cell of one thresholded image for every parameter set, in the same way as the
+    # crop mode of MicrogliaPipeline. Work shared by parameter sets is done once: the image is read
+    # and labeled once, each crop is thresholded and labeled once per threshold, and the skeleton
+    # analysis (and the fractal and hull metrics) runs once per (threshold, min_object_size).
+    # Returns {parameter set: rows}
+    filename = os.path.basename(image_path)
+
+    if image_array is None:
+        image_array = read_field(image_path)
+    with stage('label', filename):
+        labels, regions = select_cells(image_array, min(parameters.min_cell_area for parameters in parameter_sets))
+
+    rows = {parameters: [] for parameters in parameter_sets}
+    cell_numbers = {min_cell_area: 0 for min_cell_area in set(parameters.min_cell_area for parameters in parameter_sets)}
+    for region in regions:
+        # Cell number of the region for every area cutoff that selects it (the cell IDs of a normal run)
+        for min_cell_area in cell_numbers:
+            if region.area >= min_cell_area:
+                cell_numbers[min_cell_area] += 1
+        selected = [parameters for parameters in parameter_sets if region.area >= parameters.min_cell_area]
+        if not selected:
+            continue
+
+        cell_array = crop_cell(image_array, region)
+        components = {}
+        skeletons = {}
+        for parameters in selected:
+            cell_id = f'{filename}_cell_{cell_numbers[parameters.min_cell_area]}_processed'
+
+            if parameters.threshold_value not in components:
+                with stage('threshold', cell_id):
+                    components[parameters.threshold_value] = threshold_components(cell_array, parameters.threshold_value)
+
+            cleaning = (parameters.threshold_value, parameters.min_object_size)
+            if cleaning not in skeletons:
+                cell_binary = keep_objects(*components[parameters.threshold_value], parameters.min_object_size)
+                result, _, num_ramifications, graph = analyze_skeleton_array(cell_binary, cell_id)
+                shape_metrics = None
+                if morphology:
+                    with stage('metrics', cell_id):
+                        shape_metrics = [fractal_dimension(cell_binary > 0)] + hull_measurements(cell_binary)
+                skeletons[cleaning] = cell_binary, result, skeleton_measurements(result, num_ramifications, graph), shape_metrics
+            cell_binary, result, measurements, shape_metrics = skeletons[cleaning]
+
+            with stage('soma', cell_id):
+                soma, area, perimeter = measure_soma(cell_binary, parameters.min_soma_area, parameters.erosion_kernel)
+
+            row = [cell_id, area, perimeter] + measurements
+            if morphology:
+                # Only the Sholl centre depends on the soma parameters
+                with stage('metrics', cell_id):
+                    intersections = sholl_profile(result.skeleton, cell_center(cell_binary > 0, soma))
+                    row += sholl_measurements(intersections) + shape_metrics
+            rows[parameters].append(row)
+
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Measure every cell of the thresholded TIFFs in a folder for a grid of parameters in one pass, '
+                                                 'writing one results table per parameter set.')
+    parser.add_argument('input_folder', nargs='?', help='Folder with the thresholded TIFF images (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region written to the results (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group written to the results (asked when omitted)')
+    parser.add_argument('--output-folder', help='Folder for the results tables (default: the input folder)')
+    parser.add_argument('--min-cell-area', type=int, nargs='+', default=[300], help='Minimum areas in pixels of a selected cell (default: 300)')
+    parser.add_argument('--threshold-value', type=int, nargs='+', default=[100], help='Thresholds applied to every cell crop (default: 100)')
+    parser.add_argument('--min-object-size', type=int, nargs='+', default=[100], help='Objects of this many pixels or fewer are removed from a thresholded cell (default: 100)')
+    parser.add_argument('--min-soma-area', type=int, nargs='+', default=[50], help='Objects of this many pixels or fewer are removed before the soma erosion (default: 50)')
+    parser.add_argument('--erosion-kernel', type=int, nargs='+', default=[3], help='Sizes of the square soma erosion kernel (default: 3)')
+    parser.add_argument('--morphology', action='store_true', help='Also measure Sholl intersections, fractal dimension and convex hull of every cell')
+    add_results_arguments(parser)
+    add_io_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_tracing(args.trace, new_trace=True)
+
+    # Get the region and group from the command line or the user
+    region = ask_value(args.region, "Enter the region: ")
+    group = ask_value(args.group, "Enter the group: ")
+
+    # Get the folder with the thresholded images
+    input_folder = ask_directory(args.input_folder, "Select Input Folder")
+
+    if input_folder:
+        output_folder = args.output_folder or input_folder
+        os.makedirs(output_folder, exist_ok=True)
+        parameter_sets = parameter_grid(args.min_cell_area, args.threshold_value, args.min_object_size, args.min_soma_area, args.erosion_kernel)
+
+        # One results table per parameter set, filled field by field
+        output_paths = {parameters: results_path(output_folder, f'Microglia_Measurements_{region}_{group}_{parameter_tag(parameters)}', args.output_format)
+                        for parameters in parameter_sets}
+        writers = {parameters: open_results_writer(output_paths[parameters], result_columns(args.morphology), args.output_format)
+                   for parameters in parameter_sets}
+        try:
+            image_paths = [os.path.join(input_folder, filename) for filename in sorted(os.listdir(input_folder))
+                           if filename.endswith('.tif') or filename.endswith('.tiff')]
+            for image_path, image_array in prefetch(read_field, image_paths, args.io_threads, depth=1):
+                for parameters, rows in sweep_field(image_path, parameter_sets, image_array, args.morphology).items():
+                    for row in rows:
+                        writers[parameters].write_row([row[0], region, group] + row[1:])
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        for parameters in parameter_sets:
+            output_path = finish_results(output_paths[parameters], args.output_format, args.excel)
+            print(f"Measurements for {parameter_tag(parameters)} saved to {output_path}")
+
+    finish_tracing(args.trace)
+
+
+if __name__ == '__main__':
+    main()
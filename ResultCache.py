@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import zipfile
+import zlib
+import numpy as np
+from ResultsWriter import json_default
+
+
+# Bump when the analysis changes so that older cached results are not reused
+CACHE_VERSION = 3
+
+
+class ResultCache:
+    # Persistent on-disk cache of per-cell results, keyed by the content hash of the input
+    # image plus the analysis parameters. Every entry is one NPZ file holding the measurement
+    # values (as JSON) and the arrays needed to rewrite the output images
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, image_path, params):
+        # Hash the image content, the stage and the parameters
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps({'stage': stage, 'version': CACHE_VERSION, 'params': params}, sort_keys=True).encode())
+        return f'{stage}-{digest.hexdigest()}'
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        # Return (values, arrays) of a cached result, or None on a miss. A corrupt or truncated
+        # entry (e.g. left by a full disk) is a miss too and is simply written again
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files if name != '__values__'}
+                values = json.loads(str(entry['__values__']))
+        except (FileNotFoundError, ValueError, OSError, KeyError, EOFError, zipfile.BadZipFile, zlib.error):
+            return None
+
+        # Mark the entry as recently used for the size-based eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return values, arrays
+
+    def put(self, key, values, arrays=None):
+        # Write the entry to a temporary file first so that readers never see a partial entry
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, __values__=np.array(json.dumps(values, default=json_default)), **(arrays or {}))
+        path = self.entry_path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(buffer.getvalue())
+        os.replace(temporary_path, path)
+
+        if self.max_bytes:
+            if self.total_bytes is None:
+                self.total_bytes = self.size()
+            else:
+                self.total_bytes += buffer.tell()
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self, stage=None):
+        # (path, size, last use) of every cache entry, optionally of one stage only
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz') and (stage is None or name.startswith(f'{stage}-')):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, status.st_size, status.st_mtime))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        # Remove the least recently used entries until the cache fits in max_bytes
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total_bytes <= max_bytes:
+                break
+            _remove(path)
+            total_bytes -= size
+            removed += 1
+        self.total_bytes = total_bytes
+        return removed
+
+    def clear(self, stage=None):
+        # Invalidate every entry, or only the entries of one stage
+        entries = self.entries(stage)
+        for path, _, _ in entries:
+            _remove(path)
+        self.total_bytes = None
+        return len(entries)
+
+
+def _remove(path):
+    # Another process may have evicted the entry already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def add_cache_arguments(parser):
+    # Command-line options shared by every script that can reuse cached results
+    parser.add_argument('--cache-dir', help='Folder of the result cache; unchanged cells are not recomputed on reruns')
+    parser.add_argument('--cache-max-mb', type=float, help='Evict the least recently used cache entries above this size')
+
+
+def open_cache(args):
+    # Result cache from the command-line options, or None when caching is off
+    if not args.cache_dir:
+        return None
+    max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None
+    return ResultCache(args.cache_dir, max_bytes)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect, evict or invalidate a result cache.')
+    parser.add_argument('command', choices=['info', 'evict', 'clear'], help='info: show the cache size; evict: shrink it to --max-mb; clear: remove entries')
+    parser.add_argument('cache_dir', help='Folder of the result cache')
+    parser.add_argument('--stage', choices=['soma', 'skeleton', 'pipeline'], help='Only clear the entries of this stage')
+    parser.add_argument('--max-mb', type=float, default=0, help='Size to evict down to (default: 0)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = ResultCache(args.cache_dir)
+
+    if args.command == 'info':
+        entries = cache.entries(args.stage)
+        print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / (1024 * 1024):.1f} MB in {args.cache_dir}")
+    elif args.command == 'evict':
+        removed = cache.evict(int(args.max_mb * 1024 * 1024))
+        print(f"Evicted {removed} entries from {args.cache_dir}")
+    else:
+        removed = cache.clear(args.stage)
+        print(f"Removed {removed} entries from {args.cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
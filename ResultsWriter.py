@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import openpyxl
+from Instrumentation import stage
+
+
+# One results schema for every script: the identification columns, then the soma
+# measurements, then the skeleton measurements. Each script writes the subset it measures
+ID_COLUMNS = ["Cell ID", "Region", "Group"]
+SOMA_COLUMNS = ["Area", "Perimeter"]
+SKELETON_COLUMNS = ["# Branches", "# End Point Voxels", "# Junction Voxels", "# Slab Voxels",
+                    "# Total Branches", "# Junctions", "# Triple Points", "# Quadruple Points", "Average Branch Length", "Maximum Branch Length"]
+RESULT_COLUMNS = ID_COLUMNS + SOMA_COLUMNS + SKELETON_COLUMNS
+
+# Optional Sholl, fractal and convex hull measurements, appended after the columns above
+METRICS_COLUMNS = ["# Max Sholl Intersections", "# Sholl Intersections", "Sholl Critical Radius", "Sholl Enclosing Radius",
+                   "Fractal Dimension", "Convex Hull Area", "Convex Hull Perimeter", "Span Ratio", "Density"]
+
+# File extension of every output format
+OUTPUT_FORMATS = {'xlsx': '.xlsx', 'csv': '.csv', 'parquet': '.parquet'}
+
+
+def column_type(column):
+    # Text for the identification columns, integers for counts and floats for everything else
+    if column in ID_COLUMNS:
+        return str
+    if column.startswith('#'):
+        return int
+    return float
+
+
+def json_default(value):
+    # JSON encoding of the values json does not know: NumPy scalars are stored as plain numbers
+    return value.item()
+
+
+class CsvResultsWriter:
+    # Append rows to a CSV file, flushing every chunk_size rows
+
+    def __init__(self, path, columns, chunk_size=1000):
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        with stage('write_results'):
+            self.writer.writerows(self.rows)
+            self.rows = []
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetResultsWriter:
+    # Append rows to a Parquet file, writing one row group every chunk_size rows
+
+    def __init__(self, path, columns, chunk_size=10000):
+        # pyarrow is only needed for Parquet output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = []
+        arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+        self.schema = pa.schema([(column, arrow_types[column_type(column)]) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            with stage('write_results'):
+                # Cast NumPy scalars to plain Python values of the column type
+                types = [column_type(column) for column in self.columns]
+                table_columns = [[value_type(value) if value is not None else None for value in column]
+                                 for value_type, column in zip(types, zip(*self.rows))]
+                self.writer.write_table(self.pa.table(table_columns, schema=self.schema))
+                self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ExcelResultsWriter:
+    # Stream rows into a write-only openpyxl workbook, saved once when closed
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet()
+        self.worksheet.append(columns)
+
+    def write_row(self, row):
+        self.worksheet.append(row)
+
+    def close(self):
+        # Save the Excel workbook
+        with stage('write_results'):
+            self.workbook.save(self.path)
+            self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def results_path(output_folder, base_name, output_format):
+    # Results file for the chosen output format, e.g. Soma_Measurements_CX_MOR.csv
+    return os.path.join(output_folder, base_name + OUTPUT_FORMATS[output_format])
+
+
+def open_results_writer(path, columns, output_format=None):
+    # Pick the writer from the output format, or from the file extension
+    if output_format is None:
+        output_format = os.path.splitext(path)[1].lstrip('.').lower()
+
+    if output_format == 'csv':
+        return CsvResultsWriter(path, columns)
+    if output_format == 'parquet':
+        return ParquetResultsWriter(path, columns)
+    if output_format == 'xlsx':
+        return ExcelResultsWriter(path, columns)
+    raise ValueError(f'Unknown results format: {output_format}')
+
+
+def read_results(path, chunk_size=10000):
+    # Yield the header, then the rows of a CSV, Parquet or Excel results file in chunks
+    if path.endswith('.xlsx'):
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = list(next(rows))
+            yield header
+            # Excel stores whole floats as integers; cast back to the column type
+            types = [column_type(column) for column in header]
+            for row in rows:
+                yield [value_type(value) if value is not None else None for value_type, value in zip(types, row)]
+        finally:
+            workbook.close()
+    elif path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        yield parquet_file.schema_arrow.names
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield from zip(*[column.to_pylist() for column in batch.columns])
+    else:
+        with open(path, newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            yield header
+            types = [column_type(column) for column in header]
+            for row in reader:
+                yield [value_type(value) if value != '' else None for value_type, value in zip(types, row)]
+
+
+def export_excel(path, excel_path):
+    # Final Excel export of a CSV or Parquet results file, streamed row by row
+    rows = read_results(path)
+    with ExcelResultsWriter(excel_path, next(rows)) as writer:
+        for row in rows:
+            writer.write_row(list(row))
+
+    return excel_path
+
+
+def add_results_arguments(parser):
+    # Command-line options shared by every script that writes a results table
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS), default='xlsx',
+                        help='Format of the results table (default: xlsx)')
+    parser.add_argument('--excel', action='store_true',
+                        help='Also export a CSV or Parquet results table to Excel at the end of the run')
+
+
+def finish_results(path, output_format, excel):
+    # Optional Excel export once the streamed results table is complete
+    if excel and output_format != 'xlsx':
+        return export_excel(path, os.path.splitext(path)[0] + '.xlsx')
+    return path
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from ResultsWriter import json_default
+
+
+# Bump when the record layout changes so that older manifests are not resumed
+MANIFEST_VERSION = 1
+
+
+class RunManifest:
+    # Append-only JSON lines file with one record per completed task (cell) and its result row.
+    # Every record is handed to the operating system before the next task starts, so a crash or
+    # preemption of the process loses at most the task in progress. Records are fsynced to disk
+    # every sync_every records and on close only, since every fsync is a synchronous round trip on
+    # network storage; a failure of the whole node loses at most the unsynced records, which are
+    # then simply analyzed again. A partly written last line is ignored when resuming.
+    # The first line describes the run (script, columns, parameters), so that a run is only
+    # resumed with the same settings
+
+    def __init__(self, path, header, resume=False, sync_every=100):
+        self.path = path
+        self.completed = {}
+        self.sync_every = sync_every
+        self.unsynced = 0
+        header = dict(header, version=MANIFEST_VERSION)
+
+        if resume and os.path.exists(path):
+            self.completed = self.load(header)
+            self.file = open(path, 'a')
+            self.truncate_partial_line()
+        else:
+            self.file = open(path, 'w')
+            self.write_line(header)
+
+    def load(self, header):
+        # Completed tasks of an earlier run with the same header, by task ID
+        completed = {}
+        with open(self.path) as file:
+            lines = file.read().split('\n')
+
+        try:
+            previous_header = json.loads(lines[0])
+        except ValueError:
+            previous_header = None
+        if previous_header != header:
+            raise ValueError(f'{self.path} was written by a run with other settings; rerun without --resume')
+
+        # The last piece is empty, or a line cut short by a crash
+        for line in lines[1:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            completed[record['task']] = record['row']
+        return completed
+
+    def truncate_partial_line(self):
+        # Drop a last line cut short by a crash, so that the next record starts on its own line
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        end = content.rfind(b'\n') + 1
+        if end < len(content):
+            self.file.truncate(end)
+
+    def write_line(self, record):
+        self.file.write(json.dumps(record, default=json_default) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def record(self, task, row):
+        self.completed[task] = row
+        self.write_line({'task': task, 'row': row})
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def manifest_path(results_path):
+    # Manifest next to the results table, e.g. Soma_Measurements_CX_MOR.manifest.jsonl
+    return os.path.splitext(results_path)[0] + '.manifest.jsonl'
+
+
+def resume_results(manifest, tasks, task_ids, process):
+    # Yield the result row of every task in the order of tasks: completed tasks from the manifest,
+    # the others from process(pending tasks), recording each one as soon as it is yielded
+    pending = [task for task, task_id in zip(tasks, task_ids) if task_id not in manifest.completed]
+    if len(pending) < len(tasks):
+        print(f"Resuming: {len(tasks) - len(pending)} of {len(tasks)} cells already done")
+
+    results = iter(process(pending))
+    for task_id in task_ids:
+        if task_id in manifest.completed:
+            yield manifest.completed[task_id]
+        else:
+            row = next(results)
+            manifest.record(task_id, row)
+            yield row
+
+
+def add_manifest_arguments(parser):
+    # Command-line options shared by every script that can resume an interrupted run
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the cells completed by an interrupted run (recorded in the .manifest.jsonl next to the results) and merge them into the results')
+    parser.add_argument('--manifest-sync', type=int, default=100, metavar='N',
+                        help='Sync the run manifest to disk every N cells; a node failure loses at most N recorded cells (default: 100)')
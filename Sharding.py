@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+from ResultsWriter import OUTPUT_FORMATS, read_results, open_results_writer, results_path, finish_results
+
+
+def parse_shard(text):
+    # 'K/N' (shard K of N, K counted from 0) as a (K, N) tuple
+    try:
+        index, count = (int(value) for value in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected K/N, got {text!r}')
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard {index} does not exist among {count} shards (K counts from 0)')
+    return index, count
+
+
+def select_shard(tasks, task_ids, shard=None, by='index'):
+    # Tasks (and their IDs) of one shard. By index, the shards are consecutive blocks of the
+    # task list, so merging them in shard order gives the rows of an unsharded run. By hash,
+    # every task ID always lands in the same shard, even when files are added or removed
+    if shard is None:
+        return tasks, task_ids
+    index, count = shard
+
+    if by == 'index':
+        keep = [position * count // len(tasks) == index for position in range(len(tasks))]
+    else:
+        keep = [int(hashlib.sha1(task_id.encode()).hexdigest(), 16) % count == index for task_id in task_ids]
+
+    return ([task for task, kept in zip(tasks, keep) if kept],
+            [task_id for task_id, kept in zip(task_ids, keep) if kept])
+
+
+def shard_name(base_name, shard=None):
+    # Results name of one shard, e.g. Soma_Measurements_CX_MOR_shard3of8
+    if shard is None:
+        return base_name
+    return f'{base_name}_shard{shard[0]}of{shard[1]}'
+
+
+def shard_paths(folder, base_name):
+    # Results files of every shard of base_name in shard order. All shards of one count
+    # must be present, so that a merge never silently drops the cells of a missing shard
+    pattern = re.compile(re.escape(base_name) + r'_shard(\d+)of(\d+)(' + '|'.join(re.escape(extension) for extension in OUTPUT_FORMATS.values()) + ')$')
+    shards = {}
+    for filename in os.listdir(folder):
+        match = pattern.match(filename)
+        if match:
+            shards.setdefault(int(match.group(2)), {})[int(match.group(1))] = os.path.join(folder, filename)
+
+    if not shards:
+        raise FileNotFoundError(f'No shards of {base_name} in {folder}')
+    if len(shards) > 1:
+        raise ValueError(f'Shards of {base_name} from runs with different shard counts: {sorted(shards)}')
+
+    count, paths = shards.popitem()
+    missing = sorted(set(range(count)) - set(paths))
+    if missing:
+        names = ', '.join(shard_name(base_name, (index, count)) for index in missing)
+        raise FileNotFoundError(f'Shards {missing} of {count} of {base_name} are missing from {folder}: {names}')
+    return [paths[index] for index in range(count)]
+
+
+def read_shard(path, index):
+    # Yield the header, then the rows of one shard results file, as read_results. A file that cannot
+    # be read, has no header or has cut-short rows comes from a shard that did not finish; it is
+    # reported with its shard index instead of a traceback from the reader
+    try:
+        rows = read_results(path)
+        columns = list(next(rows))
+        if not columns:
+            raise ValueError('no header')
+        yield columns
+        for row in rows:
+            row = list(row)
+            if len(row) != len(columns):
+                raise ValueError(f'a row of {len(row)} values for {len(columns)} columns')
+            yield row
+    except FileNotFoundError:
+        raise FileNotFoundError(f'Shard {index} ({path}) is missing')
+    except Exception as error:
+        if isinstance(error, RuntimeError) and isinstance(error.__cause__, StopIteration):
+            error = 'the file is empty'
+        raise ValueError(f'Shard {index} ({path}) is incomplete or unreadable: {error}; rerun this shard')
+
+
+def merge_shards(folder, base_name, output_format='xlsx'):
+    # Concatenate the results tables of every shard into the results table of the whole run. The
+    # merged table is only kept when every shard was read in full
+    output_path = results_path(folder, base_name, output_format)
+    writer = None
+    try:
+        for index, path in enumerate(shard_paths(folder, base_name)):
+            rows = read_shard(path, index)
+            columns = next(rows)
+            if writer is None:
+                writer = open_results_writer(output_path, columns, output_format)
+            elif columns != writer.columns:
+                raise ValueError(f'Shard {index} ({path}) has other columns than the first shard')
+            for row in rows:
+                writer.write_row(row)
+    except Exception:
+        if writer is not None:
+            writer.close()
+            os.remove(output_path)
+        raise
+
+    writer.close()
+    return output_path
+
+
+def add_shard_arguments(parser):
+    # Command-line options shared by every script that can run as one shard of an array job
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                        help='Only analyze shard K of N (K counts from 0) and write <results>_shardKofN; combine the shards with Sharding.py')
+    parser.add_argument('--shard-by', choices=['index', 'hash'], default='index',
+                        help='index: consecutive blocks of the sorted cell list; hash: by the hash of the cell path (default: index)')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Merge the results tables written by the shards of a sharded run.')
+    parser.add_argument('folder', help='Folder with the shard results, e.g. the main folder of SomaMeasurements.py')
+    parser.add_argument('base_name', help='Results name without shard suffix and extension, e.g. Soma_Measurements_CX_MOR')
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS), default='xlsx', help='Format of the merged results table (default: xlsx)')
+    parser.add_argument('--excel', action='store_true', help='Also export a CSV or Parquet merged table to Excel')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        output_path = merge_shards(args.folder, args.base_name, args.output_format)
+    except (FileNotFoundError, ValueError) as error:
+        sys.exit(f'Cannot merge the shards: {error}')
+    output_path = finish_results(output_path, args.output_format, args.excel)
+    print(f"Merged results saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
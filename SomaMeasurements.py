@@ -7,112 +7,150 @@ Created on Thu Jan 18 20:50:53 2024
 """
 
 
-import tkinter as tk
-from tkinter import filedialog
+import argparse
 import os
 import cv2
-import numpy as np
-from skimage.morphology import remove_small_objects, binary_erosion, binary_closing, binary_dilation
-from skimage.measure import label, regionprops
-import openpyxl
+from microglia import measure_soma
+from ResultsWriter import ID_COLUMNS, SOMA_COLUMNS, add_results_arguments, results_path, open_results_writer, finish_results
+from ResultCache import add_cache_arguments, open_cache
+from Instrumentation import stage, add_trace_arguments, start_tracing, finish_tracing
+from Sharding import select_shard, shard_name, add_shard_arguments
+from RunManifest import RunManifest, manifest_path, resume_results, add_manifest_arguments
+from AsyncImageIO import start_writing, finish_writing, prefetch, add_io_arguments
+from ArtifactPolicy import ArtifactPolicy, CellArchive, flag_cell, save_cell_image, add_artifact_arguments, open_artifacts
+from CommandLine import ask_value, ask_directory
+
+
+def extract_soma_and_measure(cell_image_path, output_soma_path, min_soma_area=50, cache=None, cell_image=None, artifacts=None, archive=None):
+    # cell_image may be passed when the processed cell is already in memory, to skip reading it back.
+    # The soma image is saved when the artifact policy asks for it, into archive when given
+    cell_id = os.path.splitext(os.path.basename(cell_image_path))[0]
+    artifacts = artifacts or ArtifactPolicy()
+
+    # Reuse the cached measurements of an unchanged image
+    if cache is not None:
+        key = cache.key('soma', cell_image_path, {'min_soma_area': min_soma_area, 'erosion_kernel': 3})
+        cached = cache.get(key)
+        if cached is not None:
+            (area, perimeter), arrays = cached
+            if artifacts.cell(cell_id, flag_cell(soma_area=area)) and (archive is not None or not os.path.exists(output_soma_path)):
+                save_cell_image(output_soma_path, arrays['soma'], archive)
+            return cell_id, area, perimeter
 
-
-
-# Define a function to extract the cell soma
-
-def extract_soma_and_measure(cell_image_path, output_soma_path, min_soma_area=50):
     # Open the processed individual cell image
-    cell_image = cv2.imread(cell_image_path, cv2.IMREAD_GRAYSCALE)
+    if cell_image is None:
+        with stage('decode', cell_id):
+            cell_image = cv2.imread(cell_image_path, cv2.IMREAD_GRAYSCALE)
 
-    # Remove small objects (ramifications)
-    cell_binary = remove_small_objects(cell_image.astype(bool), min_size=50).astype(np.uint8) * 255
+    # Extract the soma, measure area and perimeter
+    with stage('soma', cell_id):
+        soma, area, perimeter = measure_soma(cell_image, min_soma_area)
 
-    # Erosion to extract the soma
-    kernel = np.ones((3, 3), np.uint8)
-    soma = cv2.erode(cell_binary, kernel, iterations=1)
+    # Save the extracted soma
+    if artifacts.cell(cell_id, flag_cell(soma_area=area)):
+        with stage('write_images', cell_id):
+            save_cell_image(output_soma_path, soma, archive)
 
-    # Label connected components in the soma
-    labeled_soma = label(soma)
+    if cache is not None:
+        cache.put(key, [area, perimeter], {'soma': soma})
 
-    # Get properties of labeled regions
-    props = regionprops(labeled_soma)
+    return cell_id, area, perimeter
 
-    # Check if there are any labeled regions
-    if props:
-        # Find the index of the largest region
-        largest_index = np.argmax([prop.area for prop in props])
 
-        # Create a binary mask keeping only the largest region
-        largest_soma = np.zeros_like(soma)
-        largest_soma[labeled_soma == largest_index + 1] = 255
-
-        # Save the extracted soma
-        cv2.imwrite(output_soma_path, largest_soma)
-        
-        # Measure area and perimeter
-        area = props[largest_index].area
-        perimeter = props[largest_index].perimeter
-
-        return os.path.splitext(os.path.basename(cell_image_path))[0], area, perimeter
-    
-    else:
-        # Save the original soma (no extraction performed)
-        cv2.imwrite(output_soma_path, soma)
-        
-        return os.path.splitext(os.path.basename(cell_image_path))[0], 0, 0
-
-
-# Get the region and group from the user
-region = input("Enter the region: ")
-group = input("Enter the group: ")
- 
-# Create a Tkinter window for folder selection
-root = tk.Tk()
-root.withdraw()  # Hide the root window
-
-  
-# Ask the user to select the main folder containing subfolders
-main_folder = filedialog.askdirectory(title="Select Main Folder")
-
-if main_folder:
-    
-    # Create an output parent folder
-    output_parent_folder = os.path.join(main_folder, f'Cell Soma {group} {region}')
-    os.makedirs(output_parent_folder, exist_ok=True)
-    
-    # Create an Excel workbook and add a worksheet
-    excel_path = os.path.join(main_folder, f'Soma_Measurements_{region}_{group}.xlsx')
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.append(["Cell ID", "Region","Group", "Area", "Perimeter"])
-   
-
-    # Iterate through each subfolder in the main folder
-    for subfolder_name in os.listdir(main_folder):
+def collect_cell_tasks(main_folder, output_parent_folder):
+    # List every PNG of every subfolder in a deterministic (sorted) order, so that every
+    # node of a sharded run sees the same list
+    cell_tasks = []
+    for subfolder_name in sorted(os.listdir(main_folder)):
         subfolder_path = os.path.join(main_folder, subfolder_name)
 
-        # Check if the path is a directory
-        if os.path.isdir(subfolder_path):
+        # Check if the path is a directory (skipping the output folder itself)
+        if os.path.isdir(subfolder_path) and subfolder_path != output_parent_folder:
             # Create an output folder for each subfolder in the output parent folder
             output_folder_soma = os.path.join(output_parent_folder, f'{subfolder_name}_Soma')
             os.makedirs(output_folder_soma, exist_ok=True)
 
             # Iterate through each file in the subfolder
-            for filename in os.listdir(subfolder_path):
+            for filename in sorted(os.listdir(subfolder_path)):
                 if filename.endswith('.png'):
-                    cell_image_path = os.path.join(subfolder_path, filename)
-                    output_soma_path = os.path.join(output_folder_soma, f'Soma_{filename}')
+                    cell_tasks.append((os.path.join(subfolder_path, filename), os.path.join(output_folder_soma, f'Soma_{filename}')))
+
+    return cell_tasks
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Extract and measure the soma of every processed cell PNG in the subfolders of a main folder.')
+    parser.add_argument('main_folder', nargs='?', help='Main folder containing one subfolder of cell PNGs per image (a folder dialog opens when omitted)')
+    parser.add_argument('--region', help='Region written to the results (asked when omitted)')
+    parser.add_argument('--group', help='Experimental group written to the results (asked when omitted)')
+    add_artifact_arguments(parser)
+    add_results_arguments(parser)
+    add_cache_arguments(parser)
+    add_manifest_arguments(parser)
+    add_shard_arguments(parser)
+    add_io_arguments(parser)
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = open_cache(args)
+    start_tracing(args.trace, new_trace=True)
+    start_writing(args.io_threads, args.io_queue)
+
+    # Get the region and group from the command line or the user
+    region = ask_value(args.region, "Enter the region: ")
+    group = ask_value(args.group, "Enter the group: ")
+
+    # Get the main folder containing subfolders
+    main_folder = ask_directory(args.main_folder, "Select Main Folder")
+
+    if main_folder:
+        
+        # Create an output parent folder
+        output_parent_folder = os.path.join(main_folder, f'Cell Soma {group} {region}')
+        os.makedirs(output_parent_folder, exist_ok=True)
+        
+        # Measure every cell of every subfolder, or only the cells of one shard
+        cell_tasks = collect_cell_tasks(main_folder, output_parent_folder)
+        task_ids = [os.path.relpath(cell_image_path, main_folder) for cell_image_path, _ in cell_tasks]
+        cell_tasks, task_ids = select_shard(cell_tasks, task_ids, args.shard, args.shard_by)
+
+        # Read the upcoming cells ahead on the I/O threads. Without them every cell is read
+        # when it is measured, so that a cached cell is not read at all
+        def read_cell(cell_task):
+            return cv2.imread(cell_task[0], cv2.IMREAD_GRAYSCALE) if args.io_threads else None
+
+        # With --artifact-archive, the somas of every subfolder go into one archive
+        artifacts = open_artifacts(args)
+
+        def measure_cells(cell_tasks):
+            with CellArchive() as archive:
+                for (cell_image_path, output_soma_path), cell_image in prefetch(read_cell, cell_tasks, args.io_threads):
+                    if artifacts.archive:
+                        archive.open(artifacts.archive_path(os.path.dirname(output_soma_path)))
 
                     # Extract soma, measure area and perimeter
-                    cell_id, area, perimeter = extract_soma_and_measure(cell_image_path,output_soma_path)
+                    yield list(extract_soma_and_measure(cell_image_path, output_soma_path, cache=cache, cell_image=cell_image,
+                                                        artifacts=artifacts, archive=archive if artifacts.archive else None))
+
+        # Stream the measurements into the results table, recording every finished cell in the
+        # run manifest so that an interrupted run can be resumed
+        output_path = results_path(main_folder, shard_name(f'Soma_Measurements_{region}_{group}', args.shard), args.output_format)
+        header = {'script': 'SomaMeasurements', 'columns': ID_COLUMNS + SOMA_COLUMNS, 'min_soma_area': 50}
+        with RunManifest(manifest_path(output_path), header, args.resume, args.manifest_sync) as manifest, \
+                open_results_writer(output_path, ID_COLUMNS + SOMA_COLUMNS, args.output_format) as writer:
+            for cell_id, area, perimeter in resume_results(manifest, cell_tasks, task_ids, measure_cells):
+                # Write the measurements to the results table
+                writer.write_row([cell_id, region, group, area, perimeter])
+
+        output_path = finish_results(output_path, args.output_format, args.excel)
+        print(f"Soma measurements saved to {output_path}")
 
-                # Write the measurements to the Excel worksheet
-                    worksheet.append([cell_id, region, group, area, perimeter])
-                    
-     # Save the Excel workbook
-        workbook.save(excel_path)
+    finish_writing()
+    finish_tracing(args.trace)
 
-# Close the workbook to ensure the changes are written
-        workbook.close()
 
-        print(f"Soma measurements saved to {excel_path}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
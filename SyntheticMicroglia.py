@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from skimage.draw import disk, line, line_nd, ellipsoid
+from scipy import ndimage
+
+
+def synthetic_cell(size=200, soma_radius=10, num_processes=6, branch_probability=0.3, process_width=3, seed=0):
+    # Binary microglia-like cell: a round soma with processes that wander outwards
+    # and branch at random. Returns a (size, size) boolean array
+    rng = np.random.default_rng(seed)
+    cell = np.zeros((size, size), dtype=bool)
+    center = size // 2
+
+    # Soma
+    rows, cols = disk((center, center), soma_radius, shape=cell.shape)
+    cell[rows, cols] = True
+
+    # Every process is a chain of short straight segments; branches start new chains
+    segment_length = max(4, size // 16)
+    tips = [(center, center, angle) for angle in rng.uniform(0, 2 * np.pi, num_processes)]
+    branches_left = 3 * num_processes
+    while tips:
+        row, col, angle = tips.pop()
+        for _ in range(rng.integers(3, 8)):
+            angle += rng.normal(0, 0.35)
+            next_row = int(np.clip(row + segment_length * np.sin(angle), 0, size - 1))
+            next_col = int(np.clip(col + segment_length * np.cos(angle), 0, size - 1))
+            rows, cols = line(row, col, next_row, next_col)
+            cell[rows, cols] = True
+            row, col = next_row, next_col
+            if branches_left and rng.random() < branch_probability:
+                tips.append((row, col, angle + rng.choice([-1, 1]) * rng.uniform(0.5, 1.2)))
+                branches_left -= 1
+
+    # Give the processes some thickness
+    if process_width > 1:
+        cell = ndimage.binary_dilation(cell, iterations=process_width // 2)
+
+    return cell
+
+
+def synthetic_field(num_cells=20, cell_size=200, field_shape=None, noise_objects=50, seed=0, **cell_options):
+    # Thresholded full-field image (uint8, 0/255) with num_cells non-touching synthetic cells
+    # and a few small noise objects, like the TIFFs read by IndividualCellSelectandExtract
+    rng = np.random.default_rng(seed)
+    if field_shape is None:
+        side = int(np.ceil(np.sqrt(num_cells))) * cell_size
+        field_shape = (side, side)
+    field = np.zeros(field_shape, dtype=np.uint8)
+
+    # Place the cells on a shuffled grid so that they never overlap
+    grid_rows, grid_cols = field_shape[0] // cell_size, field_shape[1] // cell_size
+    slots = rng.permutation(grid_rows * grid_cols)[:num_cells]
+    for index, slot in enumerate(slots):
+        row, col = divmod(int(slot), grid_cols)
+        cell = synthetic_cell(cell_size, seed=seed * 100003 + index, **cell_options)
+        # Keep a one pixel background border so neighbouring cells never touch
+        cell[[0, -1], :] = False
+        cell[:, [0, -1]] = False
+        field[row * cell_size:(row + 1) * cell_size, col * cell_size:(col + 1) * cell_size][cell] = 255
+
+    # Small noise objects below the minimum cell area
+    for _ in range(noise_objects):
+        row, col = rng.integers(0, field_shape[0] - 3), rng.integers(0, field_shape[1] - 3)
+        field[row:row + 2, col:col + 3] = 255
+
+    return field
+
+
+def synthetic_volume_cell(size=64, soma_radius=5, num_processes=6, branch_probability=0.3, process_width=3, seed=0):
+    # Binary 3D microglia-like cell, the volume counterpart of synthetic_cell:
+    # a ball soma with processes wandering outwards in every direction. Returns a (size,) * 3 boolean array
+    rng = np.random.default_rng(seed)
+    cell = np.zeros((size,) * 3, dtype=bool)
+    center = size // 2
+
+    # Soma
+    ball = ellipsoid(soma_radius, soma_radius, soma_radius)[1:-1, 1:-1, 1:-1]
+    start = center - soma_radius
+    cell[start:start + ball.shape[0], start:start + ball.shape[1], start:start + ball.shape[2]] |= ball
+
+    # Processes are chains of short segments along random unit directions
+    segment_length = max(3, size // 12)
+    tips = [(np.full(3, center, dtype=float), direction / np.linalg.norm(direction)) for direction in rng.normal(size=(num_processes, 3))]
+    branches_left = 3 * num_processes
+    while tips:
+        point, direction = tips.pop()
+        for _ in range(rng.integers(3, 7)):
+            direction = direction + rng.normal(0, 0.3, 3)
+            direction /= np.linalg.norm(direction)
+            next_point = np.clip(point + segment_length * direction, 0, size - 1)
+            cell[line_nd(point, next_point, endpoint=True, integer=True)] = True
+            point = next_point
+            if branches_left and rng.random() < branch_probability:
+                branch = direction + rng.normal(0, 0.8, 3)
+                tips.append((point, branch / np.linalg.norm(branch)))
+                branches_left -= 1
+
+    # Give the processes some thickness
+    if process_width > 1:
+        cell = ndimage.binary_dilation(cell, iterations=process_width // 2)
+
+    return cell
+
+
+def synthetic_volume(num_cells=8, cell_size=64, seed=0, **cell_options):
+    # Thresholded z-stack (uint8, 0/255) with num_cells non-touching synthetic volume cells side by side
+    rng = np.random.default_rng(seed)
+    grid = int(np.ceil(np.sqrt(num_cells)))
+    volume = np.zeros((cell_size, grid * cell_size, grid * cell_size), dtype=np.uint8)
+    for index, slot in enumerate(rng.permutation(grid * grid)[:num_cells]):
+        row, col = divmod(int(slot), grid)
+        cell = synthetic_volume_cell(cell_size, seed=seed * 100003 + index, **cell_options)
+        # Keep a one voxel background border so neighbouring cells never touch
+        cell[:, [0, -1], :] = False
+        cell[:, :, [0, -1]] = False
+        volume[:, row * cell_size:(row + 1) * cell_size, col * cell_size:(col + 1) * cell_size][cell] = 255
+    return volume
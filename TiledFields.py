@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from itertools import product
+import numpy as np
+from scipy import ndimage, sparse
+from scipy.sparse.csgraph import connected_components
+from skimage import measure
+
+
+# Cell selected from a field that was labeled strip by strip. label, bbox and area mean the same
+# as in skimage.measure.regionprops, so a CellRegion can be used wherever a region is expected
+CellRegion = namedtuple('CellRegion', ['label', 'bbox', 'area'])
+
+# Labels of a whole field: the strip height, the first provisional label of every strip and the
+# lookup from provisional label to the label of the selected cell (0 when not selected)
+FieldLabels = namedtuple('FieldLabels', ['strip_rows', 'label_offsets', 'lookup'])
+
+
+def open_field(image_path):
+    # Memory-map the TIFF so that only the rows in use are read from disk. Compressed or
+    # otherwise non-contiguous TIFFs cannot be mapped and are read into memory instead
+    import tifffile
+    try:
+        return tifffile.memmap(image_path, mode='r')
+    except ValueError:
+        return tifffile.imread(image_path)
+
+
+def field_resolution(image_path):
+    # Resolution tags of a TIFF as tifffile.imwrite options, to carry them into the output images
+    import tifffile
+    with tifffile.TiffFile(image_path) as tif:
+        page = tif.pages[0]
+        return {'resolution': page.resolution, 'resolutionunit': page.resolutionunit}
+
+
+def _border_pairs(previous_labels, previous_values, current_labels, current_values):
+    # Provisional labels touching across the border of two strips (8-connectivity; the borders
+    # of slabs of a volume are planes, 26-connectivity). As in measure.label, touching pixels
+    # only belong to one object when they have the same value
+    pairs = []
+    for shifts in product((-1, 0, 1), repeat=previous_labels.ndim):
+        previous = tuple(slice(max(0, shift), size + min(0, shift)) for size, shift in zip(previous_labels.shape, shifts))
+        current = tuple(slice(max(0, -shift), size + min(0, -shift)) for size, shift in zip(previous_labels.shape, shifts))
+        touching = (previous_labels[previous] > 0) & (previous_values[previous] == current_values[current])
+        pairs.append(np.stack([previous_labels[previous][touching], current_labels[current][touching]], axis=1))
+    return np.concatenate(pairs)
+
+
+def label_field(image, min_cell_area=300, strip_rows=2048):
+    # Label a (memory-mapped) field strip by strip and stitch the objects that cross strip borders.
+    # Gives the same cells, in the same order, as select_cells on the whole image while only one
+    # strip of labels is held in memory. Returns the FieldLabels and the selected CellRegions.
+    # Volumes are labeled the same way in slabs of strip_rows planes
+    ndim = image.ndim
+
+    # Per provisional label: area, bounding box; per strip border: touching label pairs
+    offsets, areas, boxes, pairs = [], [np.zeros(1, dtype=np.int64)], [np.zeros((1, 2 * ndim), dtype=np.int64)], []
+    num_labels = 0
+    previous_labels = previous_values = None
+    for start in range(0, image.shape[0], strip_rows):
+        strip = np.asarray(image[start:start + strip_rows])
+        strip_labels, strip_count = measure.label(strip, return_num=True)
+        areas.append(np.bincount(strip_labels.ravel(), minlength=strip_count + 1)[1:])
+        strip_boxes = np.zeros((strip_count, 2 * ndim), dtype=np.int64)
+        for index, slices in enumerate(ndimage.find_objects(strip_labels)):
+            strip_boxes[index] = [piece.start for piece in slices] + [piece.stop for piece in slices]
+        strip_boxes[:, [0, ndim]] += start
+        boxes.append(strip_boxes)
+
+        # Make the labels unique over the whole field
+        strip_labels[strip_labels > 0] += num_labels
+        offsets.append(num_labels)
+
+        if previous_labels is not None:
+            pairs.append(_border_pairs(previous_labels, previous_values, strip_labels[0], strip[0]))
+        previous_labels, previous_values = strip_labels[-1].copy(), strip[-1].copy()
+        num_labels += strip_count
+
+    # Merge the provisional labels that touch into objects
+    areas, boxes = np.concatenate(areas), np.concatenate(boxes)
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    adjacency = sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(num_labels + 1, num_labels + 1))
+    num_objects, objects = connected_components(adjacency, directed=False)
+
+    # Objects are numbered by their first pixel in raster order like measure.label does; the smallest
+    # provisional label of an object is the one holding that pixel
+    first = np.full(num_objects, num_labels + 1)
+    np.minimum.at(first, objects[1:], np.arange(1, num_labels + 1))
+    object_areas = np.bincount(objects[1:], weights=areas[1:], minlength=num_objects).astype(np.int64)
+    object_boxes = np.tile(np.array(list(image.shape[:ndim]) + [0] * ndim), (num_objects, 1))
+    np.minimum.at(object_boxes[:, :ndim], objects[1:], boxes[1:, :ndim])
+    np.maximum.at(object_boxes[:, ndim:], objects[1:], boxes[1:, ndim:])
+
+    # Keep the objects large enough to be cells
+    background = objects[0]
+    order = [index for index in np.argsort(first, kind='stable') if index != background]
+    regions = []
+    object_labels = np.zeros(num_objects, dtype=np.int64)
+    for label, index in enumerate(order, start=1):
+        if object_areas[index] >= min_cell_area:
+            regions.append(CellRegion(label, tuple(int(value) for value in object_boxes[index]), int(object_areas[index])))
+            object_labels[index] = label
+
+    lookup = object_labels[objects]
+    lookup[0] = 0
+    return FieldLabels(strip_rows, offsets, lookup), regions
+
+
+def selected_strips(image, field_labels):
+    # Yield (first row, selected cell labels) of every strip, labeling each strip again
+    # exactly as label_field did and mapping its labels to the selected cells
+    strip_rows = field_labels.strip_rows
+    for start, offset in zip(range(0, image.shape[0], strip_rows), field_labels.label_offsets):
+        strip_labels = measure.label(np.asarray(image[start:start + strip_rows]))
+        strip_labels[strip_labels > 0] += offset
+        yield start, field_labels.lookup[strip_labels]
+
+
+def overview_strip(strip):
+    # Gray strip as the 8-bit color image cv2.imread returns for it (16-bit images keep their high byte)
+    if strip.dtype == np.uint16:
+        strip = strip >> 8
+    strip = strip.astype(np.uint8)
+    return np.stack([strip] * 3, axis=-1) if strip.ndim == 2 else strip
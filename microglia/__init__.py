@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Array-in / array-out core of the microglia analysis: no file reads or writes and nothing run at
+# import, so it can be embedded in other programs. The scripts of the repository only add the file
+# handling, results tables and command lines around it. Every function only reads its arguments,
+# and the pixel work runs in NumPy, SciPy, scikit-image and OpenCV kernels that release the GIL,
+# so cells can be analyzed concurrently on a thread pool (see analyze_cells)
+
+from .cells import select_cells, crop_cell, label_objects, keep_objects, remove_small_objects, threshold_cell
+from .soma import measure_soma, measure_soma_stack
+from .skeleton_points import SkeletonResult, classify_points
+from . import skeleton_graph
+from .skeleton import analyze_skeleton_array, analyze_volume_array, identify_points, segment_image, skeleton_measurements, render_visualization
+from .morphology_metrics import cell_center, sholl_profile, sholl_measurements, fractal_dimension, hull_measurements, morphology_metrics
+from .field_analysis import selected_cell_labels, analyze_labeled_field
+from .analysis import CellAnalysis, analyze_cell, analyze_cells
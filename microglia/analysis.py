@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .cells import threshold_cell
+from .soma import measure_soma
+from .skeleton import analyze_skeleton_array, skeleton_measurements
+from .morphology_metrics import morphology_metrics
+from .tracing import stage
+
+
+# Everything known about one cell crop: its cleaned binary image, soma image, SkeletonResult and
+# segmented image, and its measurements in the order of RESULT_COLUMNS (+ METRICS_COLUMNS)
+CellAnalysis = namedtuple('CellAnalysis', ['cell_binary', 'soma', 'result', 'segmented_image', 'measurements'])
+
+
+def analyze_cell(cell_array, threshold_value=100, morphology=False, cell_id=None):
+    # Threshold and clean one cell crop and measure its soma and skeleton, as the crop mode of
+    # MicrogliaPipeline does. Only reads its arguments, so cells can be analyzed on several threads
+    with stage('threshold', cell_id):
+        cell_binary = threshold_cell(cell_array, threshold_value)
+
+    with stage('soma', cell_id):
+        soma, area, perimeter = measure_soma(cell_binary)
+    result, segmented_image, num_ramifications, graph = analyze_skeleton_array(cell_binary, cell_id)
+
+    measurements = [area, perimeter] + skeleton_measurements(result, num_ramifications, graph)
+    if morphology:
+        with stage('metrics', cell_id):
+            measurements += morphology_metrics(cell_binary, result.skeleton, soma)
+
+    return CellAnalysis(cell_binary, soma, result, segmented_image, measurements)
+
+
+def analyze_cells(cell_arrays, threshold_value=100, morphology=False, threads=None, cell_ids=None):
+    # analyze_cell for many crops on a thread pool of the calling process; a list in the order of the crops.
+    # The thresholding, labeling, erosion, skeletonization and neighbour counting kernels release the
+    # GIL, so the threads run in parallel on the pixel work (threads defaults to the CPU count)
+    cell_arrays = list(cell_arrays)
+    cell_ids = list(cell_ids) if cell_ids is not None else [None] * len(cell_arrays)
+    with ThreadPoolExecutor(threads or os.cpu_count()) as executor:
+        return list(executor.map(lambda cell_array, cell_id: analyze_cell(cell_array, threshold_value, morphology, cell_id), cell_arrays, cell_ids))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+from skimage import measure
+
+
+def select_cells(image_array, min_cell_area=300):
+    # Label connected regions in the thresholded image
+    labels = measure.label(image_array)
+
+    # Get properties of labeled regions
+    props = measure.regionprops(labels)
+
+    # Filter regions based on area
+    filtered_regions = [region for region in props if region.area >= min_cell_area]
+
+    return labels, filtered_regions
+
+
+def crop_cell(image_array, region):
+    # Crop the cell as a view of the image array. The bounding box stops one pixel
+    # before the last row and column of the cell, as the crops always have
+    min_row, min_col, max_row, max_col = region.bbox
+    return image_array[min_row:max_row - 1, min_col:max_col - 1]
+
+
+def label_objects(binary, connectivity=4):
+    # Objects of a binary image and their sizes in pixels (index 0 is the background), from one
+    # OpenCV connected components pass, which releases the GIL for its whole run
+    _, objects, stats, _ = cv2.connectedComponentsWithStats((binary != 0).astype(np.uint8), connectivity=connectivity)
+    return objects, stats[:, cv2.CC_STAT_AREA]
+
+
+def keep_objects(objects, object_sizes, min_size):
+    # The objects of more than min_size pixels as a 0 / 255 image
+    keep = object_sizes > min_size
+    keep[0] = False
+    return keep[objects].astype(np.uint8) * 255
+
+
+def remove_small_objects(binary, min_size, connectivity=4):
+    # Remove the 4-connected objects of min_size pixels or fewer, as a 0 / 255 image. skimage 0.26's
+    # remove_small_objects(min_size=...) also removes objects of exactly min_size pixels
+    return keep_objects(*label_objects(binary, connectivity), min_size)
+
+
+def threshold_cell(cell_array, threshold_value=100, min_object_size=100):
+    # Thresholding
+    cell_binary = cv2.threshold(cell_array, threshold_value, 255, cv2.THRESH_BINARY)[1]
+
+    # Remove small objects (noise)
+    return remove_small_objects(cell_binary, min_object_size)
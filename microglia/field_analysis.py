@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import ndimage
+from skimage import measure
+from skimage.morphology import skeletonize
+from .skeleton_points import SkeletonResult
+from .morphology_metrics import morphology_metrics
+from . import skeleton_graph
+from .tracing import stage
+
+
+# 3x3 neighbourhood of the label-aware erosion, as the soma erosion kernel
+SOMA_FOOTPRINT = np.ones((3, 3), dtype=bool)
+
+
+def selected_cell_labels(labels, filtered_regions):
+    # Label image with the selected cells numbered 1 .. n in the order of filtered_regions
+    # (the order of the cell IDs) and everything else set to 0
+    lookup = np.zeros(labels.max() + 1, dtype=np.int32)
+    lookup[[region.label for region in filtered_regions]] = np.arange(1, len(filtered_regions) + 1)
+    return lookup[labels]
+
+
+def _per_cell(cell_of, num_cells, weights=None):
+    # Sum (or count) values per cell 1 .. num_cells; entries of cell 0 are dropped
+    return np.bincount(cell_of, weights=weights, minlength=num_cells + 1)[1:num_cells + 1]
+
+
+def pack_cells(image_array, cell_labels, threshold_value=100):
+    # Copy the thresholded pixels of every cell, and nothing else, into one compact mosaic so that
+    # the label-aware operations below run on the cells only instead of on the mostly empty field.
+    # Every cell keeps a one pixel background border, so cells never touch in the mosaic; border
+    # pixels lying outside the field are flagged in `outside`. Returns the mosaic, the outside mask,
+    # and the mosaic position and field bounding box (slices) of every cell
+    boxes = ndimage.find_objects(cell_labels)
+    sizes = [(box[0].stop - box[0].start + 2, box[1].stop - box[1].start + 2) if box else (0, 0) for box in boxes]
+    width = max([size[1] for size in sizes] + [int(np.sqrt(sum(height * width for height, width in sizes))) + 1])
+
+    # Shelf packing: the tallest cells first, left to right, a new shelf when the row is full
+    positions = [(0, 0)] * len(boxes)
+    row = col = shelf = 0
+    for cell in sorted(range(len(boxes)), key=lambda cell: -sizes[cell][0]):
+        height, tile_width = sizes[cell]
+        if col + tile_width > width:
+            row, col, shelf = row + shelf, 0, 0
+        positions[cell] = (row, col)
+        col += tile_width
+        shelf = max(shelf, height)
+
+    packed = np.zeros((row + shelf, width), dtype=cell_labels.dtype)
+    outside = np.zeros(packed.shape, dtype=bool)
+    field_height, field_width = cell_labels.shape
+    for cell, box in enumerate(boxes, start=1):
+        if box is None:
+            continue
+        (row, col), (height, tile_width) = positions[cell - 1], sizes[cell - 1]
+        inside = (cell_labels[box] == cell) & (image_array[box] > threshold_value)
+        packed[row + 1:row + height - 1, col + 1:col + tile_width - 1][inside] = cell
+        outside[row, col:col + tile_width] |= box[0].start == 0
+        outside[row + height - 1, col:col + tile_width] |= box[0].stop == field_height
+        outside[row:row + height, col] |= box[1].start == 0
+        outside[row:row + height, col + tile_width - 1] |= box[1].stop == field_width
+
+    return packed, outside, positions, boxes
+
+
+def unpack_cells(packed, positions, boxes, shape):
+    # Field image of a per-cell result computed on the mosaic (soma, skeleton, ...)
+    field = np.zeros(shape, dtype=packed.dtype)
+    for cell, box in enumerate(boxes, start=1):
+        if box is None:
+            continue
+        row, col = positions[cell - 1]
+        tile = packed[row + 1:row + 1 + box[0].stop - box[0].start, col + 1:col + 1 + box[1].stop - box[1].start]
+        field[box] = np.where(tile > 0, tile, field[box])
+    return field
+
+
+def remove_small_pieces(cell_labels, min_size, connectivity=1):
+    # remove_small_objects for every cell at once: pieces of one cell are split like
+    # remove_small_objects splits them (4-connectivity), pieces of different cells never merge.
+    # Pieces of min_size pixels or fewer are removed, as on the per-cell path
+    pieces = measure.label(cell_labels, connectivity=connectivity)
+    piece_sizes = np.bincount(pieces.ravel(), minlength=1)
+    keep = piece_sizes > min_size
+    keep[0] = False
+    return np.where(keep[pieces], cell_labels, 0)
+
+
+def erode_cells(cell_labels, outside=None):
+    # 3x3 erosion of every cell on its own: a pixel stays when its whole neighbourhood belongs
+    # to the same cell. Pixels outside the field do not erode, like cv2.erode's default border
+    if outside is None:
+        outside = np.zeros(cell_labels.shape, dtype=bool)
+    smallest = ndimage.grey_erosion(np.where(outside, np.iinfo(cell_labels.dtype).max, cell_labels), footprint=SOMA_FOOTPRINT, mode='nearest')
+    largest = ndimage.grey_dilation(np.where(outside, 0, cell_labels), footprint=SOMA_FOOTPRINT, mode='nearest')
+    return np.where((smallest == cell_labels) & (largest == cell_labels), cell_labels, 0)
+
+
+def measure_somas(cell_labels, num_cells, min_soma_area=50, outside=None):
+    # measure_soma for every cell at once: the largest 8-connected piece of the eroded cell
+    # is the soma. Returns the soma label image (cell numbers) and the area and perimeter per cell
+    eroded = erode_cells(remove_small_pieces(cell_labels, min_soma_area), outside)
+    pieces, num_pieces = measure.label(eroded, return_num=True)
+    piece_cells = skeleton_graph.label_values(eroded, pieces, num_pieces)[1:].astype(np.intp)
+    piece_areas = np.bincount(pieces.ravel(), minlength=num_pieces + 1)[1:]
+
+    # Largest piece of every cell; on ties the first in raster order, as np.argmax does
+    order = np.lexsort((np.arange(len(piece_areas)), -piece_areas, piece_cells))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = piece_cells[order][1:] != piece_cells[order][:-1]
+    somas = order[first]
+
+    piece_soma = np.zeros(len(piece_areas) + 1, dtype=cell_labels.dtype)
+    piece_soma[somas + 1] = piece_cells[somas]
+    soma_labels = piece_soma[pieces]
+
+    areas = np.zeros(num_cells + 1)
+    perimeters = np.zeros(num_cells + 1)
+    for region in measure.regionprops(soma_labels):
+        areas[region.label] = region.area
+        perimeters[region.label] = region.perimeter
+
+    return soma_labels, areas[1:], perimeters[1:]
+
+
+def skeleton_measurements_by_cell(skeleton, cell_labels, num_cells):
+    # skeleton_measurements for every cell at once, as columns in the order of SKELETON_COLUMNS.
+    # One classified skeleton and one branch graph for all the packed cells, split by cell with bincount
+    result = SkeletonResult(skeleton)
+    graph = skeleton_graph.build_skeleton_graph(skeleton, result.types)
+
+    # Cell of every skeleton component, and from it of every node and edge
+    component_cells = skeleton_graph.label_values(cell_labels, graph.components, graph.components.max()).astype(np.intp)
+    node_cells = component_cells[graph.node_components]
+    edge_cells = component_cells[graph.edge_components]
+
+    # Isolated pixels and loops (round cells) are edges without nodes (-1, -1), left out of the node lookup
+    valid = (graph.edge_nodes >= 0).all(axis=1)
+    edge_kind = graph.node_kind[graph.edge_nodes[valid]]
+    is_end, is_junction = edge_kind == skeleton_graph.END_POINT, edge_kind == skeleton_graph.JUNCTION
+    ramifications = (is_end[:, 0] & is_junction[:, 1]) | (is_junction[:, 0] & is_end[:, 1])
+    junction_nodes = graph.node_kind == skeleton_graph.JUNCTION
+
+    num_branches = _per_cell(edge_cells, num_cells)
+    total_length = _per_cell(edge_cells, num_cells, graph.edge_lengths)
+    maximum_length = np.zeros(num_cells + 1)
+    np.maximum.at(maximum_length, edge_cells, graph.edge_lengths)
+
+    return [_per_cell(edge_cells[valid][ramifications], num_cells),
+            _per_cell(cell_labels[tuple(result.end_points.T)], num_cells),
+            _per_cell(cell_labels[tuple(result.junctions.T)], num_cells),
+            _per_cell(cell_labels[tuple(result.slabs.T)], num_cells),
+            num_branches,
+            _per_cell(node_cells[junction_nodes], num_cells),
+            _per_cell(node_cells[junction_nodes & (graph.node_degree == 3)], num_cells),
+            _per_cell(node_cells[junction_nodes & (graph.node_degree == 4)], num_cells),
+            np.divide(total_length, num_branches, out=np.zeros(num_cells), where=num_branches > 0),
+            maximum_length[1:]]
+
+
+def metrics_by_cell(processed, soma_labels, skeleton, positions, boxes):
+    # morphology_metrics of every cell on its own tile of the packed cells
+    rows = []
+    for cell, box in enumerate(boxes, start=1):
+        row, col = positions[cell - 1]
+        tile = (slice(row + 1, row + 1 + box[0].stop - box[0].start), slice(col + 1, col + 1 + box[1].stop - box[1].start))
+        rows.append(morphology_metrics(processed[tile] == cell, skeleton[tile], soma_labels[tile] == cell))
+    return rows
+
+
+def analyze_labeled_field(image_array, cell_labels, num_cells, threshold_value=100, min_soma_area=50, field_id=None, field_images=False,
+                          morphology=False):
+    # Measure every selected cell of a field in one pass: threshold and clean the cells, find their
+    # somas and skeletonize them, all at once with label-aware operations on the packed cells, so
+    # that every cell is measured on its own pixels only. cell_labels numbers the cells 1 .. num_cells
+    # (see selected_cell_labels). Returns one [area, perimeter] + skeleton measurement row per cell
+    # (+ the morphology metrics with morphology), and with field_images the soma labels and the
+    # skeleton as field images
+    if num_cells == 0:
+        # Nothing to pack on a field without selected cells
+        if not field_images:
+            return [], None, None
+        return [], np.zeros(cell_labels.shape, dtype=cell_labels.dtype), np.zeros(cell_labels.shape, dtype=bool)
+
+    with stage('threshold', field_id):
+        packed, outside, positions, boxes = pack_cells(image_array, cell_labels, threshold_value)
+        processed = remove_small_pieces(packed, 100)
+
+    with stage('soma', field_id):
+        soma_labels, areas, perimeters = measure_somas(processed, num_cells, min_soma_area, outside)
+
+    with stage('skeletonize', field_id):
+        skeleton = skeletonize(processed > 0)
+
+    with stage('graph', field_id):
+        columns = skeleton_measurements_by_cell(skeleton, processed, num_cells)
+
+    rows = []
+    for cell in range(num_cells):
+        rows.append([float(areas[cell]), float(perimeters[cell])] +
+                    [int(column[cell]) for column in columns[:8]] + [float(column[cell]) for column in columns[8:]])
+
+    if morphology:
+        with stage('metrics', field_id):
+            for row, metrics in zip(rows, metrics_by_cell(processed, soma_labels, skeleton, positions, boxes)):
+                row += metrics
+
+    if not field_images:
+        return rows, None, None
+    return rows, unpack_cells(soma_labels, positions, boxes, cell_labels.shape), unpack_cells(skeleton, positions, boxes, cell_labels.shape)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import cv2
+from .skeleton_graph import path_steps
+
+
+# Radius step of the Sholl circles in pixels
+SHOLL_STEP = 1.0
+
+
+def cell_center(cell_binary, soma=None):
+    # (row, col) centre of the Sholl circles: the centroid of the soma when given, otherwise
+    # the deepest pixel of the cell (the maximum of its distance transform), which lies in the soma
+    if soma is not None and soma.any():
+        return np.argwhere(soma).mean(axis=0)
+    distance = cv2.distanceTransform(cell_binary.astype(np.uint8), cv2.DIST_L2, 3)
+    return np.array(np.unravel_index(np.argmax(distance), distance.shape), dtype=float)
+
+
+def sholl_profile(skeleton, center, step=SHOLL_STEP):
+    # Intersections of the skeleton with circles of radius step, 2 * step, ... around center.
+    # Every pixel gets its shell (distance from the centre // step) from one distance map; a step
+    # along the skeleton from shell a to shell b crosses the circles a + 1 .. b, which are counted
+    # for all steps at once with bincount on the first and one past the last crossed circle
+    skeleton = np.asarray(skeleton, dtype=bool)
+    grid = np.ogrid[tuple(slice(0, size) for size in skeleton.shape)]
+    distance = np.sqrt(sum((axis - position) ** 2 for axis, position in zip(grid, center)))
+    shells = (distance // step).astype(np.intp)
+
+    num_circles = int(shells.max()) + 2 if shells.size else 2
+    changes = np.zeros(num_circles + 1)
+    for _, source, target, path_step in path_steps(skeleton):
+        source_shells, target_shells = shells[source][path_step], shells[target][path_step]
+        first, last = np.minimum(source_shells, target_shells) + 1, np.maximum(source_shells, target_shells) + 1
+        crossing = first < last
+        changes += np.bincount(first[crossing], minlength=num_circles + 1)
+        changes -= np.bincount(last[crossing], minlength=num_circles + 1)
+
+    # Intersections of the circles 1 .. num_circles - 1, radius = circle * step
+    return np.cumsum(changes)[1:num_circles].astype(np.int64)
+
+
+def sholl_measurements(intersections, step=SHOLL_STEP):
+    # Maximum and total intersections, critical radius (of the maximum) and enclosing radius
+    # (of the outermost circle still intersected)
+    if not intersections.any():
+        return [0, 0, 0.0, 0.0]
+    radii = step * np.arange(1, len(intersections) + 1)
+    return [int(intersections.max()), int(intersections.sum()),
+            float(radii[np.argmax(intersections)]), float(radii[np.flatnonzero(intersections)[-1]])]
+
+
+def outline(cell_binary):
+    # One pixel outline of the cell: the pixels with a background 4-neighbour
+    cell = cell_binary.astype(np.uint8)
+    eroded = cv2.erode(cell, cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3)), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return cell > eroded
+
+
+def box_counts(image):
+    # Occupied boxes of side 1, 2, 4, ... up to half the image: every size is one block
+    # reduction (any over 2 x 2 blocks) of the occupancy of the previous size
+    occupied = np.asarray(image, dtype=bool)
+    sizes, counts = [1], [np.count_nonzero(occupied)]
+    size = 1
+    while 2 * size <= max(image.shape) / 2:
+        padding = [(0, length % 2) for length in occupied.shape]
+        occupied = np.pad(occupied, padding)
+        occupied = occupied.reshape(occupied.shape[0] // 2, 2, occupied.shape[1] // 2, 2).any(axis=(1, 3))
+        size *= 2
+        sizes.append(size)
+        counts.append(np.count_nonzero(occupied))
+    return np.array(sizes), np.array(counts)
+
+
+def fractal_dimension(cell_binary):
+    # Box-counting dimension of the cell outline: minus the slope of log(count) over log(box size)
+    sizes, counts = box_counts(outline(cell_binary))
+    keep = counts > 0
+    if np.count_nonzero(keep) < 2:
+        return 0.0
+    slope, _ = np.polyfit(np.log(sizes[keep]), np.log(counts[keep]), 1)
+    return float(-slope)
+
+
+def hull_measurements(cell_binary):
+    # Area and perimeter of the convex hull of the cell pixels (through the pixel centres), the span
+    # ratio (long over short side of the smallest rectangle around the hull) and the density (cell area
+    # over hull area). Cells too small to have a hull area give zeros
+    points = cv2.findNonZero(cell_binary.astype(np.uint8))
+    if points is None:
+        return [0.0, 0.0, 0.0, 0.0]
+    hull = cv2.convexHull(points)
+    hull_area = cv2.contourArea(hull)
+    hull_perimeter = cv2.arcLength(hull, True)
+    if hull_area == 0:
+        return [0.0, float(hull_perimeter), 0.0, 0.0]
+
+    width, height = cv2.minAreaRect(hull)[1]
+    return [float(hull_area), float(hull_perimeter), float(max(width, height) / min(width, height)), float(len(points) / hull_area)]
+
+
+def morphology_metrics(cell_binary, skeleton, soma=None, step=SHOLL_STEP):
+    # Sholl, fractal and convex hull measurements of one cell from its binary image and skeleton
+    # (and soma, for the Sholl centre), in the order of METRICS_COLUMNS
+    cell_binary = np.asarray(cell_binary) > 0
+    intersections = sholl_profile(skeleton, cell_center(cell_binary, soma), step)
+    return sholl_measurements(intersections, step) + [fractal_dimension(cell_binary)] + hull_measurements(cell_binary)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+from skimage.morphology import skeletonize
+from .skeleton_points import SkeletonResult
+from . import skeleton_graph
+from .tracing import stage
+
+
+def analyze_skeleton_array(image_array, cell_id=None):
+    # Threshold image to obtain binary image
+    binary_image = image_array > 0
+    
+    # Skeletonize the binary image
+    with stage('skeletonize', cell_id):
+        skeleton = skeletonize(binary_image)
+    
+    # Identify end points, junctions, and slabs
+    with stage('classify', cell_id):
+        result = identify_points(skeleton)
+    
+    # Perform segmentation
+    with stage('segment', cell_id):
+        segmented_image = segment_image(image_array, result)
+
+    # Build the branch graph once (from the classified points) and count ramifications on it
+    with stage('graph', cell_id):
+        graph = skeleton_graph.build_skeleton_graph(skeleton, result.types)
+        num_ramifications = skeleton_graph.count_ramifications(graph)
+
+    return result, segmented_image, num_ramifications, graph
+
+
+def skeleton_measurements(result, num_ramifications, graph):
+    # Measurements of one cell (a SkeletonResult and its branch graph) in the order of SKELETON_COLUMNS
+    return [num_ramifications, len(result.end_points), len(result.junctions), len(result.slabs),
+            skeleton_graph.count_branches(graph), skeleton_graph.count_junctions(graph),
+            skeleton_graph.count_triple_points(graph), skeleton_graph.count_quadruple_points(graph),
+            skeleton_graph.average_branch_length(graph), skeleton_graph.maximum_branch_length(graph)]
+
+
+def identify_points(skeleton):
+    # Classify every skeleton pixel at once from its neighbour count
+    # (a SkeletonResult: type raster plus N x 2 arrays of (row, col) coordinates)
+    return SkeletonResult(skeleton)
+
+
+# Intensity of every point type in the segmented image (background, end point, junction, slab)
+SEGMENT_VALUES = np.array([0, 150, 100, 50])
+
+
+def segment_image(image_array, result):
+    # Perform segmentation based on the skeleton and detected points:
+    # one lookup of the type raster of the SkeletonResult paints every point at once
+    return SEGMENT_VALUES.astype(image_array.dtype)[result.types]
+
+
+# Colors (BGR) and marker half-size in pixels of the raster visualization
+END_POINT_COLOR = (255, 0, 0)      # blue
+JUNCTION_COLOR = (128, 0, 128)     # purple
+SLAB_COLOR = (0, 165, 255)         # orange
+MARKER_RADIUS = 1
+
+
+def render_visualization(segmented_image, result, target_size=800):
+    # Gray background scaled to the full intensity range, as imshow does
+    background = segmented_image.astype(np.float32)
+    value_range = background.max() - background.min()
+    if value_range > 0:
+        background = (background - background.min()) * (255 / value_range)
+    visualization = cv2.cvtColor(background.astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+    # Color the points by direct indexing: slabs first, then the (larger) end point and junction markers on top
+    height, width = segmented_image.shape
+    visualization[result.slabs[:, 0], result.slabs[:, 1]] = SLAB_COLOR
+    for points, color in [(result.end_points, END_POINT_COLOR), (result.junctions, JUNCTION_COLOR)]:
+        for dr in range(-MARKER_RADIUS, MARKER_RADIUS + 1):
+            for dc in range(-MARKER_RADIUS, MARKER_RADIUS + 1):
+                rows = np.clip(points[:, 0] + dr, 0, height - 1)
+                cols = np.clip(points[:, 1] + dc, 0, width - 1)
+                visualization[rows, cols] = color
+
+    # Enlarge small cells with nearest-neighbour scaling so that single pixels stay visible
+    scale = max(1, target_size // max(height, width, 1))
+    if scale > 1:
+        visualization = cv2.resize(visualization, (width * scale, height * scale), interpolation=cv2.INTER_NEAREST)
+
+    return visualization
+
+
+def analyze_volume_array(volume, cell_id=None):
+    # 3D counterpart of analyze_skeleton_array: skeletonize the binary volume, classify
+    # the skeleton voxels with 26-connectivity and build the branch graph
+    binary_volume = volume > 0
+
+    with stage('skeletonize', cell_id):
+        skeleton = skeletonize(binary_volume)
+
+    # The end points, junctions and slabs of the result are N x 3 arrays of (plane, row, col) coordinates
+    with stage('classify', cell_id):
+        result = SkeletonResult(skeleton)
+
+    with stage('graph', cell_id):
+        graph = skeleton_graph.build_skeleton_graph(skeleton, result.types)
+        num_ramifications = skeleton_graph.count_ramifications(graph)
+
+    return result, num_ramifications, graph
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from itertools import product
+import numpy as np
+from scipy import ndimage
+from .skeleton_points import point_types, END_POINT as END_POINT_TYPE, JUNCTION as JUNCTION_TYPE
+
+
+# Node kinds of the skeleton graph
+END_POINT = 0
+JUNCTION = 1
+
+# Skeleton graph built once per cell, similar to skan or Fiji's AnalyzeSkeleton:
+# nodes are end points and 8-connected junction clusters, edges are the slab runs between them.
+# Volumes work the same way with 26-connected voxels.
+# Edges of isolated loops (no end point, no junction) use -1 for both nodes.
+# node_components and edge_components give the connected component (label in components) of every
+# node and edge, so that a graph of many cells can be split by cell.
+BranchGraph = namedtuple('BranchGraph', ['node_coords', 'node_kind', 'node_degree',
+                                         'edge_nodes', 'edge_lengths', 'components',
+                                         'node_components', 'edge_components'])
+
+# 8-connectivity structuring element used for every labelling step (26-connectivity in 3D)
+STRUCTURE = np.ones((3, 3), dtype=bool)
+
+
+def _structure(ndim):
+    return STRUCTURE if ndim == 2 else np.ones((3,) * ndim, dtype=bool)
+
+
+def _neighbor_offsets(ndim, half=False):
+    # Offsets of all 3 ** ndim - 1 neighbours, or of one of every pair of opposite neighbours
+    # (the first non-zero step positive). In 2D the half set is (0, 1), (1, 0), (1, 1), (1, -1)
+    offsets = [offset for offset in product((0, 1, -1), repeat=ndim) if any(offset)]
+    if half:
+        offsets = [offset for offset in offsets if next(step for step in offset if step) > 0]
+    return offsets
+
+
+def _shifted_pairs(shape, offset):
+    # Slices selecting every pixel p and its neighbour p + offset inside the image
+    source = tuple(slice(max(0, -step), size - max(0, step)) for size, step in zip(shape, offset))
+    target = tuple(slice(max(0, step), size - max(0, -step)) for size, step in zip(shape, offset))
+    return source, target
+
+
+def path_steps(mask):
+    # Yield (offset, source, target, step) for one of every pair of opposite neighbour offsets:
+    # step marks the pixels p of the mask whose neighbour p + offset is the next pixel along the
+    # thin path. Diagonal steps are skipped when a shorter path around the corner exists,
+    # so that corners of the 8- (26-) connected skeleton are not counted twice
+    for offset in _neighbor_offsets(mask.ndim, half=True):
+        source, target = _shifted_pairs(mask.shape, offset)
+        step = mask[source] & mask[target]
+
+        # Corner pixels of a diagonal step: the source moved along some, not all, of its axes
+        moved_axes = [axis for axis, step_size in enumerate(offset) if step_size]
+        for moves in product((False, True), repeat=len(moved_axes)):
+            if any(moves) and not all(moves):
+                corner = list(source)
+                for axis, move in zip(moved_axes, moves):
+                    if move:
+                        corner[axis] = target[axis]
+                step &= ~mask[tuple(corner)]
+
+        yield offset, source, target, step
+
+
+def _run_lengths(run_labels, num_runs):
+    # Sum the step lengths between neighbouring pixels of every slab run
+    lengths = np.zeros(num_runs + 1)
+
+    for offset, source, target, step in path_steps(run_labels > 0):
+        same_run = step & (run_labels[source] == run_labels[target])
+        step_length = np.sqrt(np.count_nonzero(offset))
+        counts = np.bincount(run_labels[source][same_run], minlength=num_runs + 1)
+        lengths += counts if np.count_nonzero(offset) == 1 else step_length * counts
+
+    return lengths
+
+
+def _junction_contacts(run_labels, junction_labels):
+    # Find every (run pixel, junction cluster) contact and its step length
+    run_ids = []
+    cluster_ids = []
+    pixel_ids = []
+    steps = []
+    flat_index = np.arange(run_labels.size).reshape(run_labels.shape)
+
+    for offset in _neighbor_offsets(run_labels.ndim):
+        source, target = _shifted_pairs(run_labels.shape, offset)
+        touching = (run_labels[source] > 0) & (junction_labels[target] > 0)
+        run_ids.append(run_labels[source][touching])
+        cluster_ids.append(junction_labels[target][touching])
+        pixel_ids.append(flat_index[source][touching])
+        steps.append(np.full(np.count_nonzero(touching), np.sqrt(np.count_nonzero(offset))))
+
+    run_ids = np.concatenate(run_ids)
+    cluster_ids = np.concatenate(cluster_ids)
+    pixel_ids = np.concatenate(pixel_ids)
+    steps = np.concatenate(steps)
+
+    # Keep the shortest step for every contact pixel, then sum the steps per (run, cluster)
+    order = np.lexsort((steps, cluster_ids, pixel_ids))
+    run_ids, cluster_ids, pixel_ids, steps = run_ids[order], cluster_ids[order], pixel_ids[order], steps[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (pixel_ids[1:] != pixel_ids[:-1]) | (cluster_ids[1:] != cluster_ids[:-1])
+    run_ids, cluster_ids, steps = run_ids[first], cluster_ids[first], steps[first]
+
+    pairs, inverse, contact_counts = np.unique(np.stack([run_ids, cluster_ids], axis=1), axis=0,
+                                               return_inverse=True, return_counts=True)
+    contact_steps = np.bincount(inverse.ravel(), weights=steps, minlength=len(pairs))
+
+    return pairs.reshape(-1, 2), contact_counts, contact_steps
+
+
+def label_values(values, labels, num_labels):
+    # Value of every label 0 .. num_labels (0 for label 0) when values are constant over each
+    # label, e.g. the component of every junction cluster. One indexed write instead of the
+    # full-image sort of ndimage.maximum
+    in_label = labels > 0
+    label_value = np.zeros(num_labels + 1, dtype=values.dtype)
+    label_value[labels[in_label]] = values[in_label]
+    return label_value
+
+
+def build_skeleton_graph(skeleton, types=None):
+    # Classify the skeleton pixels from their neighbour count, or take the classes from the
+    # type raster of a SkeletonResult of the same skeleton
+    skeleton = np.asarray(skeleton, dtype=bool)
+    if types is None:
+        types = point_types(skeleton)
+    end_point_mask = types == END_POINT_TYPE
+    junction_mask = types == JUNCTION_TYPE
+
+    # Label junction clusters (graph nodes), slab runs (graph edges) and connected components
+    structure = _structure(skeleton.ndim)
+    junction_labels, num_junctions = ndimage.label(junction_mask, structure)
+    run_labels, num_runs = ndimage.label(skeleton & ~junction_mask, structure)
+    components, num_components = ndimage.label(skeleton, structure)
+
+    # Junction clusters are nodes 0 .. num_junctions - 1, end points follow
+    end_points = np.argwhere(end_point_mask)
+    # Centre of every junction cluster, from its pixel coordinates only
+    junction_pixels = np.argwhere(junction_mask)
+    junction_pixel_labels = junction_labels[junction_mask]
+    junction_sizes = np.bincount(junction_pixel_labels, minlength=num_junctions + 1)[1:]
+    junction_centers = np.stack([np.bincount(junction_pixel_labels, weights=junction_pixels[:, axis], minlength=num_junctions + 1)[1:]
+                                 for axis in range(skeleton.ndim)], axis=1).reshape(-1, skeleton.ndim) / junction_sizes[:, None]
+    node_coords = np.concatenate([junction_centers, end_points.astype(float)]).reshape(-1, skeleton.ndim)
+    node_kind = np.concatenate([np.full(num_junctions, JUNCTION, dtype=np.int8),
+                                np.full(len(end_points), END_POINT, dtype=np.int8)])
+
+    # Pixel lengths of the runs plus the steps joining them to the junction clusters
+    lengths = _run_lengths(run_labels, num_runs)
+    pairs, contact_counts, contact_steps = _junction_contacts(run_labels, junction_labels)
+    np.add.at(lengths, pairs[:, 0], contact_steps)
+
+    # Group the end point nodes and the touched junction clusters by run
+    end_point_runs = run_labels[end_point_mask]
+    end_point_nodes = num_junctions + np.arange(len(end_points))
+    end_order = np.argsort(end_point_runs, kind='stable')
+    end_starts = np.searchsorted(end_point_runs[end_order], np.arange(num_runs + 2))
+    pair_starts = np.searchsorted(pairs[:, 0], np.arange(num_runs + 2))
+
+    # Turn every run into one edge between its terminal nodes
+    edge_nodes = []
+    edge_runs = []
+    for run in range(1, num_runs + 1):
+        terminals = list(end_point_nodes[end_order[end_starts[run]:end_starts[run + 1]]])
+        for index in range(pair_starts[run], pair_starts[run + 1]):
+            # A run touching the same cluster at both ends is a loop back to that cluster
+            cluster_node = pairs[index, 1] - 1
+            terminals.extend([cluster_node] * min(contact_counts[index], 2))
+
+        if not terminals:
+            run_edges = [(-1, -1)]
+        elif len(terminals) == 1:
+            # A slab pixel wedged between pixels of one cluster belongs to that cluster
+            continue
+        else:
+            run_edges = [(terminals[0], other) for other in terminals[1:]]
+        edge_nodes.extend(run_edges)
+        edge_runs.extend([run] * len(run_edges))
+
+    edge_nodes = np.array(edge_nodes, dtype=np.intp).reshape(-1, 2)
+    edge_lengths = lengths[np.array(edge_runs, dtype=np.intp)]
+
+    # Node degree is the number of edge ends at every node
+    node_degree = np.bincount(edge_nodes[edge_nodes >= 0], minlength=len(node_kind))
+
+    # Component of every junction cluster, end point and run
+    node_components = np.concatenate([label_values(components, junction_labels, num_junctions)[1:],
+                                      components[end_point_mask]])
+    edge_components = label_values(components, run_labels, num_runs)[np.array(edge_runs, dtype=np.intp)]
+
+    return BranchGraph(node_coords, node_kind, node_degree, edge_nodes, edge_lengths, components,
+                       node_components, edge_components)
+
+
+def count_ramifications(graph):
+    # Count the branches joining an end point to a junction cluster. Isolated pixels and loops
+    # are edges without nodes (-1, -1); they are left out before the node lookup
+    edge_nodes = graph.edge_nodes[(graph.edge_nodes >= 0).all(axis=1)]
+    node_kind = graph.node_kind[edge_nodes]
+    is_end = node_kind == END_POINT
+    is_junction = node_kind == JUNCTION
+    ramifications = (is_end[:, 0] & is_junction[:, 1]) | (is_junction[:, 0] & is_end[:, 1])
+    return int(np.count_nonzero(ramifications))
+
+
+def count_branches(graph):
+    # Every edge of the graph is one branch
+    return len(graph.edge_lengths)
+
+
+def average_branch_length(graph):
+    return float(graph.edge_lengths.mean()) if len(graph.edge_lengths) else 0.0
+
+
+def maximum_branch_length(graph):
+    return float(graph.edge_lengths.max()) if len(graph.edge_lengths) else 0.0
+
+
+def count_junctions(graph):
+    # Junction clusters, each counted once however many pixels it has
+    return int(np.count_nonzero(graph.node_kind == JUNCTION))
+
+
+def count_junction_points(graph, degree):
+    # Junction clusters where exactly `degree` branches meet
+    return int(np.count_nonzero((graph.node_kind == JUNCTION) & (graph.node_degree == degree)))
+
+
+def count_triple_points(graph):
+    return count_junction_points(graph, 3)
+
+
+def count_quadruple_points(graph):
+    return count_junction_points(graph, 4)
+
+
+def has_path(graph, start, end):
+    # Two skeleton pixels are connected when they belong to the same component
+    start_label = graph.components[tuple(start)]
+    end_label = graph.components[tuple(end)]
+    return bool(tuple(start) == tuple(end) or (start_label > 0 and start_label == end_label))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import ndimage
+
+
+# 3x3 kernel that sums the 8 neighbours of every pixel (the centre is excluded)
+NEIGHBOR_KERNEL = np.array([[1, 1, 1],
+                            [1, 0, 1],
+                            [1, 1, 1]], dtype=np.uint8)
+
+
+def neighbor_kernel(ndim):
+    # Kernel summing the 3 ** ndim - 1 neighbours of every pixel: 8 in 2D, 26 voxels in 3D
+    if ndim == 2:
+        return NEIGHBOR_KERNEL
+    kernel = np.ones((3,) * ndim, dtype=np.uint8)
+    kernel[(1,) * ndim] = 0
+    return kernel
+
+
+def count_neighbors(skeleton):
+    # Count the skeleton neighbours of every pixel (or voxel) with a single convolution.
+    # Pixels outside the image count as background
+    skeleton = np.asarray(skeleton, dtype=bool)
+    neighbor_count = ndimage.convolve(skeleton.astype(np.uint8), neighbor_kernel(skeleton.ndim), mode='constant', cval=0)
+
+    # Only skeleton pixels have a meaningful neighbour count
+    neighbor_count[~skeleton] = 0
+
+    return neighbor_count
+
+
+# Point types of the type raster of a SkeletonResult
+BACKGROUND = 0
+END_POINT = 1
+JUNCTION = 2
+SLAB = 3
+
+
+def point_types(skeleton):
+    # Type raster of the skeleton from the neighbour count of every pixel: one neighbour is
+    # an end point, more than two a junction, every other skeleton pixel a slab
+    skeleton = np.asarray(skeleton, dtype=bool)
+    neighbor_count = count_neighbors(skeleton)
+    types = np.where(skeleton, SLAB, BACKGROUND).astype(np.uint8)
+    types[skeleton & (neighbor_count == 1)] = END_POINT
+    types[skeleton & (neighbor_count > 2)] = JUNCTION
+    return types
+
+
+class SkeletonResult:
+    # Classified skeleton of one cell (or field): the boolean skeleton, the uint8 type raster
+    # (BACKGROUND, END_POINT, JUNCTION or SLAB per pixel) and the end point, junction and slab
+    # coordinates as N x 2 (N x 3 for volumes) intp arrays in raster order, as np.argwhere gives them.
+    # Membership tests look the pixel up in the raster instead of searching the coordinates
+
+    __slots__ = ('skeleton', 'types', 'end_points', 'junctions', 'slabs')
+
+    def __init__(self, skeleton, types=None):
+        self.skeleton = np.asarray(skeleton, dtype=bool)
+        self.types = point_types(self.skeleton) if types is None else types
+        self.end_points = np.argwhere(self.types == END_POINT)
+        self.junctions = np.argwhere(self.types == JUNCTION)
+        self.slabs = np.argwhere(self.types == SLAB)
+
+    def point_type(self, point):
+        return int(self.types[tuple(point)])
+
+    def is_end_point(self, point):
+        return self.types[tuple(point)] == END_POINT
+
+    def is_junction(self, point):
+        return self.types[tuple(point)] == JUNCTION
+
+    def is_slab(self, point):
+        return self.types[tuple(point)] == SLAB
+
+    def __contains__(self, point):
+        return bool(self.skeleton[tuple(point)])
+
+    def points(self):
+        return self.end_points, self.junctions, self.slabs
+
+
+def classify_points(skeleton):
+    # End points, junctions and slabs of the skeleton as N x 2 (row, col) coordinate arrays
+    # (N x 3 (plane, row, col) for volumes) in the same raster order as np.nonzero
+    return SkeletonResult(skeleton).points()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+from scipy import ndimage
+from skimage.measure import perimeter as region_perimeter
+from .cells import remove_small_objects
+
+
+def measure_soma(cell_image, min_soma_area=50, erosion_kernel=3):
+    # Remove small objects (ramifications)
+    cell_binary = remove_small_objects(cell_image, min_soma_area)
+
+    # Erosion to extract the soma
+    kernel = np.ones((erosion_kernel, erosion_kernel), np.uint8)
+    soma = cv2.erode(cell_binary, kernel, iterations=1)
+
+    # Label connected components in the soma. Wu's algorithm numbers the components in raster
+    # order like skimage's label, so that ties go to the same component
+    num_labels, labeled_soma, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(soma, 8, cv2.CV_32S, cv2.CCL_WU)
+
+    # Check if there are any labeled regions
+    if num_labels > 1:
+        # Find the largest region from the pixel counts of all labels
+        areas = stats[:, cv2.CC_STAT_AREA].copy()
+        areas[0] = 0
+        largest_label = int(np.argmax(areas))
+
+        # Keep only the largest region with a single lookup into the label image
+        soma_values = np.zeros(num_labels, dtype=soma.dtype)
+        soma_values[largest_label] = 255
+        largest_soma = soma_values[labeled_soma]
+
+        # Measure area, and the perimeter of the largest region only (as regionprops does, on its bounding box)
+        area = float(areas[largest_label])
+        left, top, width, height = stats[largest_label, :4]
+        soma_perimeter = region_perimeter(labeled_soma[top:top + height, left:left + width] == largest_label, 4)
+
+        return largest_soma, area, soma_perimeter
+    
+    else:
+        # Return the original soma (no extraction performed)
+        return soma, 0, 0
+
+
+
+def measure_soma_stack(cell_stack, min_soma_area=50, chunk_pixels=1 << 18):
+    # measure_soma for a stack of same-sized cell images (n x height x width), a few planes at a time:
+    # chunks of about chunk_pixels pixels stay in the CPU cache while saving the per-image calls.
+    # Returns the soma stack and the area and perimeter of every cell
+    cell_stack = np.asarray(cell_stack)
+    chunk_planes = max(1, chunk_pixels // max(1, cell_stack[0].size)) if len(cell_stack) else 1
+    somas, areas, perimeters = [], [], []
+    for first in range(0, len(cell_stack), chunk_planes):
+        chunk_somas, chunk_areas, chunk_perimeters = _measure_soma_planes(cell_stack[first:first + chunk_planes], min_soma_area)
+        somas.append(chunk_somas)
+        areas.append(chunk_areas)
+        perimeters.append(chunk_perimeters)
+
+    if not somas:
+        return np.zeros(cell_stack.shape, dtype=np.uint8), np.zeros(0), np.zeros(0)
+    return np.concatenate(somas), np.concatenate(areas), np.concatenate(perimeters)
+
+
+def _measure_soma_planes(cell_stack, min_soma_area):
+    # Every plane is labeled on its own (the structures never connect planes)
+    cell_stack = cell_stack.astype(bool)
+    num_cells = len(cell_stack)
+    within_plane = np.zeros((3, 3, 3), dtype=bool)
+
+    # Remove small objects (4-connected and of min_soma_area pixels or fewer, like remove_small_objects)
+    within_plane[1] = [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+    pieces, num_pieces = ndimage.label(cell_stack, within_plane)
+    piece_sizes = np.bincount(pieces.ravel(), minlength=num_pieces + 1)
+    keep = piece_sizes > min_soma_area
+    keep[0] = False
+    cell_binary = keep[pieces]
+
+    # Erode all planes with one cv2.erode call on the planes stacked vertically. Rows of 255
+    # between the planes keep them apart and, like the image border, do not erode
+    num_rows, num_cols = cell_stack.shape[1:]
+    stacked = np.full((num_cells, num_rows + 1, num_cols), 255, dtype=np.uint8)
+    stacked[:, :num_rows] = cell_binary * np.uint8(255)
+    kernel = np.ones((3, 3), np.uint8)
+    soma = cv2.erode(stacked.reshape(-1, num_cols), kernel, iterations=1).reshape(stacked.shape)[:, :num_rows] > 0
+
+    # Largest 8-connected component of every plane; on ties the first one, as np.argmax does
+    within_plane[1] = True
+    labeled_soma, num_components = ndimage.label(soma, within_plane)
+    areas = np.bincount(labeled_soma.ravel(), minlength=num_components + 1)[1:]
+    bounding_boxes = ndimage.find_objects(labeled_soma)
+    planes = np.array([box[0].start for box in bounding_boxes], dtype=np.intp)
+    order = np.lexsort((np.arange(num_components), -areas, planes))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = planes[order][1:] != planes[order][:-1]
+    largest_labels = order[first] + 1
+
+    soma_values = np.zeros(num_components + 1, dtype=np.uint8)
+    soma_values[largest_labels] = 255
+    somas = soma_values[labeled_soma]
+
+    # Area and perimeter of the winning components only; cells without a soma measure 0
+    cell_areas = np.zeros(num_cells)
+    cell_perimeters = np.zeros(num_cells)
+    for largest_label in largest_labels:
+        bounding_box = bounding_boxes[largest_label - 1]
+        plane = bounding_box[0].start
+        cell_areas[plane] = areas[largest_label - 1]
+        cell_perimeters[plane] = region_perimeter(labeled_soma[bounding_box][0] == largest_label, 4)
+
+    # Planes without any component keep their eroded image, like measure_soma
+    empty = np.ones(num_cells, dtype=bool)
+    empty[planes[largest_labels - 1]] = False
+    somas[empty] = soma[empty].astype(np.uint8) * 255
+
+    return somas, cell_areas, cell_perimeters
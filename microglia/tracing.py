@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module; peak RSS is then not recorded
+    resource = None
+
+
+# Active tracer of this process, None when tracing is disabled
+_tracer = None
+
+
+def _status_bytes(field):
+    # One memory field of /proc/self/status in bytes, None where there is no /proc (macOS, Windows)
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # Restart the resident set high-water mark of this process (Linux 4.0 and later).
+    # Returns False where it cannot be reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes since the last reset_peak_rss (VmHWM).
+    # Without /proc, the peak of the whole process lifetime (ru_maxrss is in bytes on macOS, KB elsewhere)
+    high_water_mark = _status_bytes('VmHWM')
+    if high_water_mark is not None or resource is None:
+        return high_water_mark
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+# Stages of this process being timed, and the lock guarding them and the high-water mark
+_open_stages = []
+_memory_lock = threading.Lock()
+
+
+class Tracer:
+    # Writes one JSON line per timed stage. Worker processes append to the same file;
+    # single short lines opened in append mode do not interleave. Both the CPU time and the
+    # peak RSS of a stage are those of the whole process, so they include other threads when
+    # cells run in a thread pool (hence process_cpu_s and process_peak_rss). The peak RSS is the
+    # highest resident set size reached while the stage ran, or None where the high-water mark
+    # cannot be reset (only the lifetime peak is known there)
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', buffering=1)
+        self.lock = threading.Lock()
+
+    def record(self, stage, wall, cpu, peak, item=None):
+        record = {'stage': stage, 'wall_s': wall, 'process_cpu_s': cpu, 'process_peak_rss': peak, 'pid': os.getpid()}
+        if item is not None:
+            record['item'] = item
+        # Threads analyzing cells side by side share the file
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class _Stage:
+    # Times one stage, tracks the peak RSS reached during it and hands both to the active tracer
+
+    def __init__(self, name, item):
+        self.name = name
+        self.item = item
+
+    def __enter__(self):
+        # Restart the high-water mark for this stage, after handing the peak so far to the
+        # enclosing (or concurrent) stages, whose own peak would otherwise be lost
+        with _memory_lock:
+            current_peak = peak_rss() or 0
+            for open_stage in _open_stages:
+                open_stage.peak = max(open_stage.peak, current_peak)
+            self.peak = 0
+            self.resets = reset_peak_rss()
+            _open_stages.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        with _memory_lock:
+            _open_stages.remove(self)
+            peak = max(self.peak, peak_rss() or 0) if self.resets else None
+        if _tracer is not None:
+            _tracer.record(self.name, wall, cpu, peak, self.item)
+
+
+class _NoStage:
+    # Shared do-nothing context manager used while tracing is disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name, item=None):
+    # Context manager timing one stage of one cell or field, e.g.
+    #     with stage('skeletonize', cell_id):
+    # Costs one global lookup when tracing is disabled
+    if _tracer is None:
+        return _NO_STAGE
+    return _Stage(name, item)
+
+
+def start_tracing(path, new_trace=False):
+    # Enable tracing in this process. The main process starts a new trace file,
+    # worker processes (started with this function as initializer) append to it
+    global _tracer
+    if path and _tracer is None:
+        if new_trace:
+            open(path, 'w').close()
+        _tracer = Tracer(path)
+
+
+def stop_tracing():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from skimage.morphology import disk
+import ArtifactPolicy as artifact_policy
+from ArtifactPolicy import ARTIFACT_POLICIES, ArtifactPolicy, is_sampled
+from ForAnalyzeSkeleton import collect_cell_tasks, process_cells
+from IndividualCellSelectandExtract import extract_cells
+from SyntheticMicroglia import synthetic_cell, synthetic_field
+
+
+def files_in(folder):
+    return sorted(os.path.relpath(os.path.join(root, filename), folder) for root, _, filenames in os.walk(folder) for filename in filenames)
+
+
+def test_sample_is_deterministic():
+    cell_ids = [f'field.tif_cell_{index}_processed' for index in range(1, 2001)]
+    sampled = [cell_id for cell_id in cell_ids if is_sampled(cell_id, 10)]
+    assert sampled == [cell_id for cell_id in cell_ids if ArtifactPolicy('sampled', 10).cell(cell_id)]
+    assert 150 < len(sampled) < 250
+    assert all(is_sampled(cell_id, 1) for cell_id in cell_ids)
+
+
+@pytest.mark.parametrize('policy', ARTIFACT_POLICIES)
+def test_extraction_writes_the_images_of_the_policy(tmp_path, policy):
+    image_path = str(tmp_path / 'field.tif')
+    Image.fromarray(synthetic_field(num_cells=9, cell_size=100, seed=1)).save(image_path)
+    output_folders = tuple(str(tmp_path / name) for name in ['selected', 'rectangles', 'cells', 'processed'])
+    for folder in output_folders:
+        os.makedirs(folder)
+    extract_cells(image_path, output_folders, artifacts=ArtifactPolicy(policy, sample_every=2))
+
+    # The processed cells are always written, the analyses read them
+    processed = files_in(output_folders[3])
+    cell_ids = [os.path.basename(path)[:-len('_processed.png')] for path in processed]
+    assert len(cell_ids) == 9
+
+    summary = files_in(output_folders[0]) + files_in(output_folders[1])
+    assert summary == ([] if policy == 'none' else ['Selected_cells_field.tif', 'Selected_cells_rectangles_numbers_field.tif'])
+
+    # No synthetic cell is empty after cleaning, so none is flagged here
+    expected = {'all': cell_ids, 'sampled': [cell_id for cell_id in cell_ids if is_sampled(f'{cell_id}_processed', 2)]}.get(policy, [])
+    assert files_in(output_folders[2]) == sorted(os.path.join('Individual_Cells_field.tif', f'{cell_id}.png') for cell_id in expected)
+    if policy == 'sampled':
+        assert 0 < len(expected) < 9
+
+
+def write_cell_folders(main_folder):
+    # Two fields of processed cells: branched cells and round cells (a skeleton without junctions
+    # is flagged). Returns the cell IDs by field and the IDs of the round cells
+    cell_ids, round_cells = {}, set()
+    for field, seeds in [('field_1', [0, 1, 2]), ('field_2', [3, 4])]:
+        os.makedirs(main_folder / field)
+        cell_ids[field] = []
+        for seed in seeds:
+            cell_id = f'{field}_cell_{seed}_processed'
+            if seed % 2:
+                cell = np.pad(disk(15), 10).astype(bool)
+                round_cells.add(cell_id)
+            else:
+                cell = synthetic_cell(100, seed=seed)
+            Image.fromarray(cell.astype(np.uint8) * 255).save(str(main_folder / field / f'{cell_id}.png'))
+            cell_ids[field].append(cell_id)
+    return cell_ids, round_cells
+
+
+@pytest.mark.parametrize('policy', ARTIFACT_POLICIES)
+def test_skeleton_images_of_the_policy(tmp_path, policy):
+    cell_ids, round_cells = write_cell_folders(tmp_path)
+    output_parent_folder = str(tmp_path / 'skeletons')
+    cell_tasks = collect_cell_tasks(str(tmp_path), output_parent_folder)
+    rows = list(process_cells(cell_tasks, artifacts=ArtifactPolicy(policy, sample_every=2)))
+    assert [row[0] for row in rows] == cell_ids['field_1'] + cell_ids['field_2']
+
+    written = set()
+    for field, field_cell_ids in cell_ids.items():
+        for cell_id in field_cell_ids:
+            if {'all': True, 'sampled': is_sampled(cell_id, 2), 'flagged': cell_id in round_cells}.get(policy, False):
+                written.update(os.path.join(f'{field}_Skeletonize', f'{prefix}_{cell_id}.png') for prefix in ['Skeletonize', 'Segmented', 'Visualization'])
+    assert files_in(output_parent_folder) == sorted(written)
+    if policy == 'flagged':
+        assert len(written) == 2 * 3
+
+
+def test_every_archive_is_written_once(tmp_path, monkeypatch):
+    cell_ids, _ = write_cell_folders(tmp_path)
+    output_parent_folder = str(tmp_path / 'skeletons')
+    cell_tasks = collect_cell_tasks(str(tmp_path), output_parent_folder)
+
+    saved = []
+    save_archive = artifact_policy.save_archive
+
+    def record_archive(path, images):
+        saved.append(path)
+        save_archive(path, images)
+    monkeypatch.setattr(artifact_policy, 'save_archive', record_archive)
+    list(process_cells(cell_tasks, artifacts=ArtifactPolicy('all', archive=True)))
+
+    archives = [os.path.join(output_parent_folder, f'{field}_Skeletonize.npz') for field in cell_ids]
+    assert saved == archives
+    assert files_in(output_parent_folder) == [os.path.basename(path) for path in archives]
+    for path, field_cell_ids in zip(archives, cell_ids.values()):
+        with np.load(path) as archive:
+            assert sorted(archive.files) == sorted(f'{prefix}_{cell_id}' for cell_id in field_cell_ids for prefix in ['Skeletonize', 'Segmented'])
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from AsyncImageIO import start_writing, finish_writing, write_image
+from ForAnalyzeSkeleton import process_cells
+from SyntheticMicroglia import synthetic_cell
+
+IMAGE = np.zeros((8, 8), dtype=np.uint8)
+
+
+def test_failed_write_raises(tmp_path):
+    with pytest.raises(OSError, match='Could not write'):
+        write_image(cv2.imwrite, str(tmp_path / 'missing' / 'image.png'), IMAGE)
+
+
+def test_failed_background_write_stops_the_run(tmp_path):
+    start_writing(2)
+    try:
+        write_image(cv2.imwrite, str(tmp_path / 'missing' / 'image.png'), IMAGE)
+    finally:
+        with pytest.raises(OSError, match='Could not write'):
+            finish_writing()
+
+
+def test_failed_write_in_a_worker_stops_the_run(tmp_path):
+    # The last write of the worker fails (a folder is in the way of the visualization). Queued on
+    # the writer inherited from the main process, the failure would never be seen
+    cell_image_path = str(tmp_path / 'cell_1_processed.png')
+    Image.fromarray(synthetic_cell(80).astype(np.uint8) * 255).save(cell_image_path)
+    output_folder = tmp_path / 'skeletons'
+    (output_folder / 'Visualization_cell_1_processed.png').mkdir(parents=True)
+    cell_tasks = [(cell_image_path, str(output_folder))]
+
+    start_writing(2)
+    try:
+        with pytest.raises(OSError, match='Could not write'):
+            list(process_cells(cell_tasks, workers=2))
+    finally:
+        finish_writing()
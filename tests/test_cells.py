@@ -0,0 +1,41 @@
+import warnings
+import cv2
+import numpy as np
+import pytest
+from skimage.morphology import remove_small_objects as skimage_remove_small_objects
+from microglia import threshold_cell, remove_small_objects
+
+
+def baseline_remove_small_objects(binary, min_size):
+    # The noise removal of the original scripts (skimage 0.26 deprecates min_size for max_size)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return skimage_remove_small_objects(binary.astype(bool), min_size=min_size).astype(np.uint8) * 255
+
+
+def random_cell_crops(seed, count=20):
+    # Grey crops with speckle noise and objects of every size around the cutoffs
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        crop = (rng.random((80, 90)) * 140).astype(np.uint8)
+        for _ in range(rng.integers(1, 12)):
+            top, left = rng.integers(0, 70, size=2)
+            height, width = rng.integers(1, 15, size=2)
+            crop[top:top + height, left:left + width] = rng.integers(101, 256)
+        yield crop
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_threshold_cell_matches_baseline(seed):
+    for crop in random_cell_crops(seed):
+        cell_binary = cv2.threshold(crop, 100, 255, cv2.THRESH_BINARY)[1]
+        assert np.array_equal(threshold_cell(crop), baseline_remove_small_objects(cell_binary, 100))
+
+
+@pytest.mark.parametrize('size', [99, 100, 101])
+def test_objects_of_exactly_min_size_are_removed(size):
+    binary = np.zeros((30, 130), dtype=np.uint8)
+    binary[5, 10:10 + size] = 255
+    cleaned = remove_small_objects(binary, 100)
+    assert np.array_equal(cleaned, baseline_remove_small_objects(binary, 100))
+    assert cleaned.any() == (size > 100)
@@ -0,0 +1,52 @@
+import numpy as np
+from skimage.morphology import disk
+from SyntheticMicroglia import synthetic_cell
+from microglia import select_cells, selected_cell_labels, analyze_labeled_field
+from microglia.field_analysis import remove_small_pieces
+
+
+def analyze_field_array(field, **options):
+    labels, regions = select_cells(field)
+    return analyze_labeled_field(field, selected_cell_labels(labels, regions), len(regions), **options)
+
+
+def test_blank_field():
+    # A field without any selected cell has no rows and empty field images
+    rows, soma_labels, skeleton = analyze_field_array(np.zeros((50, 60), dtype=np.uint8), field_images=True, morphology=True)
+    assert rows == []
+    assert soma_labels.shape == skeleton.shape == (50, 60)
+    assert not soma_labels.any() and not skeleton.any()
+
+
+def test_field_of_round_cells():
+    # Round (amoeboid) cells only: the shared branch graph has no nodes at all
+    field = np.zeros((50, 100), dtype=np.uint8)
+    field[5:36, 5:36] = disk(15).astype(np.uint8) * 255
+    field[10:31, 60:81] = disk(10).astype(np.uint8) * 255
+    rows, _, _ = analyze_field_array(field)
+    assert [row[2:7] for row in rows] == [[0, 0, 0, 1, 1]] * 2
+
+
+def test_round_cell_next_to_a_branched_cell():
+    # A filled disk skeletonizes to a single pixel, an edge without nodes in the shared branch graph
+    field = np.zeros((120, 260), dtype=np.uint8)
+    field[10:41, 10:41] = disk(15).astype(np.uint8) * 255
+    field[:, 60:260] = synthetic_cell(200, seed=1)[:120].astype(np.uint8) * 255
+    rows, _, _ = analyze_field_array(field, morphology=True)
+    assert len(rows) == 2
+    round_cell = rows[0]
+    assert round_cell[2:6] == [0, 0, 0, 1]
+    assert rows[1][2] > 0
+
+
+def test_remove_small_pieces_removes_pieces_of_min_size():
+    # Pieces of min_size pixels or fewer go, as on the per-cell path; touching pieces of two cells stay apart
+    cell_labels = np.zeros((6, 12), dtype=np.int32)
+    cell_labels[0, 0:4] = 1
+    cell_labels[2, 0:5] = 1
+    cell_labels[4, 0:3] = 1
+    cell_labels[4, 3:6] = 2
+    kept = remove_small_pieces(cell_labels, 4)
+    np.testing.assert_array_equal(kept[0], 0)
+    np.testing.assert_array_equal(kept[2, 0:5], 1)
+    np.testing.assert_array_equal(kept[4], 0)
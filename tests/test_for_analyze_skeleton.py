@@ -0,0 +1,15 @@
+import numpy as np
+from PIL import Image
+from ForAnalyzeSkeleton import process_cell
+from SyntheticMicroglia import synthetic_cell
+from microglia import analyze_cell, threshold_cell
+
+
+def test_morphology_metrics_agree_with_the_pipeline(tmp_path):
+    # The Sholl metrics of a processed cell image are taken around its soma, as in MicrogliaPipeline
+    for seed in range(3):
+        cell_binary = threshold_cell(synthetic_cell(seed=seed).astype(np.uint8) * 255)
+        cell_image_path = str(tmp_path / f'cell_{seed}_processed.png')
+        Image.fromarray(cell_binary).save(cell_image_path)
+        row, _ = process_cell((cell_image_path, str(tmp_path)), morphology=True)
+        assert row[1:] == analyze_cell(cell_binary, morphology=True).measurements[2:]
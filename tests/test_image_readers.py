@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from ImageReaders import is_stack, max_projection
+
+tifffile = pytest.importorskip('tifffile')
+
+# Stacks as written by tifffile: the options of imwrite and the axes of the written array
+STACKS = {
+    'plain_zyx': ({}, 'ZYX'),
+    'shaped_czyx': ({'metadata': {'axes': 'CZYX'}}, 'CZYX'),
+    'shaped_zcyx': ({'metadata': {'axes': 'ZCYX'}}, 'ZCYX'),
+    'shaped_zyxs': ({}, 'ZYXS'),
+    'imagej_zcyx': ({'imagej': True, 'metadata': {'axes': 'ZCYX'}}, 'ZCYX'),
+    'imagej_zyx': ({'imagej': True, 'metadata': {'axes': 'ZYX'}}, 'ZYX'),
+    'ome_czyx': ({'ome': True, 'metadata': {'axes': 'CZYX'}}, 'CZYX'),
+    'ome_zyx': ({'ome': True, 'metadata': {'axes': 'ZYX'}}, 'ZYX'),
+}
+SIZES = {'C': 2, 'Z': 5, 'Y': 12, 'X': 14, 'S': 3}
+
+
+def write_stack(tmp_path, name):
+    options, axes = STACKS[name]
+    stack = np.random.default_rng(len(name)).integers(0, 256, [SIZES[axis] for axis in axes], dtype=np.uint8)
+    path = str(tmp_path / f'{name}.tif')
+    tifffile.imwrite(path, stack, **options)
+    return path, stack, axes
+
+
+def expected_projection(stack, axes, channel=0, z_planes=(0, None)):
+    # The projection as plain NumPy: pick the channel, cut the z range, take the maximum over z
+    if 'C' in axes:
+        stack = np.take(stack, channel, axis=axes.index('C'))
+        axes = axes.replace('C', '')
+    if 'S' in axes:
+        stack = np.take(stack, channel, axis=axes.index('S'))
+        axes = axes.replace('S', '')
+    stack = np.moveaxis(stack, axes.index('Z'), 0)[slice(*z_planes)]
+    return np.max(stack, axis=0)
+
+
+@pytest.mark.parametrize('name', sorted(STACKS))
+def test_projection_of_every_channel(tmp_path, name):
+    path, stack, axes = write_stack(tmp_path, name)
+    assert is_stack(path)
+    num_channels = SIZES['C'] if 'C' in axes else SIZES['S'] if 'S' in axes else 1
+    for channel in range(num_channels):
+        assert np.array_equal(max_projection(path, channel, chunk_planes=2), expected_projection(stack, axes, channel))
+
+
+@pytest.mark.parametrize('name', ['plain_zyx', 'shaped_czyx', 'imagej_zcyx', 'ome_czyx'])
+def test_projection_of_a_z_range(tmp_path, name):
+    path, stack, axes = write_stack(tmp_path, name)
+    assert np.array_equal(max_projection(path, 0, z_planes=(1, 3)), expected_projection(stack, axes, 0, (1, 3)))
+    with pytest.raises(ValueError, match='No planes'):
+        max_projection(path, 0, z_planes=(7, None))
+
+
+@pytest.mark.parametrize('name, channel', [('plain_zyx', 1), ('ome_zyx', 1), ('imagej_zyx', 1),
+                                           ('shaped_czyx', 2), ('imagej_zcyx', 2), ('shaped_zyxs', 3), ('ome_czyx', -1)])
+def test_channel_out_of_range(tmp_path, name, channel):
+    path, _, _ = write_stack(tmp_path, name)
+    with pytest.raises(ValueError, match='channel'):
+        max_projection(path, channel)
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_pages_of_several_planes(tmp_path):
+    # A shaped CZYX stack of 3 z planes is stored as 2 pages of 3 planar samples each
+    path = str(tmp_path / 'planar.tif')
+    stack = np.random.default_rng(0).integers(0, 256, (2, 3, 20, 20), dtype=np.uint8)
+    tifffile.imwrite(path, stack, metadata={'axes': 'CZYX'})
+    for channel in range(2):
+        assert np.array_equal(max_projection(path, channel, z_planes=(1, None)), np.max(stack[channel, 1:], axis=0))
+
+
+def test_single_plane_is_not_a_stack(tmp_path):
+    path = str(tmp_path / 'plane.tif')
+    tifffile.imwrite(path, np.zeros((12, 14), dtype=np.uint8))
+    assert not is_stack(path)
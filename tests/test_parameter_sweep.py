@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from skimage.morphology import disk
+import MicrogliaPipeline
+import ParameterSweep
+from ParameterSweep import ParameterSet, parameter_grid, parameter_tag
+from ResultsWriter import read_results
+from SyntheticMicroglia import synthetic_field
+from microglia import select_cells, crop_cell, threshold_cell, measure_soma, analyze_skeleton_array, skeleton_measurements, morphology_metrics
+
+OPTIONS = ['--region', 'R', '--group', 'G', '--output-format', 'csv', '--morphology']
+
+
+def test_repeated_values_are_swept_once():
+    assert parameter_grid(threshold_values=(100, 150, 100)) == [ParameterSet(300, 100, 100, 50, 3), ParameterSet(300, 150, 100, 50, 3)]
+
+
+@pytest.fixture(scope='module')
+def input_folder(tmp_path_factory):
+    # Branched cells, round cells of about 450 pixels (selected at 300 but not at 600) and 8 x 8
+    # objects, which only survive a min_object_size below 64 in the crops they fall into
+    input_folder = tmp_path_factory.mktemp('fields')
+    rng = np.random.default_rng(0)
+    for seed in range(2):
+        field = synthetic_field(num_cells=4, cell_size=100, field_shape=(300, 300), noise_objects=0, seed=seed)
+        field[220:245, 20:45][disk(12) > 0] = 255
+        field[250:275, 250:275][disk(12) > 0] = 255
+        for row, col in rng.integers(0, 292, size=(12, 2)):
+            if not field[max(0, row - 1):row + 9, max(0, col - 1):col + 9].any():
+                field[row:row + 8, col:col + 8] = 255
+        Image.fromarray(field).save(str(input_folder / f'field_{seed}.tif'))
+    return input_folder
+
+
+def sweep_tables(input_folder, output_folder, *grid_options):
+    ParameterSweep.main([str(input_folder), '--output-folder', str(output_folder)] + OPTIONS + list(grid_options))
+    tables = {}
+    for filename in os.listdir(output_folder):
+        rows = list(read_results(str(output_folder / filename)))
+        tables[filename[len('Microglia_Measurements_R_G_'):-len('.csv')]] = rows
+    return tables
+
+
+def pipeline_table(input_folder, output_folder, *options):
+    MicrogliaPipeline.main([str(input_folder), '--output-folder', str(output_folder)] + OPTIONS + list(options))
+    return list(read_results(str(output_folder / 'Microglia_Measurements_R_G.csv')))
+
+
+def reference_table(input_folder, parameters):
+    # The table of one parameter set, measured cell by cell with the microglia functions
+    rows = [list(MicrogliaPipeline.result_columns(morphology=True))]
+    for filename in sorted(os.listdir(input_folder)):
+        image_array = np.array(Image.open(str(input_folder / filename)))
+        for idx, region in enumerate(select_cells(image_array, parameters.min_cell_area)[1]):
+            cell_binary = threshold_cell(crop_cell(image_array, region), parameters.threshold_value, parameters.min_object_size)
+            soma, area, perimeter = measure_soma(cell_binary, parameters.min_soma_area, parameters.erosion_kernel)
+            result, _, num_ramifications, graph = analyze_skeleton_array(cell_binary)
+            rows.append([f'{filename}_cell_{idx + 1}_processed', 'R', 'G', area, perimeter] + skeleton_measurements(result, num_ramifications, graph)
+                        + morphology_metrics(cell_binary, result.skeleton, soma))
+    return rows
+
+
+def test_default_parameters_match_the_pipeline(tmp_path, input_folder):
+    tables = sweep_tables(input_folder, tmp_path / 'sweep')
+    assert list(tables) == [parameter_tag(ParameterSet(300, 100, 100, 50, 3))]
+    assert list(tables.values())[0] == pipeline_table(input_folder, tmp_path / 'pipeline')
+
+
+def test_other_cell_areas_and_object_sizes(tmp_path, input_folder):
+    tables = sweep_tables(input_folder, tmp_path / 'sweep', '--min-cell-area', '300', '600', '--min-object-size', '100', '40')
+    assert len(tables) == 4
+    large_cells = ParameterSet(600, 100, 100, 50, 3)
+    assert tables[parameter_tag(large_cells)] == pipeline_table(input_folder, tmp_path / 'pipeline', '--min-cell-area', '600')
+    for parameters in parameter_grid([300, 600], [100], [100, 40]):
+        assert tables[parameter_tag(parameters)] == reference_table(input_folder, parameters)
+
+    # The grid points measure different cells, and small objects change the measurements
+    assert len(tables[parameter_tag(ParameterSet(300, 100, 100, 50, 3))]) > len(tables[parameter_tag(large_cells)])
+    assert tables[parameter_tag(ParameterSet(600, 100, 40, 50, 3))] != tables[parameter_tag(large_cells)]
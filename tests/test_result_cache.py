@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import MicrogliaPipeline
+import ResultCache as result_cache
+from ResultCache import ResultCache
+from ResultsWriter import read_results
+from SyntheticMicroglia import synthetic_field
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / 'image.tif'
+    path.write_bytes(b'image content')
+    return str(path)
+
+
+def test_hit_and_miss(tmp_path, image_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = cache.key('soma', image_path, {'min_soma_area': 50})
+    assert cache.get(key) is None
+
+    cache.put(key, [np.int64(3), np.float64(2.5), 'cell_1'], {'soma': np.eye(3, dtype=np.uint8)})
+    values, arrays = ResultCache(str(tmp_path / 'cache')).get(key)
+    assert values == [3, 2.5, 'cell_1']
+    assert list(arrays) == ['soma'] and np.array_equal(arrays['soma'], np.eye(3))
+
+
+def test_key_changes_with_the_image_parameters_and_version(tmp_path, image_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = cache.key('soma', image_path, {'min_soma_area': 50})
+    assert cache.key('soma', image_path, {'min_soma_area': 50}) == key
+    assert cache.key('soma', image_path, {'min_soma_area': 60}) != key
+    assert cache.key('skeleton', image_path, {'min_soma_area': 50}) != key
+
+    monkeypatch.setattr(result_cache, 'CACHE_VERSION', result_cache.CACHE_VERSION + 1)
+    assert cache.key('soma', image_path, {'min_soma_area': 50}) != key
+    monkeypatch.undo()
+
+    with open(image_path, 'ab') as file:
+        file.write(b'!')
+    assert cache.key('soma', image_path, {'min_soma_area': 50}) != key
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    for index, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, [index], {'data': np.arange(1000) + index})
+        os.utime(cache.entry_path(key), (1000 + index, 1000 + index))
+    entry_bytes = max(size for _, size, _ in cache.entries())
+
+    # Reading 'a' makes it the most recently used, so 'b' goes first
+    assert cache.get('a') is not None
+    limited = ResultCache(cache.cache_dir, max_bytes=3 * entry_bytes)
+    limited.put('d', [3], {'data': np.arange(1000) + 3})
+    assert sorted(os.path.basename(path) for path, _, _ in limited.entries()) == ['a.npz', 'c.npz', 'd.npz']
+    assert limited.size() <= 3 * entry_bytes
+
+
+@pytest.mark.parametrize('damage', ['empty', 'truncated', 'garbage', 'no_values'])
+def test_corrupt_entry_is_a_miss(tmp_path, damage):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    cache.put('key', [1, 2.0], {'data': np.arange(1000)})
+    path = cache.entry_path('key')
+    content = open(path, 'rb').read()
+    if damage == 'no_values':
+        np.savez_compressed(path, data=np.arange(3))
+    else:
+        with open(path, 'wb') as file:
+            file.write({'empty': b'', 'truncated': content[:len(content) // 2], 'garbage': b'not an entry'}[damage])
+    assert cache.get('key') is None
+
+    cache.put('key', [1, 2.0])
+    assert cache.get('key') == ([1, 2.0], {})
+
+
+def run_pipeline(input_folder, output_folder, *options):
+    MicrogliaPipeline.main([str(input_folder), '--region', 'R', '--group', 'G', '--output-folder', str(output_folder),
+                            '--output-format', 'csv', '--morphology'] + list(options))
+    return list(read_results(str(output_folder / 'Microglia_Measurements_R_G.csv')))
+
+
+def test_cached_pipeline_matches_uncached(tmp_path, monkeypatch):
+    input_folder = tmp_path / 'fields'
+    input_folder.mkdir()
+    for seed in range(2):
+        Image.fromarray(synthetic_field(num_cells=4, cell_size=100, seed=seed)).save(str(input_folder / f'field_{seed}.tif'))
+    cache_dir = str(tmp_path / 'cache')
+
+    uncached = run_pipeline(input_folder, tmp_path / 'uncached')
+    assert len(uncached) > 1
+    assert run_pipeline(input_folder, tmp_path / 'first', '--cache-dir', cache_dir) == uncached
+
+    # The rerun takes every row from the cache: the fields are not analyzed again
+    def fail(*args, **kwargs):
+        raise AssertionError('field analyzed again')
+    monkeypatch.setattr(MicrogliaPipeline, 'select_cells', fail)
+    assert run_pipeline(input_folder, tmp_path / 'second', '--cache-dir', cache_dir) == uncached
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from ResultsWriter import ID_COLUMNS, OUTPUT_FORMATS, export_excel, open_results_writer, read_results, results_path
+
+COLUMNS = ID_COLUMNS + ['Area', '# Branches', 'Average Branch Length']
+
+# Plain and NumPy values, whole floats (which Excel stores as integers) and floats that only
+# survive a text round trip when written in full
+ROWS = [['cell_1', 'CX', 'MOR', np.float64(12.5), np.int64(3), 2.0],
+        ['cell_2', 'CX', 'MOR', 7.0, 0, np.float32(0.25)],
+        ['cell_3', 'CX', 'MOR', 1 / 3, np.int32(12), np.float64(0.1) + np.float64(0.2)]]
+
+# The rows as read back: text, integers and floats by column
+EXPECTED = [[str(row[0]), row[1], row[2], float(row[3]), int(row[4]), float(row[5])] for row in ROWS]
+
+
+def check_rows(path, chunk_size=10000):
+    rows = read_results(path, chunk_size)
+    assert next(rows) == COLUMNS
+    rows = [list(row) for row in rows]
+    expected = EXPECTED * (len(rows) // len(EXPECTED))
+    if path.endswith('.xlsx'):
+        # Excel keeps 15 significant digits
+        expected = [[pytest.approx(value, rel=1e-15) if isinstance(value, float) else value for value in row] for row in expected]
+    assert rows == expected
+    assert all([type(value) for value in row] == [str, str, str, float, int, float] for row in rows)
+    return len(rows)
+
+
+@pytest.mark.parametrize('output_format', sorted(OUTPUT_FORMATS))
+def test_round_trip(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = results_path(str(tmp_path), 'Results', output_format)
+    # More rows than one CSV chunk (1000 rows) and read back in many small Parquet batches
+    with open_results_writer(path, COLUMNS, output_format) as writer:
+        for _ in range(400):
+            for row in ROWS:
+                writer.write_row(row)
+    assert check_rows(path, chunk_size=7) == 1200
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_excel_export(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = results_path(str(tmp_path), 'Results', output_format)
+    with open_results_writer(path, COLUMNS) as writer:
+        for row in ROWS:
+            writer.write_row(row)
+    assert check_rows(export_excel(path, str(tmp_path / 'Results.xlsx'))) == 3
+
+
+@pytest.mark.parametrize('output_format', sorted(OUTPUT_FORMATS))
+def test_table_without_rows(tmp_path, output_format):
+    # A run (or shard) without any cell still writes the header
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = results_path(str(tmp_path), 'Results', output_format)
+    with open_results_writer(path, COLUMNS, output_format):
+        pass
+    assert list(read_results(path)) == [COLUMNS]
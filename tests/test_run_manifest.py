@@ -0,0 +1,62 @@
+import os
+import pytest
+import RunManifest as run_manifest
+from RunManifest import RunManifest, resume_results
+
+HEADER = {'script': 'test', 'columns': ['Cell ID', 'Area']}
+
+
+def test_resume_skips_completed_tasks(tmp_path):
+    path = str(tmp_path / 'run.manifest.jsonl')
+    with RunManifest(path, HEADER) as manifest:
+        assert list(resume_results(manifest, ['a', 'b'], ['a', 'b'], lambda tasks: ([task, 1.0] for task in tasks))) == [['a', 1.0], ['b', 1.0]]
+
+    processed = []
+
+    def process(tasks):
+        processed.extend(tasks)
+        return ([task, 2.0] for task in tasks)
+
+    with RunManifest(path, HEADER, resume=True) as manifest:
+        rows = list(resume_results(manifest, ['a', 'b', 'c'], ['a', 'b', 'c'], process))
+    assert processed == ['c']
+    assert rows == [['a', 1.0], ['b', 1.0], ['c', 2.0]]
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    # A record cut short by a crash is dropped, and the next record starts on its own line
+    path = str(tmp_path / 'run.manifest.jsonl')
+    with RunManifest(path, HEADER) as manifest:
+        manifest.record('a', ['a', 1.0])
+    with open(path, 'a') as file:
+        file.write('{"task": "b", "ro')
+
+    with RunManifest(path, HEADER, resume=True) as manifest:
+        assert manifest.completed == {'a': ['a', 1.0]}
+        manifest.record('b', ['b', 2.0])
+    with RunManifest(path, HEADER, resume=True) as manifest:
+        assert manifest.completed == {'a': ['a', 1.0], 'b': ['b', 2.0]}
+
+
+def test_other_settings_are_not_resumed(tmp_path):
+    path = str(tmp_path / 'run.manifest.jsonl')
+    RunManifest(path, HEADER).close()
+    with pytest.raises(ValueError):
+        RunManifest(path, dict(HEADER, columns=['Cell ID']), resume=True)
+
+
+def test_records_are_synced_in_batches(tmp_path, monkeypatch):
+    # One fsync per sync_every records (the header counts as one) and one for the rest on close
+    syncs = []
+    monkeypatch.setattr(run_manifest.os, 'fsync', lambda fd: syncs.append(fd))
+    path = str(tmp_path / 'run.manifest.jsonl')
+    manifest = RunManifest(path, HEADER, sync_every=10)
+    for index in range(24):
+        manifest.record(str(index), [str(index), float(index)])
+    assert len(syncs) == 2
+    manifest.close()
+    assert len(syncs) == 3
+
+    # Every record reached the file even without a sync
+    assert os.path.getsize(path) > 0
+    assert len(RunManifest(path, HEADER, resume=True).completed) == 24
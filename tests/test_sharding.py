@@ -0,0 +1,42 @@
+import os
+import pytest
+from ResultsWriter import open_results_writer, read_results
+from Sharding import main, merge_shards
+
+COLUMNS = ['Cell ID', 'Area']
+
+
+def write_shard(folder, index, count, rows):
+    with open_results_writer(str(folder / f'Soma_shard{index}of{count}.csv'), COLUMNS, 'csv') as writer:
+        for row in rows:
+            writer.write_row(row)
+
+
+def test_merge_keeps_the_shard_order(tmp_path):
+    write_shard(tmp_path, 1, 2, [['c', 3.0]])
+    write_shard(tmp_path, 0, 2, [['a', 1.0], ['b', 2.0]])
+    output_path = merge_shards(str(tmp_path), 'Soma', 'csv')
+    assert list(read_results(output_path)) == [COLUMNS, ['a', 1.0], ['b', 2.0], ['c', 3.0]]
+
+
+def test_missing_shard_is_named(tmp_path):
+    write_shard(tmp_path, 0, 3, [['a', 1.0]])
+    write_shard(tmp_path, 2, 3, [['c', 3.0]])
+    with pytest.raises(FileNotFoundError, match='Soma_shard1of3'):
+        merge_shards(str(tmp_path), 'Soma', 'csv')
+
+
+@pytest.mark.parametrize('content', ['', 'Cell ID,Area\na,1.0\nb\n'])
+def test_incomplete_shard_is_named(tmp_path, content):
+    # An empty shard or a cut-short row is reported, and no merged table is left behind
+    write_shard(tmp_path, 0, 2, [['a', 1.0]])
+    (tmp_path / 'Soma_shard1of2.csv').write_text(content)
+    with pytest.raises(ValueError, match='Shard 1 .*Soma_shard1of2.csv'):
+        merge_shards(str(tmp_path), 'Soma', 'csv')
+    assert not os.path.exists(tmp_path / 'Soma.csv')
+
+
+def test_main_reports_errors_without_traceback(tmp_path):
+    write_shard(tmp_path, 1, 2, [['b', 2.0]])
+    with pytest.raises(SystemExit, match='Cannot merge the shards: .*Soma_shard0of2'):
+        main([str(tmp_path), 'Soma', '--output-format', 'csv'])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from microglia import analyze_volume_array, skeleton_measurements
+from microglia.skeleton_graph import END_POINT, JUNCTION
+
+tifffile = pytest.importorskip('tifffile')
+from AnalyzeSkeleton3D import collect_volume_tasks, process_cell_volumes
+
+# Voxels of the six arms of the cross beyond its centre: -x, +x, -y, +y, -z, +z
+ARMS = (6, 10, 5, 8, 7, 9)
+
+# Measurements of the cross in the order of SKELETON_COLUMNS. The centre and its six neighbours
+# are junction voxels (the neighbours touch each other diagonally), so every branch runs from an
+# end point to the voxel before the junction cluster: one voxel shorter than its arm
+CROSS_MEASUREMENTS = [6, 6, 7, sum(ARMS) - 12, 6, 1, 0, 0, (sum(ARMS) - 6) / 6, max(ARMS) - 1.0]
+
+
+def draw_cross(volume, center):
+    plane, row, col = center
+    volume[plane, row, col - ARMS[0]:col + ARMS[1] + 1] = True
+    volume[plane, row - ARMS[2]:row + ARMS[3] + 1, col] = True
+    volume[plane - ARMS[4]:plane + ARMS[5] + 1, row, col] = True
+
+
+def test_cross():
+    volume = np.zeros((25, 25, 25), dtype=bool)
+    draw_cross(volume, (12, 12, 12))
+    result, num_ramifications, graph = analyze_volume_array(volume)
+    assert np.array_equal(result.skeleton, volume)
+    assert skeleton_measurements(result, num_ramifications, graph) == CROSS_MEASUREMENTS
+    assert sorted(graph.edge_lengths) == sorted(arm - 1 for arm in ARMS)
+    assert np.count_nonzero(graph.node_kind == END_POINT) == 6
+    assert np.count_nonzero(graph.node_kind == JUNCTION) == 1
+
+
+@pytest.mark.parametrize('slab_planes', [1, 5, 12, 100])
+def test_cells_across_slab_borders(tmp_path, slab_planes):
+    # Two crosses spanning several slabs (one has its junction on a slab border with 12 planes), and
+    # a noise object inside the bounding box of the first one, which its crop must leave out
+    volume = np.zeros((40, 30, 60), dtype=bool)
+    draw_cross(volume, (12, 12, 12))
+    draw_cross(volume, (26, 15, 40))
+    volume[6:8, 8:10, 19:21] = True
+    input_folder = tmp_path / 'stacks'
+    input_folder.mkdir()
+    tifffile.imwrite(str(input_folder / 'stack.tif'), volume.astype(np.uint8) * 255, imagej=True, metadata={'axes': 'ZYX'})
+
+    cell_tasks = collect_volume_tasks(str(input_folder), min_cell_volume=30, slab_planes=slab_planes, output_folder_skeletons=str(tmp_path))
+    assert [cell_task[2] for cell_task in cell_tasks] == ['stack.tif_cell_1', 'stack.tif_cell_2']
+    rows = list(process_cell_volumes(cell_tasks))
+    assert rows == [['stack.tif_cell_1'] + CROSS_MEASUREMENTS, ['stack.tif_cell_2'] + CROSS_MEASUREMENTS]
+
+    # The saved skeleton of the first cell is its cross in its bounding box plus one voxel, without the noise object
+    cross = np.zeros_like(volume)
+    draw_cross(cross, (12, 12, 12))
+    skeleton = tifffile.imread(str(tmp_path / 'Skeletonize_stack.tif_cell_1.tif')) > 0
+    assert np.array_equal(skeleton, cross[4:23, 6:22, 5:24])
+    assert volume[4:23, 6:22, 5:24].sum() > skeleton.sum()
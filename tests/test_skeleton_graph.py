@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from skimage.morphology import skeletonize, disk
+from microglia import skeleton_graph, analyze_skeleton_array, skeleton_measurements
+from test_skeleton_points import baseline_get_neighbors, baseline_identify_points, random_skeletons
+
+
+def baseline_count_ramifications(skeleton):
+    # count_ramifications of the original ForAnalyzeSkeleton.py: a depth-first search from every
+    # end point, counting the end points that reach a junction
+    end_points, junctions, _ = baseline_identify_points(skeleton)
+    junctions = set(map(tuple, junctions))
+    num_ramifications = 0
+    for end_point in end_points:
+        visited = set()
+        stack = [tuple(end_point)]
+        while stack:
+            current = stack.pop()
+            if current in junctions:
+                num_ramifications += 1
+                break
+            if current in visited:
+                continue
+            visited.add(current)
+            stack.extend(baseline_get_neighbors(current, skeleton))
+    return num_ramifications
+
+
+def count_ramifications(skeleton):
+    return skeleton_graph.count_ramifications(skeleton_graph.build_skeleton_graph(skeleton))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_count_ramifications_matches_baseline_search(seed):
+    for pixels in random_skeletons(seed):
+        skeleton = skeletonize(pixels)
+        assert count_ramifications(skeleton) == baseline_count_ramifications(skeleton)
+
+
+def test_single_pixel_skeleton():
+    # A graph without nodes: one isolated pixel is an edge without end nodes
+    skeleton = np.zeros((5, 5), dtype=bool)
+    skeleton[2, 2] = True
+    graph = skeleton_graph.build_skeleton_graph(skeleton)
+    assert len(graph.node_kind) == 0
+    assert count_ramifications(skeleton) == 0
+    assert skeleton_graph.count_branches(graph) == 1
+
+
+def test_isolated_loop():
+    # A closed ring has neither end points nor junctions
+    skeleton = np.zeros((7, 7), dtype=bool)
+    skeleton[1, 1:6] = skeleton[5, 1:6] = skeleton[1:6, 1] = skeleton[1:6, 5] = True
+    skeleton[1, 1] = skeleton[1, 5] = skeleton[5, 1] = skeleton[5, 5] = False
+    graph = skeleton_graph.build_skeleton_graph(skeleton)
+    assert len(graph.node_kind) == 0
+    assert count_ramifications(skeleton) == 0
+
+
+def test_isolated_loop_next_to_a_branched_piece():
+    # The node-less loop edge must not be counted against the nodes of the other piece
+    skeleton = np.zeros((9, 16), dtype=bool)
+    skeleton[1, 1:6] = skeleton[5, 1:6] = skeleton[1:6, 1] = skeleton[1:6, 5] = True
+    skeleton[1, 1] = skeleton[1, 5] = skeleton[5, 1] = skeleton[5, 5] = False
+    skeleton[4, 8:15] = True
+    skeleton[1:4, 11] = True
+    assert count_ramifications(skeleton) == baseline_count_ramifications(skeleton) == 3
+
+
+@pytest.mark.parametrize('radius', [5, 10, 15])
+def test_round_cell(radius):
+    # A filled disk (an amoeboid cell) skeletonizes to a single pixel
+    cell = np.pad(disk(radius), 2).astype(np.uint8) * 255
+    result, _, num_ramifications, graph = analyze_skeleton_array(cell)
+    assert len(result.skeleton.nonzero()[0]) == 1
+    assert num_ramifications == 0
+    assert skeleton_measurements(result, num_ramifications, graph)[:4] == [0, 0, 0, 1]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from skimage.morphology import skeletonize
+from microglia import identify_points, classify_points
+
+
+def baseline_get_neighbors(coord, skeleton):
+    # get_neighbors of the original ForAnalyzeSkeleton.py
+    offsets = [(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+    height, width = skeleton.shape
+    neighbors = []
+    for dx, dy in offsets:
+        x, y = coord[0] + dx, coord[1] + dy
+        if 0 <= x < height and 0 <= y < width and skeleton[x, y]:
+            neighbors.append((x, y))
+    return neighbors
+
+
+def baseline_identify_points(skeleton):
+    # identify_points of the original ForAnalyzeSkeleton.py (one get_neighbors call per pixel)
+    end_points, junctions, slabs = [], [], []
+    for coord in np.transpose(np.nonzero(skeleton)):
+        num_neighbors = len(baseline_get_neighbors(coord, skeleton))
+        if num_neighbors == 1:
+            end_points.append(coord)
+        elif num_neighbors > 2:
+            junctions.append(coord)
+        else:
+            slabs.append(coord)
+    return [np.array(points, dtype=np.intp).reshape(-1, 2) for points in (end_points, junctions, slabs)]
+
+
+def random_skeletons(seed, count=40):
+    # Skeletons of random blobs and plain random pixel sets, both reaching the image border
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        height, width = rng.integers(1, 60, 2)
+        pixels = rng.random((height, width)) < rng.uniform(0.05, 0.7)
+        yield pixels
+        yield skeletonize(pixels)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_identify_points_matches_baseline_loop(seed):
+    for skeleton in random_skeletons(seed):
+        result = identify_points(skeleton)
+        for points, expected in zip(result.points(), baseline_identify_points(skeleton)):
+            np.testing.assert_array_equal(points, expected)
+
+
+def test_border_pixels_have_no_outside_neighbours():
+    # Every border pixel of a full image: corners have 3 neighbours, edges 5
+    skeleton = np.ones((4, 5), dtype=bool)
+    end_points, junctions, slabs = classify_points(skeleton)
+    assert len(end_points) == 0 and len(slabs) == 0
+    np.testing.assert_array_equal(junctions, np.argwhere(skeleton))
+
+    # A line along the first row ends in end points on the image corners
+    skeleton = np.zeros((3, 6), dtype=bool)
+    skeleton[0] = True
+    end_points, junctions, slabs = classify_points(skeleton)
+    np.testing.assert_array_equal(end_points, [[0, 0], [0, 5]])
+    assert len(junctions) == 0 and len(slabs) == 4
+
+
+def test_isolated_pixel_is_a_slab():
+    # Pixels without neighbours are slabs, as in the original loop
+    end_points, junctions, slabs = classify_points(np.ones((1, 1), dtype=bool))
+    assert len(end_points) == 0 and len(junctions) == 0
+    np.testing.assert_array_equal(slabs, [[0, 0]])
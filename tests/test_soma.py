@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+from skimage.measure import label, regionprops
+from microglia import measure_soma, measure_soma_stack
+from test_cells import baseline_remove_small_objects, random_cell_crops
+
+
+def baseline_measure_soma(cell_image, min_soma_area=50):
+    # extract_soma_and_measure of the original SomaMeasurements.py, without the file handling
+    cell_binary = baseline_remove_small_objects(cell_image, min_soma_area)
+    soma = cv2.erode(cell_binary, np.ones((3, 3), np.uint8), iterations=1)
+    labeled_soma = label(soma)
+    props = regionprops(labeled_soma)
+    if props:
+        largest_index = np.argmax([prop.area for prop in props])
+        largest_soma = np.zeros_like(soma)
+        largest_soma[labeled_soma == largest_index + 1] = 255
+        return largest_soma, props[largest_index].area, props[largest_index].perimeter
+    return soma, 0, 0
+
+
+def check_soma(cell_image):
+    soma, area, perimeter = measure_soma(cell_image)
+    baseline_soma, baseline_area, baseline_perimeter = baseline_measure_soma(cell_image)
+    assert np.array_equal(soma, baseline_soma)
+    assert area == baseline_area
+    assert perimeter == pytest.approx(baseline_perimeter)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_measure_soma_matches_baseline(seed):
+    for crop in random_cell_crops(seed):
+        check_soma(cv2.threshold(crop, 100, 255, cv2.THRESH_BINARY)[1])
+
+
+@pytest.mark.parametrize('width', [9, 10, 11])
+def test_soma_of_exactly_min_soma_area(width):
+    # A 5 x 10 object has exactly min_soma_area pixels and is removed before the erosion
+    cell_image = np.zeros((20, 30), dtype=np.uint8)
+    cell_image[5:10, 5:5 + width] = 255
+    check_soma(cell_image)
+    assert (measure_soma(cell_image)[1] > 0) == (width > 10)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_measure_soma_stack_matches_measure_soma(seed):
+    cell_images = [cv2.threshold(crop, 100, 255, cv2.THRESH_BINARY)[1] for crop in random_cell_crops(seed)]
+    cell_images.append(np.zeros((80, 90), dtype=np.uint8))
+    cell_images.append(np.pad(np.full((5, 10), 255, dtype=np.uint8), ((10, 65), (10, 70))))
+    somas, areas, perimeters = measure_soma_stack(np.stack(cell_images), chunk_pixels=3 * 80 * 90)
+    for cell_image, soma, area, perimeter in zip(cell_images, somas, areas, perimeters):
+        expected_soma, expected_area, expected_perimeter = measure_soma(cell_image)
+        assert np.array_equal(soma, expected_soma)
+        assert area == expected_area
+        assert perimeter == pytest.approx(expected_perimeter)
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from IndividualCellSelectandExtract import extract_cells, extract_cells_tiled
+from SyntheticMicroglia import synthetic_field
+from TiledFields import label_field, selected_strips
+from microglia import select_cells
+
+pytest.importorskip('tifffile')
+
+
+@pytest.mark.parametrize('strip_rows', [37, 100, 1000])
+def test_label_field_matches_select_cells(strip_rows):
+    # Cells of 100 rows cross the borders of strips of 37 rows
+    field = synthetic_field(num_cells=6, cell_size=100, seed=2)
+    labels, regions = select_cells(field)
+    field_labels, cell_regions = label_field(field, strip_rows=strip_rows)
+    assert [(region.label, region.bbox, region.area) for region in regions] == list(cell_regions)
+
+    selected = np.where(np.isin(labels, [region.label for region in regions]), labels, 0)
+    assert np.array_equal(np.concatenate([strip_labels for _, strip_labels in selected_strips(field, field_labels)]), selected)
+
+
+def output_folders(folder):
+    return tuple(str(folder / name) for name in ['selected', 'rectangles', 'cells', 'processed'])
+
+
+def test_tiled_outputs_match_in_memory_outputs(tmp_path):
+    image_path = str(tmp_path / 'field.tif')
+    Image.fromarray(synthetic_field(num_cells=6, cell_size=100, seed=3)).save(image_path, dpi=(300, 300))
+    for mode in ['memory', 'tiled']:
+        for folder in output_folders(tmp_path / mode):
+            os.makedirs(folder)
+    extract_cells(image_path, output_folders(tmp_path / 'memory'))
+    extract_cells_tiled(image_path, output_folders(tmp_path / 'tiled'), strip_rows=37)
+
+    num_files = 0
+    for root, _, filenames in os.walk(tmp_path / 'memory'):
+        for filename in filenames:
+            expected = Image.open(os.path.join(root, filename))
+            image = Image.open(os.path.join(root.replace('memory', 'tiled'), filename))
+            assert np.array_equal(np.array(image), np.array(expected)), filename
+            assert image.info.get('dpi') == expected.info.get('dpi'), filename
+            num_files += 1
+    assert num_files > 2 and num_files == sum(len(filenames) for _, _, filenames in os.walk(tmp_path / 'tiled'))
+    assert Image.open(str(tmp_path / 'tiled' / 'selected' / 'Selected_cells_field.tif')).info['dpi'] == (300, 300)
@@ -0,0 +1,46 @@
+import json
+import numpy as np
+import pytest
+from microglia import tracing
+
+pytestmark = pytest.mark.skipif(not tracing.reset_peak_rss(), reason='the peak RSS cannot be reset on this platform')
+
+
+def traced_records(tmp_path, run):
+    path = tmp_path / 'trace.jsonl'
+    tracing.start_tracing(str(path), new_trace=True)
+    try:
+        run()
+    finally:
+        tracing.stop_tracing()
+    return {record['stage']: record for record in map(json.loads, path.read_text().splitlines())}
+
+
+def allocate(megabytes):
+    block = np.ones(megabytes * 1024 * 1024 // 8)
+    return block.sum()
+
+
+def test_peak_rss_is_per_stage(tmp_path):
+    # A large allocation raises the peak of its own stage only, not that of a later stage
+    def run():
+        with tracing.stage('large'):
+            allocate(200)
+        with tracing.stage('small'):
+            allocate(1)
+
+    records = traced_records(tmp_path, run)
+    assert records['large']['process_peak_rss'] - records['small']['process_peak_rss'] > 150 * 1024 * 1024
+
+
+def test_enclosing_stage_keeps_the_peak_of_an_inner_stage(tmp_path):
+    def run():
+        with tracing.stage('outer'):
+            with tracing.stage('inner'):
+                allocate(200)
+            with tracing.stage('after'):
+                allocate(1)
+
+    records = traced_records(tmp_path, run)
+    assert records['outer']['process_peak_rss'] >= records['inner']['process_peak_rss']
+    assert records['inner']['process_peak_rss'] - records['after']['process_peak_rss'] > 150 * 1024 * 1024